@@ -0,0 +1,102 @@
+import asyncio
+import time
+from collections import deque
+from typing import Awaitable, Callable, List, Optional
+
+
+class OrderDigest:
+    """
+    Адаптивные уведомления админам о новых заказах.
+
+    Пока заказов меньше rate_per_min в минуту — should_batch() == False и шлём,
+    как раньше, отдельное сообщение на заказ. Выше порога заказы копятся и раз в
+    window секунд уходят одним дайджестом (flush получает список order_id).
+    Состав дайджеста хранится в settings (digest:<id>), чтобы кнопки работали после рестарта.
+    Заказы, которые ещё ждут окна, тоже лежат в settings (PENDING_KEY): после рестарта
+    resume() сразу отправляет их дайджестом.
+    """
+
+    def __init__(self, store, rate_per_min: int, window: float):
+        self.store = store
+        self.rate_per_min = rate_per_min
+        self.window = window
+        self._recent = deque()
+        self._pending: List[int] = []
+        self._timer: Optional[asyncio.Task] = None
+
+        self.single_sent = 0
+        self.digests_sent = 0
+        self.batched_orders = 0
+
+    def should_batch(self) -> bool:
+        now = time.monotonic()
+        self._recent.append(now)
+        while self._recent and self._recent[0] < now - 60:
+            self._recent.popleft()
+        # пока дайджест собирается — докладываем в него, чтобы не перемешивать режимы
+        batch = bool(self._pending) or len(self._recent) > self.rate_per_min
+        if not batch:
+            self.single_sent += 1
+        return batch
+
+    async def add(self, order_id: int, flush: Callable[[int, List[int]], Awaitable]):
+        self._pending.append(int(order_id))
+        self.batched_orders += 1
+        if self._timer is None or self._timer.done():
+            self._timer = asyncio.create_task(self._flush_later(flush, self.window))
+        await self._save_pending()
+
+    async def resume(self, flush: Callable[[int, List[int]], Awaitable]):
+        """При старте: заказы, не дождавшиеся дайджеста до рестарта, уходят сразу."""
+        raw = await self.store.get_setting(PENDING_KEY) or ""
+        ids = [int(x) for x in raw.split(",") if x.strip().isdigit()]
+        if not ids:
+            return
+        self._pending = ids + [i for i in self._pending if i not in ids]
+        if self._timer is None or self._timer.done():
+            self._timer = asyncio.create_task(self._flush_later(flush, 0))
+
+    async def _save_pending(self):
+        await self.store.set_setting(PENDING_KEY, ",".join(str(i) for i in self._pending))
+
+    async def _flush_later(self, flush, delay: float):
+        await asyncio.sleep(delay)
+        ids, self._pending = self._pending, []
+        # таймер своё отработал: заказ, пришедший во время отправки, заведёт новый
+        self._timer = None
+        if not ids:
+            return
+        digest_id = await save_digest(self.store, ids)
+        self.digests_sent += 1
+        try:
+            await flush(digest_id, ids)
+        except Exception:
+            pass
+        # в settings остаются только заказы, пришедшие во время отправки
+        await self._save_pending()
+
+    def stats(self) -> dict:
+        return {
+            "orders_last_min": len(self._recent),
+            "single_sent": self.single_sent,
+            "digests_sent": self.digests_sent,
+            "batched_orders": self.batched_orders,
+            "pending": len(self._pending),
+        }
+
+
+# ---------- хранение состава дайджеста ----------
+# не под префиксом digest: — db.prune_settings чистит только ключи digest:<id>
+PENDING_KEY = "digest_pending"
+
+
+async def save_digest(store, order_ids: List[int]) -> int:
+    # id дайджеста = первый заказ в нём; заказы в дайджестах не пересекаются
+    digest_id = int(order_ids[0])
+    await store.set_setting(f"digest:{digest_id}", ",".join(str(i) for i in order_ids))
+    return digest_id
+
+
+async def load_digest(store, digest_id: int) -> List[int]:
+    raw = await store.get_setting(f"digest:{int(digest_id)}") or ""
+    return [int(x) for x in raw.split(",") if x.strip().isdigit()]
@@ -0,0 +1,198 @@
+"""
+Онлайн-бэкап shop.db без остановки бота.
+
+Копия снимается через sqlite3 online backup API маленькими порциями страниц:
+между порциями блокировка базы отпускается (писатели не ждут), а сама копия
+идёт в отдельном потоке, так что event loop бота не блокируется.
+Снимки сжимаются gzip и ротируются (хранятся последние keep штук).
+
+База в режиме WAL (db.init_db): копия читает зафиксированную версию и не
+начинается заново после каждой записи покупателей.
+
+Копия, сжатие и удаление временных файлов идут в отдельном потоке с пониженным
+приоритетом (nice 19, Linux): на одном ядре (Render free) иначе они делят
+процессор с event loop на равных, и хендлеры заметно медленнее, пока идёт бэкап.
+
+CLI:
+    python backup.py now               # снять снимок
+    python backup.py list              # показать снимки
+    python backup.py restore <file>    # восстановить (бот должен быть остановлен!)
+"""
+import argparse
+import asyncio
+import datetime
+import gzip
+import os
+import re
+import shutil
+import sqlite3
+import threading
+from pathlib import Path
+from typing import List
+
+import db
+
+SUFFIX = ".db.gz"
+
+
+def _online_copy(src_path: Path, dst_path: Path, pages: int, pause: float):
+    src = sqlite3.connect(src_path)
+    dst = sqlite3.connect(dst_path)
+    try:
+        if src.execute("PRAGMA journal_mode").fetchone()[0] == "wal":
+            # открытая транзакция чтения фиксирует версию базы: записи других соединений уходят в WAL
+            # и не перезапускают копирование с первой страницы (в режиме delete так и было бы)
+            src.execute("BEGIN")
+            src.execute("SELECT COUNT(*) FROM sqlite_master").fetchone()
+        # pages за шаг, pause сек между шагами — в это время другие соединения могут писать
+        src.backup(dst, pages=pages, sleep=pause)
+    finally:
+        dst.close()
+        src.close()
+
+
+def _compress(src: Path, dst: Path):
+    # уровень 1: ~в 3 раза меньше процессора, чем 6, а снимок больше всего на несколько процентов
+    with open(src, "rb") as f_in, gzip.open(dst, "wb", compresslevel=1) as f_out:
+        shutil.copyfileobj(f_in, f_out, 1024 * 1024)
+
+
+def _low_priority(fn, *args) -> "asyncio.Future":
+    """
+    fn(*args) в своём потоке с nice 19. Не asyncio.to_thread: приоритет потока
+    не вернуть обратно без прав, а пул to_thread общий (aiogram зовёт в нём sync-хендлеры).
+    """
+    loop = asyncio.get_running_loop()
+    fut = loop.create_future()
+
+    def done(result, exc):
+        if fut.cancelled():
+            return
+        if exc is not None:
+            fut.set_exception(exc)
+        else:
+            fut.set_result(result)
+
+    def work():
+        try:
+            os.setpriority(os.PRIO_PROCESS, threading.get_native_id(), 19)  # в Linux — приоритет этого потока
+        except (AttributeError, OSError):
+            pass
+        try:
+            result = fn(*args)
+        except BaseException as e:
+            loop.call_soon_threadsafe(done, None, e)
+        else:
+            loop.call_soon_threadsafe(done, result, None)
+
+    threading.Thread(target=work, name="backup", daemon=True).start()
+    return fut
+
+
+def snapshots(dest_dir: Path, stem: str = None) -> List[Path]:
+    stem = stem or db.db_path().stem
+    # точное имя stem-ГГГГММДД-ЧЧММСС: по префиксу «shop-*» попали бы и снимки магазина shop-2
+    name = re.compile(re.escape(stem) + r"-\d{8}-\d{6}" + re.escape(SUFFIX))
+    return sorted(p for p in Path(dest_dir).glob(f"{stem}-*{SUFFIX}") if name.fullmatch(p.name))
+
+
+def rotate(dest_dir: Path, keep: int, stem: str = None) -> int:
+    old = snapshots(dest_dir, stem)[:-keep] if keep > 0 else []
+    for p in old:
+        p.unlink(missing_ok=True)
+    return len(old)
+
+
+def _snapshot(src: Path, part: Path, out: Path, pages: int, pause: float):
+    try:
+        _online_copy(src, part, pages, pause)
+        _compress(part, out)
+    finally:
+        part.unlink(missing_ok=True)  # удаление копии размером с базу — тоже не в event loop
+
+
+async def backup_file(src: Path, dest_dir: Path, stamp: str, pages: int, pause: float) -> Path:
+    dest_dir.mkdir(parents=True, exist_ok=True)
+    part = dest_dir / f"{src.stem}-{stamp}.db.part"
+    out = dest_dir / f"{src.stem}-{stamp}{SUFFIX}"
+    await _low_priority(_snapshot, src, part, out, pages, pause)
+    return out
+
+
+async def backup_once(dest_dir: Path, keep: int = 7, pages: int = 64, pause: float = 0.005,
+                      db_file: Path = None) -> List[Path]:
+    """
+    Снимает shop.db (или db_file — базу конкретного магазина) и архив, если есть,
+    и чистит старые снимки. Возвращает пути новых файлов.
+    """
+    dest_dir = Path(dest_dir)
+    db_file = Path(db_file or db.db_path())
+    stamp = datetime.datetime.utcnow().strftime("%Y%m%d-%H%M%S")
+    made = []
+    for src in (db_file, db.archive_path(db_file)):
+        if not src.exists():
+            continue
+        made.append(await backup_file(src, dest_dir, stamp, pages, pause))
+        await _low_priority(rotate, dest_dir, keep, src.stem)
+    return made
+
+
+def restore(snapshot: Path, target: Path = None) -> Path:
+    """
+    Разворачивает снимок поверх target (по умолчанию db.db_path()).
+    Сначала распаковывает во временный файл и проверяет integrity_check,
+    только потом атомарно подменяет базу. Запускать при остановленном боте.
+    """
+    snapshot = Path(snapshot)
+    if target is None:
+        stem = snapshot.name.rsplit("-", 2)[0]
+        target = db.archive_path() if stem == db.archive_path().stem else db.db_path()
+    target = Path(target)
+    tmp = target.with_name(target.name + ".restore")
+
+    with gzip.open(snapshot, "rb") as f_in, open(tmp, "wb") as f_out:
+        shutil.copyfileobj(f_in, f_out, 1024 * 1024)
+
+    con = sqlite3.connect(tmp)
+    try:
+        ok = con.execute("PRAGMA integrity_check").fetchone()[0]
+    finally:
+        con.close()
+    if ok != "ok":
+        tmp.unlink(missing_ok=True)
+        raise RuntimeError(f"snapshot {snapshot} is corrupted: {ok}")
+
+    # WAL старой базы применился бы к новому файлу — убираем его вместе с индексом
+    for suffix in ("-wal", "-shm"):
+        target.with_name(target.name + suffix).unlink(missing_ok=True)
+    os.replace(tmp, target)
+    return target
+
+
+def main_cli():
+    ap = argparse.ArgumentParser(description="Online backup / restore for shop.db")
+    ap.add_argument("--db", type=Path, default=Path(db.DB_PATH))
+    ap.add_argument("--dir", type=Path, default=Path(os.getenv("BACKUP_DIR", "backups")))
+    sub = ap.add_subparsers(dest="cmd", required=True)
+    p_now = sub.add_parser("now")
+    p_now.add_argument("--keep", type=int, default=int(os.getenv("BACKUP_KEEP", "7")))
+    sub.add_parser("list")
+    p_restore = sub.add_parser("restore")
+    p_restore.add_argument("snapshot", type=Path)
+    p_restore.add_argument("--target", type=Path)
+    args = ap.parse_args()
+
+    db.DB_PATH = args.db
+    if args.cmd == "now":
+        for p in asyncio.run(backup_once(args.dir, keep=args.keep)):
+            print(p)
+    elif args.cmd == "list":
+        for stem in (db.db_path().stem, db.archive_path().stem):
+            for p in snapshots(args.dir, stem):
+                print(f"{p}  {p.stat().st_size} bytes")
+    elif args.cmd == "restore":
+        print(f"restored -> {restore(args.snapshot, args.target)}")
+
+
+if __name__ == "__main__":
+    main_cli()
@@ -0,0 +1,130 @@
+"""
+Влияние онлайн-бэкапа на задержку хендлеров.
+
+На большой синтетической базе (bench_db.generate) крутим «хендлеры» —
+типичные чтения/записи db.py из event loop — сначала без бэкапа, потом во время
+backup.backup_once, и сравниваем перцентили задержки и лаг event loop.
+
+Пример:
+    python bench_backup.py --products 200000 --orders 300000
+    python bench_backup.py --reuse /tmp/big.db --json
+"""
+import argparse
+import asyncio
+import json
+import random
+import statistics
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+import backup
+import bench_db
+import db
+
+
+def pct(values, p):
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return round(values[min(len(values) - 1, int(len(values) * p))] * 1000, 3)
+
+
+def summary(lat, lag):
+    return {
+        "handlers": len(lat),
+        "latency_ms": {"mean": round(statistics.fmean(lat) * 1000, 3) if lat else 0.0,
+                       "p50": pct(lat, 0.50), "p99": pct(lat, 0.99), "max": pct(lat, 1.0)},
+        "loop_lag_ms": {"p50": pct(lag, 0.50), "p99": pct(lag, 0.99), "max": pct(lag, 1.0)},
+    }
+
+
+async def handler_load(stop: asyncio.Event, products: int, carts: int, rnd: random.Random):
+    """Имитация потока апдейтов: карточка товара, корзина, резерв/возврат — каждые ~5 мс."""
+    lat, lag = [], []
+    interval = 0.005
+    expected = time.perf_counter() + interval
+    while not stop.is_set():
+        await asyncio.sleep(interval)
+        now = time.perf_counter()
+        lag.append(max(0.0, now - expected))
+
+        uid = 1_000_000 + rnd.randrange(max(1, carts))
+        pid = rnd.randint(1, products)
+        t0 = time.perf_counter()
+        db.get_product(pid)
+        db.cart_items(uid)
+        if rnd.random() < 0.3:
+            if db.cart_add_reserve(uid, pid, 1):
+                db.cart_remove_return(uid, pid, 1)
+        lat.append(time.perf_counter() - t0)
+        expected = time.perf_counter() + interval
+    return lat, lag
+
+
+async def measure(seconds: float, products: int, carts: int, during_backup: Path = None, pages: int = 64):
+    rnd = random.Random(7)
+    stop = asyncio.Event()
+    load = asyncio.create_task(handler_load(stop, products, carts, rnd))
+    backup_s = None
+    if during_backup:
+        t0 = time.perf_counter()
+        await backup.backup_once(during_backup, keep=1, pages=pages)
+        backup_s = time.perf_counter() - t0
+    else:
+        await asyncio.sleep(seconds)
+    stop.set()
+    lat, lag = await load
+    result = summary(lat, lag)
+    if backup_s is not None:
+        result["backup_s"] = round(backup_s, 2)
+    return result
+
+
+def main_cli():
+    ap = argparse.ArgumentParser(description="Handler latency with and without online backup")
+    ap.add_argument("--products", type=int, default=200_000)
+    ap.add_argument("--carts", type=int, default=20_000)
+    ap.add_argument("--orders", type=int, default=300_000)
+    ap.add_argument("--reuse", type=Path, help="use an existing database (copy it first!)")
+    ap.add_argument("--pages", type=int, default=64, help="pages per backup step")
+    ap.add_argument("--baseline-s", type=float, default=5.0)
+    ap.add_argument("--json", action="store_true")
+    args = ap.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        tmp = Path(tmp)
+        if args.reuse:
+            db.DB_PATH = args.reuse
+            db.init_db()
+            with db.connect() as con:
+                products = con.execute("SELECT COUNT(*) FROM products").fetchone()[0]
+            carts = args.carts
+        else:
+            bench_db.generate(tmp / "bench.db", args.products, 50, args.carts, args.orders)
+            products, carts = args.products, args.carts
+        size_mb = Path(db.DB_PATH).stat().st_size / 1024 / 1024
+        print(f"database: {size_mb:.1f} MB", file=sys.stderr)
+
+        report = {
+            "db_mb": round(size_mb, 1),
+            "pages_per_step": args.pages,
+            "baseline": asyncio.run(measure(args.baseline_s, products, carts)),
+            "during_backup": asyncio.run(measure(0, products, carts, during_backup=tmp / "snap", pages=args.pages)),
+        }
+
+    if args.json:
+        print(json.dumps(report, indent=2))
+        return
+    print(f"db: {report['db_mb']} MB, backup took {report['during_backup']['backup_s']} s "
+          f"({args.pages} pages/step)")
+    for name in ("baseline", "during_backup"):
+        r = report[name]
+        print(f"{name:<14} handlers={r['handlers']:<6} latency p50={r['latency_ms']['p50']} "
+              f"p99={r['latency_ms']['p99']} max={r['latency_ms']['max']} ms | "
+              f"loop lag p99={r['loop_lag_ms']['p99']} max={r['loop_lag_ms']['max']} ms")
+
+
+if __name__ == "__main__":
+    main_cli()
@@ -0,0 +1,294 @@
+"""
+Микро-бенчмарки слоя данных (db.py) на синтетических данных магазина.
+
+Генерирует базу нужного размера (товары по категориям, активные корзины,
+история заказов с позициями) и замеряет функции db.py. Результат — JSON,
+который можно сравнить с прогоном другой ревизии (--compare).
+
+Пример:
+    python bench_db.py --preset small --out before.json
+    python bench_db.py --preset small --out after.json --compare before.json
+    python bench_db.py --products 1000000 --carts 100000 --orders 1000000 --keep /tmp/big.db
+"""
+import argparse
+import datetime
+import json
+import platform
+import random
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+import db
+
+PRESETS = {
+    "small": {"products": 10_000, "categories": 20, "carts": 5_000, "orders": 20_000},
+    "medium": {"products": 100_000, "categories": 50, "carts": 50_000, "orders": 200_000},
+    "large": {"products": 1_000_000, "categories": 200, "carts": 100_000, "orders": 1_000_000},
+}
+
+STATUSES = ["new", "accepted", "accepted", "declined", "cancelled"]
+BATCH = 50_000
+
+
+# ----------------- DATASET -----------------
+def _batched(rows, size=BATCH):
+    batch = []
+    for r in rows:
+        batch.append(r)
+        if len(batch) >= size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def generate(path: Path, products: int, categories: int, carts: int, orders: int, seed: int = 1) -> dict:
+    """
+    Заполняет пустую базу синтетикой. Пишем напрямую через executemany,
+    иначе генерация миллиона строк через db.add_product занимает вечность.
+    """
+    rnd = random.Random(seed)
+    db.DB_PATH = path
+    db.init_db()
+
+    cats = [f"Category {i:03d}" for i in range(categories)]
+    now = datetime.datetime.utcnow()
+
+    with db.connect() as con:
+        cur = con.cursor()
+
+        for batch in _batched(
+            (cats[i % categories], f"Product {i}", rnd.randint(100, 20_000), rnd.randint(0, 500), None)
+            for i in range(products)
+        ):
+            cur.executemany(
+                "INSERT INTO products(category,title,price_cents,stock,photo_file_id) VALUES(?,?,?,?,?)", batch
+            )
+        con.commit()
+
+        # активные корзины: 1–5 позиций у каждого пользователя
+        def cart_rows():
+            for i in range(carts):
+                uid = 1_000_000 + i
+                for pid in rnd.sample(range(1, products + 1), rnd.randint(1, min(5, products))):
+                    yield uid, pid, rnd.randint(1, 3)
+
+        for batch in _batched(cart_rows()):
+            cur.executemany(
+                "INSERT OR IGNORE INTO cart(user_id,product_id,qty,updated_at) VALUES(?,?,?,datetime('now'))", batch
+            )
+        con.commit()
+
+        # история заказов: заказ + 1–5 позиций; total считаем сразу,
+        # пересчёт через подзапрос по order_items без индекса на миллионе заказов не закончится
+        order_batch, item_batch = [], []
+
+        def flush():
+            cur.executemany(
+                "INSERT INTO orders(id,user_id,name,phone,address,pay_method,total_cents,created_at,status,"
+                "tg_username,tg_name) VALUES(?,?,?,?,?,?,?,?,?,?,?)",
+                order_batch,
+            )
+            cur.executemany(
+                "INSERT INTO order_items(order_id,product_id,title,price_cents,qty) VALUES(?,?,?,?,?)", item_batch
+            )
+            order_batch.clear()
+            item_batch.clear()
+
+        for oid in range(1, orders + 1):
+            uid = 2_000_000 + rnd.randint(0, max(1, orders // 5))
+            created = (now - datetime.timedelta(minutes=orders - oid)).isoformat()
+            total = 0
+            for pid in rnd.sample(range(1, products + 1), rnd.randint(1, min(5, products))):
+                price, qty = rnd.randint(100, 20_000), rnd.randint(1, 3)
+                total += price * qty
+                item_batch.append((oid, pid, f"Product {pid - 1}", price, qty))
+            order_batch.append((oid, uid, "Name", "+100", "Street", "cash", total, created,
+                                rnd.choice(STATUSES), None, None))
+            if len(item_batch) >= BATCH:
+                flush()
+        flush()
+        con.commit()
+
+    return {"products": products, "categories": categories, "carts": carts, "orders": orders, "seed": seed}
+
+
+def mark_stale_carts(count: int, minutes: int = 60):
+    with db.connect() as con:
+        con.execute(
+            "UPDATE cart SET updated_at=datetime('now', ?) WHERE user_id IN "
+            "(SELECT DISTINCT user_id FROM cart ORDER BY user_id LIMIT ?)",
+            (f"-{int(minutes)} minutes", int(count)),
+        )
+        con.commit()
+
+
+# ----------------- TIMING -----------------
+def timeit(fn, args_iter, repeat: int) -> dict:
+    samples = []
+    for _ in range(repeat):
+        args = next(args_iter)
+        t0 = time.perf_counter()
+        fn(*args)
+        samples.append(time.perf_counter() - t0)
+    samples.sort()
+    return {
+        "n": len(samples),
+        "mean_ms": round(statistics.fmean(samples) * 1000, 4),
+        "p50_ms": round(samples[len(samples) // 2] * 1000, 4),
+        "p95_ms": round(samples[min(len(samples) - 1, int(len(samples) * 0.95))] * 1000, 4),
+        "ops_per_s": round(len(samples) / sum(samples), 1) if sum(samples) else 0.0,
+    }
+
+
+def forever(make):
+    while True:
+        yield make()
+
+
+def run_benchmarks(meta: dict, repeat: int, seed: int = 2) -> dict:
+    rnd = random.Random(seed)
+    products, carts, orders = meta["products"], meta["carts"], meta["orders"]
+    cats = db.list_categories()
+    # release_cart берёт самые старые user_id (см. mark_stale_carts), create_order — с другого конца
+    with db.connect() as con:
+        order_users = [r[0] for r in con.execute(
+            "SELECT DISTINCT user_id FROM cart ORDER BY user_id DESC LIMIT ?", (repeat,)
+        )]
+
+    def rand_cart_user():
+        return 1_000_000 + rnd.randrange(max(1, carts))
+
+    def rand_pid():
+        return rnd.randint(1, products)
+
+    def rand_oid():
+        return rnd.randint(1, orders)
+
+    results = {}
+    results["list_categories"] = timeit(db.list_categories, forever(tuple), repeat)
+    results["list_products"] = timeit(db.list_products, forever(lambda: (rnd.choice(cats),)), repeat)
+    results["get_product"] = timeit(db.get_product, forever(lambda: (rand_pid(),)), repeat)
+    results["cart_items"] = timeit(db.cart_items, forever(lambda: (rand_cart_user(),)), repeat)
+    results["cart_add_reserve"] = timeit(
+        db.cart_add_reserve, forever(lambda: (rand_cart_user(), rand_pid(), 1)), repeat
+    )
+    results["cart_remove_return"] = timeit(
+        db.cart_remove_return, forever(lambda: (rand_cart_user(), rand_pid(), 1)), repeat
+    )
+
+    mark_stale_carts(repeat)
+    results["stale_cart_users"] = timeit(db.stale_cart_users, forever(lambda: (30,)), repeat)
+    stale = iter(db.stale_cart_users(30))
+    results["release_cart"] = timeit(db.release_cart, forever(lambda: (next(stale, 0),)), repeat)
+
+    # create_order съедает корзину — каждому вызову свой пользователь
+    remaining = iter(order_users or [0])
+    results["create_order"] = timeit(
+        db.create_order, forever(lambda: (next(remaining, 0), "Bench", "+1", "Street", "cash")), repeat
+    )
+
+    results["get_order"] = timeit(db.get_order, forever(lambda: (rand_oid(),)), repeat)
+    results["list_orders"] = timeit(
+        db.list_orders, forever(lambda: (rnd.choice(["new", "accepted"]), 20)), repeat
+    )
+    results["order_items_full"] = timeit(db.order_items_full, forever(lambda: (rand_oid(),)), repeat)
+
+    def delta_args():
+        oid = rand_oid()
+        items = db.order_items_full(oid)
+        pid = items[0][0] if items else rand_pid()
+        return oid, pid, rnd.choice([1, -1])
+
+    results["order_item_delta"] = timeit(db.order_item_delta, forever(delta_args), repeat)
+    return results
+
+
+# ----------------- REPORT -----------------
+def git_rev() -> str:
+    try:
+        return subprocess.check_output(["git", "rev-parse", "--short", "HEAD"], text=True).strip()
+    except Exception:
+        return "unknown"
+
+
+def compare(current: dict, baseline: dict):
+    print(f"{'function':<22}{'base p50':>12}{'now p50':>12}{'ratio':>9}")
+    base = baseline.get("results", {})
+    for name, r in current["results"].items():
+        if name not in base:
+            continue
+        b = base[name]["p50_ms"]
+        ratio = r["p50_ms"] / b if b else float("inf")
+        flag = "  <-- slower" if ratio > 1.2 else ""
+        print(f"{name:<22}{b:>12.4f}{r['p50_ms']:>12.4f}{ratio:>9.2f}{flag}")
+
+
+def main_cli():
+    ap = argparse.ArgumentParser(description="db.py micro-benchmarks on synthetic data")
+    ap.add_argument("--preset", choices=PRESETS, default="small")
+    ap.add_argument("--products", type=int)
+    ap.add_argument("--categories", type=int)
+    ap.add_argument("--carts", type=int)
+    ap.add_argument("--orders", type=int)
+    ap.add_argument("--repeat", type=int, default=200, help="calls per function")
+    ap.add_argument("--seed", type=int, default=1)
+    ap.add_argument("--keep", type=Path, help="keep the generated database at this path")
+    ap.add_argument("--reuse", type=Path, help="benchmark an already generated database (copy it first!)")
+    ap.add_argument("--out", type=Path, help="write JSON results to this file")
+    ap.add_argument("--compare", type=Path, help="baseline JSON to compare against")
+    args = ap.parse_args()
+
+    size = dict(PRESETS[args.preset])
+    for key in size:
+        if getattr(args, key) is not None:
+            size[key] = getattr(args, key)
+
+    with tempfile.TemporaryDirectory() as tmp:
+        if args.reuse:
+            db.DB_PATH = args.reuse
+            db.init_db()
+            with db.connect() as con:
+                size["products"] = con.execute("SELECT COUNT(*) FROM products").fetchone()[0]
+                size["orders"] = con.execute("SELECT COALESCE(MAX(id),0) FROM orders").fetchone()[0]
+                size["carts"] = con.execute("SELECT COUNT(DISTINCT user_id) FROM cart").fetchone()[0]
+            meta = {**size, "seed": None}
+            gen_s = 0.0
+        else:
+            path = args.keep or Path(tmp) / "bench.db"
+            if path.exists():
+                path.unlink()
+            t0 = time.perf_counter()
+            meta = generate(path, size["products"], size["categories"], size["carts"], size["orders"], args.seed)
+            gen_s = time.perf_counter() - t0
+            print(f"dataset generated in {gen_s:.1f} s: {meta}", file=sys.stderr)
+
+        results = run_benchmarks(meta, args.repeat)
+
+    report = {
+        "revision": git_rev(),
+        "python": platform.python_version(),
+        "sqlite": db.sqlite3.sqlite_version,
+        "timestamp": datetime.datetime.utcnow().isoformat(),
+        "dataset": meta,
+        "generate_s": round(gen_s, 2),
+        "repeat": args.repeat,
+        "results": results,
+    }
+
+    text = json.dumps(report, indent=2)
+    if args.out:
+        args.out.write_text(text)
+    else:
+        print(text)
+
+    if args.compare:
+        compare(report, json.loads(args.compare.read_text()))
+
+
+if __name__ == "__main__":
+    main_cli()
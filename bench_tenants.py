@@ -0,0 +1,163 @@
+"""
+Память на магазин в мульти-магазинном режиме (tenants.py).
+
+Поднимает магазины в одном процессе так же, как main() с TENANTS_FILE — свой Bot
+(фейковая сессия из loadtest.py), свой файл SQLite, свои кэши, общий dp и общий
+пул потоков SQLite, — прогоняет по несколько покупателей в каждом и меряет RSS
+процесса. Стоимость магазина — прирост RSS между шагами, делённый на число новых магазинов.
+
+Пример:
+    python bench_tenants.py                          # шаги 50, 100, 200 магазинов
+    python bench_tenants.py --shops 100 --shops 500 --users 5 --json
+"""
+import argparse
+import asyncio
+import gc
+import json
+import os
+import random
+import resource
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+os.environ.setdefault("BACKUP_INTERVAL_MIN", "0")  # снимки в бенчмарке не нужны
+
+import main  # noqa: E402
+import tenants  # noqa: E402
+from loadtest import RecordingSession, Updates, scenario_browse, scenario_cart, scenario_checkout  # noqa: E402
+from storage import create_storage  # noqa: E402
+
+CATEGORIES = ["Coffee", "Tea"]
+
+
+def rss_mb() -> float:
+    """Текущий RSS (Linux /proc), иначе пиковый из getrusage."""
+    try:
+        with open("/proc/self/status") as f:
+            for line in f:
+                if line.startswith("VmRSS:"):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+async def add_shops(first: int, count: int, root: Path, executor, per_category: int) -> list:
+    shops = []
+    for i in range(first, first + count):
+        store = create_storage(f"sqlite:///{root / f'shop{i}.db'}", executor=executor)
+        shops.append(main.make_tenant(f"shop{i}", f"{700_000 + i}:BENCH", store, {1}, "EUR"))
+
+    session = RecordingSession()  # одна фейковая сессия на всех — в бою у каждого Bot своя aiohttp-сессия
+    await asyncio.gather(*(tenants.within(t, main.start_tenant(t, session)) for t in shops))
+
+    async def seed(t):
+        for cat in CATEGORIES:
+            for n in range(per_category):
+                await t.store.add_product(cat, f"{cat} #{n}", random.randint(100, 5000), 1_000)
+        return {cat: [r[0] for r in await t.store.list_products(cat)] for cat in CATEGORIES}
+
+    for t in shops:
+        t.bench_products = await tenants.within(t, seed(t))
+    main.TENANTS.extend(shops)
+    return shops
+
+
+async def drive(shops: list, users: int) -> int:
+    """Покупатели во всех магазинах одновременно, через общий dp (маршрутизация TenantMiddleware)."""
+    done = 0
+
+    async def customer(t, uid):
+        nonlocal done
+        u = Updates(t.bot)
+        for scenario in (scenario_browse, scenario_cart, scenario_checkout):
+            for update in scenario(u, uid, t.bench_products):
+                await main.dp.feed_update(t.bot, update)
+                done += 1
+
+    await asyncio.gather(*(customer(t, 10_000 + k) for t in shops for k in range(users)))
+    for t in shops:
+        await t.cart_render.wait_idle()
+    return done
+
+
+async def check_isolation(shops: list, users: int) -> bool:
+    """В каждом магазине ровно свои заказы — апдейты не утекли в чужую базу."""
+    for t in shops:
+        orders = await t.store.list_orders("new", limit=users + 10)
+        if len(orders) != users:
+            return False
+    return True
+
+
+async def run(steps: list, users: int, per_category: int) -> dict:
+    executor = ThreadPoolExecutor(max_workers=main.TENANT_DB_THREADS, thread_name_prefix="sqlite")
+    with tempfile.TemporaryDirectory() as tmp:
+        root = Path(tmp)
+
+        # прогрев: первый магазин тянет импорты, FSM, кэши aiogram — в стоимость магазина не входит
+        warm = await add_shops(0, 1, root, executor, per_category)
+        await drive(warm, users)
+        gc.collect()
+        points = [{"shops": 1, "rss_mb": round(rss_mb(), 1), "threads": threading.active_count()}]
+
+        total_updates = 0
+        t0 = time.perf_counter()
+        for target in steps:
+            have = len(main.TENANTS)
+            if target <= have:
+                continue
+            new = await add_shops(have, target - have, root, executor, per_category)
+            total_updates += await drive(new, users)
+            gc.collect()
+            points.append({"shops": target, "rss_mb": round(rss_mb(), 1), "threads": threading.active_count()})
+        elapsed = time.perf_counter() - t0
+
+        isolated = await check_isolation(main.TENANTS[1:], users)
+
+    for prev, cur in zip(points, points[1:]):
+        cur["kb_per_shop"] = round((cur["rss_mb"] - prev["rss_mb"]) * 1024 / (cur["shops"] - prev["shops"]), 1)
+    last = points[-1]
+    return {
+        "users_per_shop": users,
+        "products_per_shop": per_category * len(CATEGORIES),
+        "points": points,
+        "kb_per_shop_overall": round((last["rss_mb"] - points[0]["rss_mb"]) * 1024 / max(1, last["shops"] - 1), 1),
+        "updates": total_updates,
+        "updates_per_s": round(total_updates / elapsed, 1) if elapsed else 0.0,
+        "isolated": isolated,
+        "dispatch": main.USER_GUARD.stats(),
+    }
+
+
+def print_report(r: dict):
+    print(f"users/shop={r['users_per_shop']} products/shop={r['products_per_shop']}")
+    print(f"{'shops':>6} {'RSS MB':>8} {'threads':>8} {'KB/shop':>8}")
+    for p in r["points"]:
+        print(f"{p['shops']:>6} {p['rss_mb']:>8} {p['threads']:>8} {p.get('kb_per_shop', ''):>8}")
+    print(f"overall: {r['kb_per_shop_overall']} KB per shop")
+    print(f"updates: {r['updates']} ({r['updates_per_s']} upd/s), shops isolated: {r['isolated']}")
+
+
+def main_cli():
+    ap = argparse.ArgumentParser(description="Memory per shop in multi-tenant mode")
+    ap.add_argument("--shops", type=int, action="append", help="measure after this many shops (repeatable)")
+    ap.add_argument("--users", type=int, default=3, help="customers per shop")
+    ap.add_argument("--products", type=int, default=10, help="products per category per shop")
+    ap.add_argument("--seed", type=int, default=1)
+    ap.add_argument("--json", action="store_true", help="print machine-readable JSON")
+    args = ap.parse_args()
+
+    random.seed(args.seed)
+    report = asyncio.run(run(sorted(args.shops or [50, 100, 200]), args.users, args.products))
+    if args.json:
+        print(json.dumps(report, indent=2))
+    else:
+        print_report(report)
+
+
+if __name__ == "__main__":
+    main_cli()
@@ -0,0 +1,143 @@
+import asyncio
+import time
+
+from aiogram import Bot
+from aiogram.exceptions import TelegramForbiddenError, TelegramRetryAfter
+
+
+class SendLimiter:
+    """
+    Общий темп массовых отправок одного бота: рассылки, «Сообщить о поступлении»,
+    уведомления после «принять / отклонить все». У каждой свой темп, но лимит Telegram
+    на бота один — вместе они не должны его превышать, иначе тормозят обычные ответы.
+    Один на магазин (у магазина свой бот): main.make_tenant.
+    """
+
+    def __init__(self, rate: float):
+        self.interval = 1.0 / rate if rate > 0 else 0.0
+        self._next_at = 0.0
+        self.waited = 0.0
+
+    async def wait(self):
+        # слот занимаем до сна — параллельные отправители встают в очередь друг за другом
+        now = time.monotonic()
+        slot = max(self._next_at, now)
+        self._next_at = slot + self.interval
+        if slot > now:
+            self.waited += slot - now
+            await asyncio.sleep(slot - now)
+
+    def hold(self, seconds: float):
+        """Flood-контроль: Telegram просит подождать — ждут все массовые отправки бота."""
+        self._next_at = max(self._next_at, time.monotonic() + seconds)
+
+    def stats(self) -> dict:
+        return {"rate": round(1.0 / self.interval, 1) if self.interval else 0.0, "waited_s": round(self.waited, 1)}
+
+
+# (store, broadcast_id) -> asyncio.Task; у каждого магазина своя база, id рассылок повторяются
+_TASKS = {}
+
+
+def start(bot: Bot, store, bid: int, rate: float, limiter: SendLimiter = None,
+          batch: int = 100, checkpoint_every: int = 20):
+    """Запускает (или продолжает после рестарта) рассылку в фоне. Повторный вызов — no-op."""
+    key = (store, bid)
+    task = _TASKS.get(key)
+    if task and not task.done():
+        return task
+    task = asyncio.create_task(run(bot, store, bid, rate, limiter, batch, checkpoint_every))
+    _TASKS[key] = task
+    task.add_done_callback(lambda t: _TASKS.pop(key, None) if _TASKS.get(key) is t else None)
+    return task
+
+
+async def resume_all(bot: Bot, store, rate: float, limiter: SendLimiter = None):
+    for row in await store.broadcast_running():
+        start(bot, store, row[0], rate, limiter)
+
+
+async def send_with_retry(bot: Bot, uid: int, text: str, limiter: SendLimiter = None, **kwargs) -> str:
+    """
+    Одно сообщение с учётом flood-контроля. Возвращает delivered / blocked / failed.
+    limiter — общий темп массовых отправок бота (SendLimiter); без него шлём сразу.
+    """
+    for _ in range(5):
+        if limiter is not None:
+            await limiter.wait()
+        try:
+            await bot.send_message(uid, text, **kwargs)
+            return "delivered"
+        except TelegramRetryAfter as e:
+            # Telegram сам говорит, сколько ждать — ждём и пробуем того же получателя
+            if limiter is not None:
+                limiter.hold(e.retry_after + 0.5)
+            await asyncio.sleep(e.retry_after + 0.5)
+        except TelegramForbiddenError:
+            return "blocked"
+        except Exception:
+            return "failed"
+    return "failed"
+
+
+async def run(bot: Bot, store, bid: int, rate: float, limiter: SendLimiter = None,
+              batch: int = 100, checkpoint_every: int = 20):
+    row = await store.broadcast_get(bid)
+    if not row:
+        return
+    _id, text, created_by, status, total, last_uid, delivered, blocked, failed = row
+    counts = {"delivered": delivered, "blocked": blocked, "failed": failed}
+
+    interval = 1.0 / rate if rate > 0 else 0.0
+    next_at = time.monotonic()
+    unsaved = 0
+
+    async def checkpoint():
+        await store.broadcast_checkpoint(bid, last_uid, counts["delivered"], counts["blocked"], counts["failed"])
+
+    while True:
+        # отмену админом видим не позже чем через пачку
+        if (await store.broadcast_get(bid))[3] != "running":
+            return
+
+        uids = await store.broadcast_recipients(bid, last_uid, batch)
+        if not uids:
+            break
+
+        for uid in uids:
+            # равномерный темп, чтобы не упираться в лимиты и оставить место обычным ответам бота
+            delay = next_at - time.monotonic()
+            if delay > 0:
+                await asyncio.sleep(delay)
+            next_at = max(next_at, time.monotonic()) + interval
+
+            counts[await send_with_retry(bot, uid, text, limiter)] += 1
+            last_uid = uid
+            unsaved += 1
+            if unsaved >= checkpoint_every:
+                await checkpoint()
+                unsaved = 0
+
+        await checkpoint()
+        unsaved = 0
+
+    await store.broadcast_finish(bid, "done")
+
+    if created_by:
+        try:
+            await bot.send_message(created_by, report_text(await store.broadcast_get(bid)))
+        except Exception:
+            pass
+
+
+def report_text(row) -> str:
+    if not row:
+        return "Рассылок ещё не было / No broadcasts yet"
+    _id, _text, _by, status, total, _last, delivered, blocked, failed = row
+    return (
+        f"📣 Broadcast #{_id}: {status}\n"
+        f"Delivered: {delivered}\n"
+        f"Blocked: {blocked}\n"
+        f"Failed: {failed}\n"
+        f"Progress: {delivered + blocked + failed}/{total}"
+    )
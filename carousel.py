@@ -0,0 +1,156 @@
+import asyncio
+import time
+from collections import OrderedDict, deque
+from typing import Dict, Optional, Set
+
+
+class CarouselCache:
+    """
+    Карусель карточек товара (◀️ / ▶️ внутри категории).
+
+    На пользователя храним окно каталога вокруг открытой карточки: строки товаров
+    (с photo_file_id) на radius позиций в обе стороны и число товаров в корзине.
+    Пока показываем карточку, в фоне подтягиваем окно вокруг неё (prefetch) —
+    следующий свайп рисуется из памяти, без запросов к базе.
+
+    Окна с товаром сбрасываются по events.stock_changed (товар вернулся на склад) и
+    events.product_changed (админ поменял склад / цену / удалил) — main() подключает
+    drop_product. Резервы других покупателей событий не шлют: такие остатки могут
+    отстать на ttl секунд, сам резерв в корзину всё равно идёт по базе.
+    """
+
+    def __init__(self, store, radius: int = 2, max_users: int = 5000, ttl: float = 60, samples: int = 2000):
+        self.store = store
+        self.radius = radius
+        self.max_users = max_users
+        self.ttl = ttl
+        self._windows: "OrderedDict[int, dict]" = OrderedDict()  # user_id -> {expires, ids, rows, cart_qty}
+        self._by_product: Dict[int, Set[int]] = {}  # product_id -> user_id, у кого товар в окне
+        self._prefetch = {}  # user_id -> asyncio.Task
+        self._ms = {"hit": deque(maxlen=samples), "miss": deque(maxlen=samples)}
+
+        self.hits = 0
+        self.misses = 0
+        self.prefetches = 0
+        self.dropped = 0
+
+    # ---------- окно ----------
+    def card(self, user_id: int, pid: int) -> Optional[tuple]:
+        """(row, prev_id, next_id, cart_qty) из памяти или None, если окна нет / товар вне окна."""
+        w = self._windows.get(user_id)
+        if w is None or w["expires"] < time.monotonic():
+            self.invalidate(user_id)
+            return None
+        ids = w["ids"]
+        if pid not in w["rows"]:
+            return None
+        i = ids.index(pid)
+        # карточка на краю окна, а не категории: соседа не знаем — идём в базу
+        if (i == 0 and not w["first"]) or (i == len(ids) - 1 and not w["last"]):
+            return None
+        prev_id = ids[i - 1] if i > 0 else None
+        next_id = ids[i + 1] if i + 1 < len(ids) else None
+        self._windows.move_to_end(user_id)
+        return w["rows"][pid], prev_id, next_id, w["cart_qty"]
+
+    def put(self, user_id: int, pid: int, rows: list, cart_qty: int):
+        ids = [r[0] for r in rows]
+        i = ids.index(pid)
+        self.invalidate(user_id)
+        for p in ids:
+            self._by_product.setdefault(p, set()).add(user_id)
+        self._windows[user_id] = {
+            "expires": time.monotonic() + self.ttl,
+            "ids": ids,
+            "rows": {r[0]: r for r in rows},
+            "cart_qty": cart_qty,
+            # окно упёрлось в начало / конец категории
+            "first": i < self.radius,
+            "last": len(ids) - 1 - i < self.radius,
+        }
+        self._windows.move_to_end(user_id)
+        while len(self._windows) > self.max_users:
+            self.invalidate(next(iter(self._windows)))
+
+    async def load(self, user_id: int, pid: int) -> Optional[tuple]:
+        """Окно из базы (промах кэша или prefetch). None — товара нет."""
+        rows = await self.store.product_window(pid, self.radius)
+        if not any(r[0] == pid for r in rows):
+            self.invalidate(user_id)
+            return None
+        items = await self.store.cart_items(user_id)
+        self.put(user_id, pid, rows, sum(i[3] for i in items) if items else 0)
+        return self.card(user_id, pid)
+
+    def prefetch(self, user_id: int, pid: int):
+        """Подтянуть окно вокруг показанной карточки, не задерживая ответ. Старый prefetch отменяется."""
+        task = self._prefetch.pop(user_id, None)
+        if task and not task.done():
+            task.cancel()
+        self.prefetches += 1
+        task = asyncio.create_task(self._prefetch_one(user_id, pid))
+        self._prefetch[user_id] = task
+        task.add_done_callback(lambda t: self._prefetch.pop(user_id, None) if self._prefetch.get(user_id) is t else None)
+
+    async def _prefetch_one(self, user_id: int, pid: int):
+        try:
+            await self.load(user_id, pid)
+        except Exception:
+            pass
+
+    # ---------- изменения из хендлеров ----------
+    def cart_added(self, user_id: int, pid: int, added: int, cart_qty: int):
+        """Товар ушёл в корзину: склад этой строки и счётчик корзины поправляем на месте."""
+        w = self._windows.get(user_id)
+        if w is None:
+            return
+        w["cart_qty"] = cart_qty
+        row = w["rows"].get(pid)
+        if row is not None:
+            w["rows"][pid] = (*row[:4], max(0, row[4] - added), *row[5:])
+
+    def invalidate(self, user_id: int):
+        w = self._windows.pop(user_id, None)
+        if w is None:
+            return
+        for p in w["ids"]:
+            users = self._by_product.get(p)
+            if users is not None:
+                users.discard(user_id)
+                if not users:
+                    del self._by_product[p]
+
+    def drop_product(self, pid: int):
+        """Товар изменился не через этого пользователя — окна с ним перечитаем из базы."""
+        for user_id in list(self._by_product.get(int(pid), ())):
+            self.invalidate(user_id)
+            self.dropped += 1
+
+    # ---------- метрики ----------
+    def record(self, hit: bool, seconds: float):
+        """Время одного свайпа: от апдейта до отредактированной карточки."""
+        if hit:
+            self.hits += 1
+        else:
+            self.misses += 1
+        self._ms["hit" if hit else "miss"].append(seconds * 1000)
+
+    async def wait_idle(self):
+        while self._prefetch:
+            await asyncio.gather(*list(self._prefetch.values()), return_exceptions=True)
+
+    def stats(self) -> dict:
+        def pct(values, p):
+            if not values:
+                return 0.0
+            values = sorted(values)
+            return round(values[min(len(values) - 1, int(len(values) * p))], 3)
+
+        out = {
+            "users": len(self._windows), "hits": self.hits, "misses": self.misses,
+            "prefetches": self.prefetches, "dropped": self.dropped,
+        }
+        for kind, values in self._ms.items():
+            out[f"swipe_ms_{kind}_p50"] = pct(values, 0.50)
+            out[f"swipe_ms_{kind}_p99"] = pct(values, 0.99)
+        return out
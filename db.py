@@ -1,16 +1,76 @@
 import sqlite3
+from contextvars import ContextVar
 from pathlib import Path
 from typing import Optional, List, Tuple
 
+import events
+
 DB_PATH = Path("shop.db")
+# Файл базы текущего магазина (tenants.py); не задан — DB_PATH
+DB_PATH_CTX: ContextVar[Optional[Path]] = ContextVar("db_path", default=None)
+
+
+def db_path() -> Path:
+    return DB_PATH_CTX.get() or Path(DB_PATH)
 
 
 def connect():
-    con = sqlite3.connect(DB_PATH)
+    con = sqlite3.connect(db_path())
     return con
 
 
+# Архив старых заказов лежит рядом: shop.db -> shop_archive.db
+ARCHIVE_STATUSES = ("accepted", "declined", "cancelled")
+ORDER_COLS = "id, user_id, name, phone, address, pay_method, total_cents, created_at, status, tg_username, tg_name"
+ITEM_COLS = "order_id, product_id, title, price_cents, qty"
+
+
+def archive_path(path: Optional[Path] = None) -> Path:
+    path = Path(path or db_path())
+    return path.with_name(path.stem + "_archive.db")
+
+
+def connect_with_archive():
+    """Соединение с подключённым (ATTACH) архивом, если он уже есть. Возвращает (con, has_archive)."""
+    con = connect()
+    path = archive_path()
+    if not path.exists():
+        return con, False
+    con.execute("ATTACH DATABASE ? AS archive", (str(path),))
+    return con, True
+
+
+def _enable_incremental_vacuum():
+    """
+    auto_vacuum=INCREMENTAL включается только на пустой базе или через VACUUM.
+    Для существующей shop.db это разовая (долгая) миграция при старте.
+    """
+    con = sqlite3.connect(db_path(), isolation_level=None)
+    try:
+        if con.execute("PRAGMA auto_vacuum").fetchone()[0] != 2:
+            con.execute("PRAGMA auto_vacuum=INCREMENTAL")
+            con.execute("VACUUM")
+    finally:
+        con.close()
+
+
+def _enable_wal():
+    """
+    WAL: чтение не блокирует запись. Нужен бэкапу (backup.py): он держит снимок базы
+    открытой транзакцией чтения, и копия не начинается заново после каждой записи покупателей.
+    Режим хранится в самом файле — достаточно один раз при старте.
+    """
+    con = sqlite3.connect(db_path(), isolation_level=None)
+    try:
+        con.execute("PRAGMA journal_mode=WAL").fetchone()
+    finally:
+        con.close()
+
+
 def init_db():
+    _enable_incremental_vacuum()
+    _enable_wal()
+
     with connect() as con:
         cur = con.cursor()
 
@@ -63,6 +123,71 @@ def init_db():
         )
         """)
 
+        # Рассылки: получатели фиксируются при старте, прогресс — в broadcasts.last_user_id
+        cur.execute("""
+        CREATE TABLE IF NOT EXISTS broadcasts(
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            text TEXT NOT NULL,
+            created_by INTEGER,
+            status TEXT NOT NULL DEFAULT 'running',
+            total INTEGER NOT NULL DEFAULT 0,
+            last_user_id INTEGER NOT NULL DEFAULT 0,
+            delivered INTEGER NOT NULL DEFAULT 0,
+            blocked INTEGER NOT NULL DEFAULT 0,
+            failed INTEGER NOT NULL DEFAULT 0,
+            created_at TEXT NOT NULL
+        )
+        """)
+
+        cur.execute("""
+        CREATE TABLE IF NOT EXISTS broadcast_recipients(
+            broadcast_id INTEGER NOT NULL,
+            user_id INTEGER NOT NULL,
+            PRIMARY KEY(broadcast_id, user_id)
+        ) WITHOUT ROWID
+        """)
+
+        # Подписки «сообщить о поступлении»: удаляются после уведомления
+        cur.execute("""
+        CREATE TABLE IF NOT EXISTS stock_subs(
+            product_id INTEGER NOT NULL,
+            user_id INTEGER NOT NULL,
+            created_at TEXT NOT NULL,
+            PRIMARY KEY(product_id, user_id)
+        ) WITHOUT ROWID
+        """)
+
+        # Журнал движений склада: только INSERT, stock всегда = последний снимок + движения после него
+        cur.execute("""
+        CREATE TABLE IF NOT EXISTS stock_moves(
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            product_id INTEGER NOT NULL,
+            delta INTEGER NOT NULL,
+            reason TEXT NOT NULL,
+            user_id INTEGER,
+            order_id INTEGER,
+            created_at TEXT NOT NULL DEFAULT (datetime('now'))
+        )
+        """)
+        cur.execute("CREATE INDEX IF NOT EXISTS idx_stock_moves_product ON stock_moves(product_id, id)")
+
+        # Снимки склада по журналу: остаток каждого товара на момент last_move_id
+        cur.execute("""
+        CREATE TABLE IF NOT EXISTS stock_snapshots(
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            last_move_id INTEGER NOT NULL,
+            created_at TEXT NOT NULL
+        )
+        """)
+        cur.execute("""
+        CREATE TABLE IF NOT EXISTS stock_snapshot_items(
+            snapshot_id INTEGER NOT NULL,
+            product_id INTEGER NOT NULL,
+            stock INTEGER NOT NULL,
+            PRIMARY KEY(snapshot_id, product_id)
+        ) WITHOUT ROWID
+        """)
+
         # Миграции (добавляем новые колонки, если их ещё нет)
         def add_col(table: str, coldef: str):
             try:
@@ -80,16 +205,31 @@ def init_db():
         # Заполним пустые значения, если колонка появилась
         cur.execute("UPDATE cart SET updated_at = COALESCE(updated_at, datetime('now'))")
 
+        # «Мои заказы»: keyset по (user_id, id) и позиции пачкой по order_id
+        cur.execute("CREATE INDEX IF NOT EXISTS idx_orders_user ON orders(user_id, id)")
+        cur.execute("CREATE INDEX IF NOT EXISTS idx_order_items_order ON order_items(order_id)")
+        # Каталог и карусель: товары категории по id
+        cur.execute("CREATE INDEX IF NOT EXISTS idx_products_category ON products(category, id)")
+
+        # Журнал появился на живой базе — текущие остатки становятся начальными движениями
+        cur.execute("""
+            INSERT INTO stock_moves(product_id, delta, reason)
+            SELECT id, stock, 'opening' FROM products
+            WHERE stock != 0 AND NOT EXISTS (SELECT 1 FROM stock_moves)
+        """)
+
         con.commit()
 
 
 # ---------- Products ----------
 def add_product(category, title, price_cents, stock, photo_file_id=None):
     with connect() as con:
-        con.execute(
+        cur = con.cursor()
+        cur.execute(
             "INSERT INTO products(category,title,price_cents,stock,photo_file_id) VALUES(?,?,?,?,?)",
             (category, title, price_cents, stock, photo_file_id),
         )
+        _log_moves(cur, [(cur.lastrowid, int(stock))], "added")
         con.commit()
 
 
@@ -115,6 +255,75 @@ def get_product(pid):
         ).fetchone()
 
 
+def product_window(pid, radius):
+    """
+    Карточка товара и до radius соседей с каждой стороны в порядке каталога (id DESC) —
+    для карусели. Пусто, если товара нет.
+    """
+    with connect() as con:
+        return con.execute("""
+            SELECT id, category, title, price_cents, stock, photo_file_id FROM (
+                SELECT * FROM products WHERE category=(SELECT category FROM products WHERE id=?) AND id>?
+                ORDER BY id LIMIT ?)
+            UNION ALL
+            SELECT id, category, title, price_cents, stock, photo_file_id FROM products WHERE id=?
+            UNION ALL
+            SELECT id, category, title, price_cents, stock, photo_file_id FROM (
+                SELECT * FROM products WHERE category=(SELECT category FROM products WHERE id=?) AND id<?
+                ORDER BY id DESC LIMIT ?)
+            ORDER BY id DESC
+        """, (pid, pid, radius, pid, pid, pid, radius)).fetchall()
+
+
+# ---------- Stock ledger / events ----------
+# stock_moves.reason: opening / added / reserve / cart_return / cart_expired /
+# order_restock / order_edit / admin_set / admin_delta / deleted
+
+
+def _log_moves(cur, moves, reason: str, user_id: Optional[int] = None, order_id: Optional[int] = None):
+    """
+    Пишет движения склада одной пачкой (executemany) в ту же транзакцию, что и UPDATE stock.
+    moves = [(product_id, delta)] или [(product_id, delta, order_id)].
+    """
+    rows = []
+    for pid, delta, *ref in moves:
+        if int(delta):
+            rows.append((int(pid), int(delta), reason, user_id, ref[0] if ref else order_id))
+    if rows:
+        cur.executemany(
+            "INSERT INTO stock_moves(product_id, delta, reason, user_id, order_id) VALUES(?,?,?,?,?)",
+            rows,
+        )
+
+
+def _stock_return(cur, deltas, reason: str, user_id: Optional[int] = None,
+                  order_id: Optional[int] = None) -> List[Tuple[int, int, int]]:
+    """
+    Возвращает товар на склад: deltas = [(product_id, qty)] или [(product_id, qty, order_id)].
+    Движения пишет в журнал (только по существующим товарам).
+    Отдаёт [(product_id, old_stock, new_stock)] для events.stock_changed — слать после commit.
+    """
+    total = {}
+    for pid, qty, *_ref in deltas:
+        if int(qty) > 0:
+            total[int(pid)] = total.get(int(pid), 0) + int(qty)
+    changes = []
+    for pid, qty in total.items():
+        cur.execute("UPDATE products SET stock = stock + ? WHERE id=?", (qty, pid))
+        row = cur.execute("SELECT stock FROM products WHERE id=?", (pid,)).fetchone()
+        if row:
+            changes.append((pid, int(row[0]) - qty, int(row[0])))
+    known = {pid for pid, _old, _new in changes}
+    _log_moves(cur, [d for d in deltas if int(d[0]) in known and int(d[1]) > 0], reason, user_id, order_id)
+    return changes
+
+
+def _emit_stock(changes):
+    for pid, old, new in changes:
+        if new > old:
+            events.stock_changed.emit(pid, old, new)
+
+
 # ---------- Cart ----------
 def cart_items(user_id):
     with connect() as con:
@@ -149,6 +358,7 @@ def cart_add_reserve(user_id: int, pid: int, qty: int) -> int:
 
         # уменьшаем склад
         cur.execute("UPDATE products SET stock = stock - ? WHERE id=?", (add_qty, pid))
+        _log_moves(cur, [(pid, -add_qty)], "reserve", user_id)
 
         # upsert корзины
         cur.execute("SELECT qty FROM cart WHERE user_id=? AND product_id=?", (user_id, pid))
@@ -194,11 +404,12 @@ def cart_remove_return(user_id: int, pid: int, qty: int) -> int:
             )
 
         # вернуть на склад
-        cur.execute("UPDATE products SET stock = stock + ? WHERE id=?", (rem, pid))
+        changes = _stock_return(cur, [(pid, rem)], "cart_return", user_id)
 
         cart_touch(cur, user_id)
         con.commit()
-        return rem
+    _emit_stock(changes)
+    return rem
 
 
 def cart_clear_return(user_id: int):
@@ -208,10 +419,10 @@ def cart_clear_return(user_id: int):
     with connect() as con:
         cur = con.cursor()
         rows = cur.execute("SELECT product_id, qty FROM cart WHERE user_id=?", (user_id,)).fetchall()
-        for pid, qty in rows:
-            cur.execute("UPDATE products SET stock = stock + ? WHERE id=?", (int(qty), int(pid)))
+        changes = _stock_return(cur, rows, "cart_return", user_id)
         cur.execute("DELETE FROM cart WHERE user_id=?", (user_id,))
         con.commit()
+    _emit_stock(changes)
 
 
 # --- Таймер корзины ---
@@ -235,10 +446,10 @@ def release_cart(user_id: int):
     with connect() as con:
         cur = con.cursor()
         rows = cur.execute("SELECT product_id, qty FROM cart WHERE user_id=?", (user_id,)).fetchall()
-        for pid, qty in rows:
-            cur.execute("UPDATE products SET stock = stock + ? WHERE id=?", (int(qty), int(pid)))
+        changes = _stock_return(cur, rows, "cart_expired", user_id)
         cur.execute("DELETE FROM cart WHERE user_id=?", (user_id,))
         con.commit()
+    _emit_stock(changes)
 
 
 # ---------- Orders ----------
@@ -277,12 +488,18 @@ def create_order(user_id, name, phone, address, pay_method, tg_username=None, tg
 
 
 def get_order(order_id: int):
+    sql = (
+        "SELECT id, user_id, status, tg_username, tg_name, name, phone, address, pay_method, total_cents "
+        "FROM {t}orders WHERE id=?"
+    )
     with connect() as con:
-        return con.execute(
-            "SELECT id, user_id, status, tg_username, tg_name, name, phone, address, pay_method, total_cents "
-            "FROM orders WHERE id=?",
-            (order_id,),
-        ).fetchone()
+        row = con.execute(sql.format(t=""), (order_id,)).fetchone()
+    if row or not archive_path().exists():
+        return row
+
+    con, _ = connect_with_archive()
+    with con:
+        return con.execute(sql.format(t="archive."), (order_id,)).fetchone()
 
 
 def set_order_status(order_id: int, status: str):
@@ -291,6 +508,53 @@ def set_order_status(order_id: int, status: str):
         con.commit()
 
 
+def orders_brief(order_ids: List[int]):
+    """Краткие строки для дайджеста одним запросом: id, status, name, tg_username, total_cents"""
+    if not order_ids:
+        return []
+    marks = ",".join("?" * len(order_ids))
+    with connect() as con:
+        return con.execute(
+            f"SELECT id, status, name, tg_username, total_cents FROM orders WHERE id IN ({marks}) ORDER BY id",
+            [int(i) for i in order_ids],
+        ).fetchall()
+
+
+def set_orders_status_bulk(order_ids: List[int], status: str, restock: bool = False):
+    """
+    Массово меняет статус заказов, которые ещё 'new', в одной транзакции.
+    restock=True — заодно возвращает их товары на склад (отклонение).
+    Возвращает [(order_id, user_id)] реально изменённых заказов.
+    """
+    if not order_ids:
+        return []
+    with connect() as con:
+        cur = con.cursor()
+        marks = ",".join("?" * len(order_ids))
+        changed = cur.execute(
+            f"SELECT id, user_id FROM orders WHERE id IN ({marks}) AND status='new'",
+            [int(i) for i in order_ids],
+        ).fetchall()
+        if not changed:
+            return []
+
+        ids = [int(r[0]) for r in changed]
+        marks = ",".join("?" * len(ids))
+        cur.execute(f"UPDATE orders SET status=? WHERE id IN ({marks})", [status, *ids])
+
+        changes = []
+        if restock:
+            rows = cur.execute(
+                f"SELECT product_id, qty, order_id FROM order_items WHERE order_id IN ({marks})",
+                ids,
+            ).fetchall()
+            changes = _stock_return(cur, rows, "order_restock")
+
+        con.commit()
+    _emit_stock(changes)
+    return [(int(oid), int(uid)) for oid, uid in changed]
+
+
 def restock_order(order_id: int):
     """
     Возвращает товары заказа обратно на склад (используем при отклонении).
@@ -298,9 +562,9 @@ def restock_order(order_id: int):
     with connect() as con:
         cur = con.cursor()
         rows = cur.execute("SELECT product_id, qty FROM order_items WHERE order_id=?", (order_id,)).fetchall()
-        for pid, qty in rows:
-            cur.execute("UPDATE products SET stock = stock + ? WHERE id=?", (int(qty), int(pid)))
+        changes = _stock_return(cur, rows, "order_restock", order_id=int(order_id))
         con.commit()
+    _emit_stock(changes)
 
 
 # ---------- Settings ----------
@@ -322,34 +586,92 @@ def get_setting(key: str) -> Optional[str]:
 
 def list_orders(status: str = "new", limit: int = 20):
     """
-    Возвращает последние заказы по статусу.
+    Возвращает последние заказы по статусу (включая архив).
     Поля: id, user_id, status, tg_username, tg_name, name, phone, address, pay_method, total_cents, created_at
     """
+    sql = """
+        SELECT id, user_id, status, tg_username, tg_name, name, phone, address, pay_method, total_cents, created_at
+        FROM {t}orders
+        WHERE status=?
+        ORDER BY id DESC
+        LIMIT ?
+    """
     with connect() as con:
-        return con.execute(
-            """
-            SELECT id, user_id, status, tg_username, tg_name, name, phone, address, pay_method, total_cents, created_at
-            FROM orders
-            WHERE status=?
-            ORDER BY id DESC
-            LIMIT ?
-            """,
-            (status, int(limit)),
-        ).fetchall()
+        rows = con.execute(sql.format(t=""), (status, int(limit))).fetchall()
+
+    # в архиве только завершённые заказы, и они всегда старше горячих
+    if len(rows) >= int(limit) or status not in ARCHIVE_STATUSES or not archive_path().exists():
+        return rows
+
+    con, _ = connect_with_archive()
+    with con:
+        return rows + con.execute(sql.format(t="archive."), (status, int(limit) - len(rows))).fetchall()
 
 
 def order_items_full(order_id: int):
-    """Возвращает items заказа: product_id, title, price_cents, qty"""
+    """Возвращает items заказа: product_id, title, price_cents, qty (ищет и в архиве)"""
+    sql = """
+        SELECT product_id, title, price_cents, qty
+        FROM {t}order_items
+        WHERE order_id=?
+        ORDER BY title
+    """
     with connect() as con:
-        return con.execute(
-            """
-            SELECT product_id, title, price_cents, qty
-            FROM order_items
-            WHERE order_id=?
-            ORDER BY title
-            """,
-            (int(order_id),),
-        ).fetchall()
+        rows = con.execute(sql.format(t=""), (int(order_id),)).fetchall()
+    if rows or not archive_path().exists():
+        return rows
+
+    con, _ = connect_with_archive()
+    with con:
+        return con.execute(sql.format(t="archive."), (int(order_id),)).fetchall()
+
+
+def user_orders_page(user_id: int, before_id: Optional[int] = None, limit: int = 5):
+    """
+    Страница заказов покупателя, новые сверху (keyset: id < before_id, индекс orders(user_id, id)).
+    Поля: id, status, total_cents, created_at. Горячие и архивные заказы сливаются по id:
+    старый заказ в статусе new остаётся в горячей базе, а более новые завершённые уже в архиве.
+    """
+    sql = """
+        SELECT id, status, total_cents, created_at
+        FROM {t}orders
+        WHERE user_id=? AND id<?
+        ORDER BY id DESC
+        LIMIT ?
+    """
+    before = int(before_id) if before_id else 2 ** 62
+    with connect() as con:
+        rows = con.execute(sql.format(t=""), (int(user_id), before, int(limit))).fetchall()
+    if not archive_path().exists():
+        return rows
+
+    con, _ = connect_with_archive()
+    with con:
+        rows += con.execute(sql.format(t="archive."), (int(user_id), before, int(limit))).fetchall()
+    rows.sort(key=lambda r: r[0], reverse=True)
+    return rows[:int(limit)]
+
+
+def order_items_batch(order_ids: List[int]):
+    """Позиции сразу нескольких заказов одним запросом: order_id, product_id, title, price_cents, qty"""
+    if not order_ids:
+        return []
+    ids = [int(i) for i in order_ids]
+    sql = (
+        "SELECT order_id, product_id, title, price_cents, qty FROM {t}order_items "
+        "WHERE order_id IN ({m}) ORDER BY order_id DESC, title"
+    )
+    with connect() as con:
+        rows = con.execute(sql.format(t="", m=",".join("?" * len(ids))), ids).fetchall()
+
+    missing = set(ids) - {int(r[0]) for r in rows}
+    if not missing or not archive_path().exists():
+        return rows
+    missing = sorted(missing)
+    con, _ = connect_with_archive()
+    with con:
+        rows += con.execute(sql.format(t="archive.", m=",".join("?" * len(missing))), missing).fetchall()
+    return rows
 
 
 def recalc_order_total(order_id: int):
@@ -373,6 +695,7 @@ def order_item_delta(order_id: int, product_id: int, delta: int):
     Если qty станет 0 — позиция удаляется.
     Возвращает (ok: bool, new_qty: int, new_total: int, reason: str)
     """
+    changes = []
     with connect() as con:
         cur = con.cursor()
 
@@ -397,6 +720,7 @@ def order_item_delta(order_id: int, product_id: int, delta: int):
                 return (False, qty, recalc_order_total(order_id), "no_stock")
 
             cur.execute("UPDATE products SET stock = stock - ? WHERE id=?", (int(delta), int(product_id)))
+            _log_moves(cur, [(product_id, -int(delta))], "order_edit", order_id=int(order_id))
             new_qty = qty + int(delta)
             cur.execute(
                 "UPDATE order_items SET qty=? WHERE order_id=? AND product_id=?",
@@ -408,7 +732,7 @@ def order_item_delta(order_id: int, product_id: int, delta: int):
             delta_abs = abs(int(delta))
             real = min(delta_abs, qty)
             new_qty = qty - real
-            cur.execute("UPDATE products SET stock = stock + ? WHERE id=?", (real, int(product_id)))
+            changes = _stock_return(cur, [(product_id, real)], "order_edit", order_id=int(order_id))
 
             if new_qty <= 0:
                 cur.execute("DELETE FROM order_items WHERE order_id=? AND product_id=?", (int(order_id), int(product_id)))
@@ -419,8 +743,9 @@ def order_item_delta(order_id: int, product_id: int, delta: int):
                 )
 
         con.commit()
-        new_total = recalc_order_total(order_id)
-        return (True, new_qty, new_total, "ok")
+    _emit_stock(changes)
+    new_total = recalc_order_total(order_id)
+    return (True, new_qty, new_total, "ok")
 
 
 def cancel_order(order_id: int):
@@ -446,15 +771,22 @@ def products_by_category(category: str):
         ).fetchall()
 
 
-def product_set_stock(pid: int, stock: int) -> int:
+def product_set_stock(pid: int, stock: int, user_id: Optional[int] = None) -> int:
     stock = max(0, int(stock))
     with connect() as con:
-        con.execute("UPDATE products SET stock=? WHERE id=?", (stock, int(pid)))
+        cur = con.cursor()
+        row = cur.execute("SELECT stock FROM products WHERE id=?", (int(pid),)).fetchone()
+        cur.execute("UPDATE products SET stock=? WHERE id=?", (stock, int(pid)))
+        if row:
+            _log_moves(cur, [(pid, stock - int(row[0]))], "admin_set", user_id)
         con.commit()
+    if row:
+        _emit_stock([(int(pid), int(row[0]), stock)])
+        events.product_changed.emit(int(pid))
     return stock
 
 
-def product_stock_delta(pid: int, delta: int) -> int:
+def product_stock_delta(pid: int, delta: int, user_id: Optional[int] = None) -> int:
     with connect() as con:
         cur = con.cursor()
         row = cur.execute("SELECT stock FROM products WHERE id=?", (int(pid),)).fetchone()
@@ -462,8 +794,11 @@ def product_stock_delta(pid: int, delta: int) -> int:
             return -1
         new_stock = max(0, int(row[0]) + int(delta))
         cur.execute("UPDATE products SET stock=? WHERE id=?", (new_stock, int(pid)))
+        _log_moves(cur, [(pid, new_stock - int(row[0]))], "admin_delta", user_id)
         con.commit()
-        return new_stock
+    _emit_stock([(int(pid), int(row[0]), new_stock)])
+    events.product_changed.emit(int(pid))
+    return new_stock
 
 
 def product_set_price(pid: int, price_cents: int) -> int:
@@ -471,12 +806,335 @@ def product_set_price(pid: int, price_cents: int) -> int:
     with connect() as con:
         con.execute("UPDATE products SET price_cents=? WHERE id=?", (price_cents, int(pid)))
         con.commit()
+    events.product_changed.emit(int(pid))
     return price_cents
 
 
 def product_delete(pid: int) -> bool:
     with connect() as con:
+        row = con.execute("SELECT stock FROM products WHERE id=?", (int(pid),)).fetchone()
+        if row:
+            _log_moves(con, [(pid, -int(row[0]))], "deleted")
         con.execute("DELETE FROM products WHERE id=?", (int(pid),))
         con.execute("DELETE FROM cart WHERE product_id=?", (int(pid),))  # на всякий случай
+        con.execute("DELETE FROM stock_subs WHERE product_id=?", (int(pid),))
         con.commit()
+    events.product_changed.emit(int(pid))
     return True
+
+
+# ---------- Broadcasts ----------
+BROADCAST_FIELDS = "id, text, created_by, status, total, last_user_id, delivered, blocked, failed"
+
+
+def broadcast_create(text: str, created_by: int):
+    """
+    Создаёт рассылку и одним INSERT ... SELECT фиксирует список получателей
+    (все, кто выбирал язык, делал заказ или держит корзину) — в память не грузим.
+    Возвращает (broadcast_id, total) или None, если уже идёт другая рассылка.
+    """
+    import datetime
+
+    with connect() as con:
+        cur = con.cursor()
+        if cur.execute("SELECT 1 FROM broadcasts WHERE status='running'").fetchone():
+            return None
+
+        cur.execute(
+            "INSERT INTO broadcasts(text, created_by, status, created_at) VALUES(?,?,'running',?)",
+            (text, created_by, datetime.datetime.utcnow().isoformat()),
+        )
+        bid = cur.lastrowid
+        cur.execute("""
+            INSERT OR IGNORE INTO broadcast_recipients(broadcast_id, user_id)
+            SELECT ?, uid FROM (
+                SELECT CAST(substr(key, 6) AS INTEGER) AS uid FROM settings WHERE key LIKE 'lang:%'
+                UNION SELECT user_id FROM orders
+                UNION SELECT user_id FROM cart
+            ) WHERE uid > 0
+        """, (bid,))
+        total = cur.rowcount
+        cur.execute("UPDATE broadcasts SET total=? WHERE id=?", (total, bid))
+        con.commit()
+        return bid, total
+
+
+def broadcast_get(bid: int):
+    with connect() as con:
+        return con.execute(f"SELECT {BROADCAST_FIELDS} FROM broadcasts WHERE id=?", (int(bid),)).fetchone()
+
+
+def broadcast_running():
+    with connect() as con:
+        return con.execute(
+            f"SELECT {BROADCAST_FIELDS} FROM broadcasts WHERE status='running' ORDER BY id"
+        ).fetchall()
+
+
+def broadcast_last():
+    with connect() as con:
+        return con.execute(f"SELECT {BROADCAST_FIELDS} FROM broadcasts ORDER BY id DESC LIMIT 1").fetchone()
+
+
+def broadcast_recipients(bid: int, after_user_id: int, limit: int = 100) -> List[int]:
+    """Следующая пачка получателей после чекпоинта (keyset по первичному ключу)."""
+    with connect() as con:
+        rows = con.execute(
+            "SELECT user_id FROM broadcast_recipients WHERE broadcast_id=? AND user_id>? ORDER BY user_id LIMIT ?",
+            (int(bid), int(after_user_id), int(limit)),
+        ).fetchall()
+        return [int(r[0]) for r in rows]
+
+
+def broadcast_checkpoint(bid: int, last_user_id: int, delivered: int, blocked: int, failed: int):
+    with connect() as con:
+        con.execute(
+            "UPDATE broadcasts SET last_user_id=?, delivered=?, blocked=?, failed=? WHERE id=?",
+            (int(last_user_id), int(delivered), int(blocked), int(failed), int(bid)),
+        )
+        con.commit()
+
+
+def broadcast_finish(bid: int, status: str = "done"):
+    """status: done / cancelled. Список получателей больше не нужен — удаляем."""
+    with connect() as con:
+        con.execute("UPDATE broadcasts SET status=? WHERE id=?", (status, int(bid)))
+        con.execute("DELETE FROM broadcast_recipients WHERE broadcast_id=?", (int(bid),))
+        con.commit()
+
+
+# ---------- Stock subscriptions ----------
+def stock_subscribe(pid: int, user_id: int) -> bool:
+    """Подписка «сообщить о поступлении». False — уже подписан."""
+    import datetime
+
+    with connect() as con:
+        cur = con.execute(
+            "INSERT OR IGNORE INTO stock_subs(product_id, user_id, created_at) VALUES(?,?,?)",
+            (int(pid), int(user_id), datetime.datetime.utcnow().isoformat()),
+        )
+        con.commit()
+        return cur.rowcount > 0
+
+
+def stock_subscribers(pid: int, after_user_id: int = 0, limit: int = 100) -> List[int]:
+    """Следующая пачка подписчиков товара (keyset по первичному ключу)."""
+    with connect() as con:
+        rows = con.execute(
+            "SELECT user_id FROM stock_subs WHERE product_id=? AND user_id>? ORDER BY user_id LIMIT ?",
+            (int(pid), int(after_user_id), int(limit)),
+        ).fetchall()
+        return [int(r[0]) for r in rows]
+
+
+def stock_unsubscribe(pid: int, user_ids: List[int]):
+    if not user_ids:
+        return
+    with connect() as con:
+        con.executemany(
+            "DELETE FROM stock_subs WHERE product_id=? AND user_id=?",
+            [(int(pid), int(u)) for u in user_ids],
+        )
+        con.commit()
+
+
+# ---------- Stock ledger ----------
+# Остаток по журналу = остатки последнего снимка + движения после его last_move_id
+_LEDGER_SINCE_SNAPSHOT = """
+    SELECT product_id, SUM(q) AS q FROM (
+        SELECT product_id, stock AS q FROM stock_snapshot_items WHERE snapshot_id=?
+        UNION ALL
+        SELECT product_id, delta FROM stock_moves WHERE id > ? AND id <= ?
+    ) GROUP BY product_id
+"""
+
+
+def _last_snapshot(cur, before: str = "9999"):
+    """(snapshot_id, last_move_id) последнего снимка не позже before или (0, 0)."""
+    row = cur.execute(
+        "SELECT id, last_move_id FROM stock_snapshots WHERE created_at <= ? ORDER BY id DESC LIMIT 1",
+        (before,),
+    ).fetchone()
+    return (int(row[0]), int(row[1])) if row else (0, 0)
+
+
+def stock_snapshot() -> Optional[int]:
+    """
+    Снимок остатков по журналу: предыдущий снимок + движения после него, O(движений с прошлого снимка).
+    Считается по журналу, а не по products.stock — иначе снимок спрятал бы расхождение.
+    Возвращает id снимка или None, если движений с прошлого снимка не было.
+    """
+    import datetime
+
+    with connect() as con:
+        cur = con.cursor()
+        prev_id, prev_last = _last_snapshot(cur)
+        last = int(cur.execute("SELECT COALESCE(MAX(id), 0) FROM stock_moves").fetchone()[0])
+        if prev_id and last == prev_last:
+            return None
+        cur.execute(
+            "INSERT INTO stock_snapshots(last_move_id, created_at) VALUES(?,?)",
+            (last, datetime.datetime.utcnow().strftime("%Y-%m-%d %H:%M:%S")),
+        )
+        sid = cur.lastrowid
+        cur.execute(
+            f"INSERT INTO stock_snapshot_items(snapshot_id, product_id, stock) "
+            f"SELECT ?, product_id, q FROM ({_LEDGER_SINCE_SNAPSHOT})",
+            (sid, prev_id, prev_last, last),
+        )
+        con.commit()
+        return sid
+
+
+def stock_at(pid: int, at: Optional[str] = None) -> int:
+    """
+    Остаток товара на момент at ('YYYY-MM-DD HH:MM:SS', UTC; None — сейчас) по журналу:
+    ближайший снимок не позже at + движения товара после него.
+    """
+    at = at or "9999"
+    with connect() as con:
+        cur = con.cursor()
+        sid, last = _last_snapshot(cur, at)
+        base = cur.execute(
+            "SELECT stock FROM stock_snapshot_items WHERE snapshot_id=? AND product_id=?", (sid, int(pid)),
+        ).fetchone()
+        since = cur.execute(
+            "SELECT COALESCE(SUM(delta), 0) FROM stock_moves WHERE product_id=? AND id>? AND created_at<=?",
+            (int(pid), last, at),
+        ).fetchone()[0]
+        return (int(base[0]) if base else 0) + int(since)
+
+
+def stock_moves(pid: int, before_id: Optional[int] = None, limit: int = 50):
+    """Движения товара, новые сверху (keyset по id): id, delta, reason, user_id, order_id, created_at."""
+    with connect() as con:
+        return con.execute(
+            "SELECT id, delta, reason, user_id, order_id, created_at FROM stock_moves "
+            "WHERE product_id=? AND id<? ORDER BY id DESC LIMIT ?",
+            (int(pid), int(before_id) if before_id else 2 ** 62, int(limit)),
+        ).fetchall()
+
+
+def stock_reconcile():
+    """
+    Сверка склада с журналом. Возвращает расхождения [(product_id, title, stock, ledger_stock)];
+    title/stock = None, если товара уже нет, а по журналу он ещё числится.
+    """
+    with connect() as con:
+        cur = con.cursor()
+        sid, last = _last_snapshot(cur)
+        top = int(cur.execute("SELECT COALESCE(MAX(id), 0) FROM stock_moves").fetchone()[0])
+        ledger = dict(cur.execute(_LEDGER_SINCE_SNAPSHOT, (sid, last, top)).fetchall())
+        out = []
+        for pid, title, stock in cur.execute("SELECT id, title, stock FROM products ORDER BY id"):
+            expected = int(ledger.pop(pid, 0))
+            if int(stock) != expected:
+                out.append((int(pid), title, int(stock), expected))
+        out += [(int(pid), None, None, int(q)) for pid, q in sorted(ledger.items()) if int(q) != 0]
+        return out
+
+
+# ---------- Retention / archive ----------
+def _ensure_archive_schema(cur):
+    cur.execute("""
+    CREATE TABLE IF NOT EXISTS archive.orders(
+        id INTEGER PRIMARY KEY,
+        user_id INTEGER NOT NULL,
+        name TEXT,
+        phone TEXT,
+        address TEXT,
+        pay_method TEXT,
+        total_cents INTEGER NOT NULL,
+        created_at TEXT NOT NULL,
+        status TEXT,
+        tg_username TEXT,
+        tg_name TEXT
+    )
+    """)
+    cur.execute("""
+    CREATE TABLE IF NOT EXISTS archive.order_items(
+        order_id INTEGER NOT NULL,
+        product_id INTEGER NOT NULL,
+        title TEXT NOT NULL,
+        price_cents INTEGER NOT NULL,
+        qty INTEGER NOT NULL
+    )
+    """)
+    cur.execute("CREATE INDEX IF NOT EXISTS archive.idx_archive_items_order ON order_items(order_id)")
+    cur.execute("CREATE INDEX IF NOT EXISTS archive.idx_archive_orders_status ON orders(status, id)")
+    cur.execute("CREATE INDEX IF NOT EXISTS archive.idx_archive_orders_user ON orders(user_id, id)")
+
+
+def archive_orders_batch(days: int, batch: int = 500) -> int:
+    """
+    Переносит до batch завершённых (accepted/declined/cancelled) заказов старше days дней
+    вместе с позициями в архивную базу. Возвращает число перенесённых заказов
+    (0 — переносить больше нечего).
+
+    Транзакция одна, но в режиме WAL SQLite не фиксирует ATTACH-базы атомарно вместе:
+    после сбоя посреди commit пачка может остаться и в архиве, и в горячей базе.
+    Поэтому копия идемпотентна — повторный прогон перезаписывает заказы и их позиции в архиве.
+    """
+    import datetime
+
+    cutoff = (datetime.datetime.utcnow() - datetime.timedelta(days=int(days))).isoformat()
+
+    con = connect()
+    with con:
+        cur = con.cursor()
+        cur.execute("ATTACH DATABASE ? AS archive", (str(archive_path()),))
+        _ensure_archive_schema(cur)
+
+        marks = ",".join("?" * len(ARCHIVE_STATUSES))
+        ids = [int(r[0]) for r in cur.execute(
+            f"SELECT id FROM orders WHERE status IN ({marks}) AND created_at < ? ORDER BY id LIMIT ?",
+            (*ARCHIVE_STATUSES, cutoff, int(batch)),
+        ).fetchall()]
+        if not ids:
+            return 0
+
+        marks = ",".join("?" * len(ids))
+        cur.execute(f"INSERT OR REPLACE INTO archive.orders({ORDER_COLS}) "
+                    f"SELECT {ORDER_COLS} FROM main.orders WHERE id IN ({marks})", ids)
+        # позиции без ключа: остатки недоведённого прогона удаляем, иначе задвоятся
+        cur.execute(f"DELETE FROM archive.order_items WHERE order_id IN ({marks})", ids)
+        cur.execute(f"INSERT INTO archive.order_items({ITEM_COLS}) "
+                    f"SELECT {ITEM_COLS} FROM main.order_items WHERE order_id IN ({marks})", ids)
+        cur.execute(f"DELETE FROM main.order_items WHERE order_id IN ({marks})", ids)
+        cur.execute(f"DELETE FROM main.orders WHERE id IN ({marks})", ids)
+        con.commit()
+        return len(ids)
+
+
+def prune_settings() -> int:
+    """
+    Удаляет ключи дайджестов, все заказы которых уже ушли в архив. Смотрим на каждый
+    заказ дайджеста, а не на первый: пока хоть один в горячей базе, кнопки дайджеста нужны.
+    """
+    with connect() as con:
+        stale = []
+        for key, value in con.execute("SELECT key, value FROM settings WHERE key LIKE 'digest:%'").fetchall():
+            ids = [int(x) for x in (value or "").split(",") if x.strip().isdigit()]
+            alive = ids and con.execute(
+                f"SELECT 1 FROM orders WHERE id IN ({','.join('?' * len(ids))}) LIMIT 1", ids,
+            ).fetchone()
+            if not alive:
+                stale.append((key,))
+        con.executemany("DELETE FROM settings WHERE key=?", stale)
+        con.commit()
+        return len(stale)
+
+
+def freelist_pages() -> int:
+    with connect() as con:
+        return int(con.execute("PRAGMA freelist_count").fetchone()[0])
+
+
+def incremental_vacuum(pages: int = 256) -> int:
+    """Отдаёт ОС до pages свободных страниц. Возвращает, сколько свободных страниц осталось."""
+    con = sqlite3.connect(db_path(), isolation_level=None)
+    try:
+        con.execute(f"PRAGMA incremental_vacuum({int(pages)})").fetchall()
+        return int(con.execute("PRAGMA freelist_count").fetchone()[0])
+    finally:
+        con.close()
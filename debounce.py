@@ -0,0 +1,73 @@
+import asyncio
+from typing import AsyncContextManager, Awaitable, Callable, Dict, Hashable, Optional
+
+
+class Debouncer:
+    """
+    Откладывает перерисовку на delay секунд; если за это время пришла новая —
+    старая отменяется и рисуется только последнее состояние.
+    Считает, сколько перерисовок удалось не делать (coalesced).
+
+    guard — очередь пользователя (UserSerialMiddleware.hold): перерисовка ждёт, пока
+    отработают его хендлеры, и до самого старта её можно отменить через cancel().
+    """
+
+    def __init__(self, delay: float):
+        self.delay = delay
+        self._pending: Dict[Hashable, asyncio.Task] = {}
+        self._tasks = set()
+
+        self.scheduled = 0
+        self.rendered = 0
+        self.coalesced = 0
+        self.failed = 0
+
+    def schedule(self, key: Hashable, render: Callable[[], Awaitable],
+                 guard: Optional[AsyncContextManager] = None):
+        self.cancel(key)
+        self.scheduled += 1
+        task = asyncio.create_task(self._later(key, render, guard))
+        self._pending[key] = task
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    def cancel(self, key: Hashable) -> bool:
+        """Отменяет ещё не начатую перерисовку (уже идущую не трогаем)."""
+        task = self._pending.pop(key, None)
+        if task is None or task.done():
+            return False
+        task.cancel()
+        self.coalesced += 1
+        return True
+
+    async def _later(self, key, render, guard):
+        await asyncio.sleep(self.delay)
+        if guard is None:
+            await self._render(key, render)
+            return
+        # пока ждём очередь, задача остаётся в _pending: новый экран успеет её отменить
+        async with guard:
+            await self._render(key, render)
+
+    async def _render(self, key, render):
+        if self._pending.get(key) is not asyncio.current_task():
+            return
+        del self._pending[key]
+        try:
+            await render()
+            self.rendered += 1
+        except Exception:
+            self.failed += 1
+
+    async def wait_idle(self):
+        while self._tasks:
+            await asyncio.gather(*list(self._tasks), return_exceptions=True)
+
+    def stats(self) -> dict:
+        return {
+            "scheduled": self.scheduled,
+            "rendered": self.rendered,
+            "coalesced": self.coalesced,
+            "failed": self.failed,
+            "pending": len(self._pending),
+        }
@@ -0,0 +1,35 @@
+import asyncio
+from typing import Callable, List, Optional, Tuple
+
+
+class Signal:
+    """
+    Простейшее in-process событие. Подписчик, подключённый с loop, вызывается
+    через loop.call_soon_threadsafe — так событие можно слать и из потока SQLite.
+    """
+
+    def __init__(self):
+        self._listeners: List[Tuple[Callable, Optional[asyncio.AbstractEventLoop]]] = []
+
+    def connect(self, fn: Callable, loop: Optional[asyncio.AbstractEventLoop] = None):
+        self._listeners.append((fn, loop))
+
+    def disconnect(self, fn: Callable):
+        self._listeners = [(f, lp) for f, lp in self._listeners if f is not fn]
+
+    def emit(self, *args):
+        for fn, loop in self._listeners:
+            try:
+                if loop is not None:
+                    loop.call_soon_threadsafe(fn, *args)
+                else:
+                    fn(*args)
+            except Exception:
+                pass
+
+
+# stock_changed(product_id, old_stock, new_stock) — после коммита, только при увеличении склада
+stock_changed = Signal()
+
+# product_changed(product_id) — после коммита правки товара админом (склад, цена, удаление)
+product_changed = Signal()
@@ -0,0 +1,62 @@
+"""
+Журнал движений склада (stock_moves) из командной строки — для любого STORAGE_URL.
+
+Каждое изменение products.stock пишется в журнал в той же транзакции (причина,
+покупатель / админ, заказ). Снимки (stock_snapshots) фиксируют остатки по журналу,
+чтобы история и сверка не читали журнал с самого начала.
+
+CLI:
+    python ledger.py snapshot                       # снять снимок остатков
+    python ledger.py reconcile                      # склад vs журнал; код выхода 1 при расхождениях
+    python ledger.py history 42 --at "2026-01-31 23:59:59"   # остаток товара на момент (UTC)
+    python ledger.py moves 42 --limit 20            # последние движения товара
+"""
+import argparse
+import asyncio
+import os
+import sys
+
+from storage import create_storage
+
+
+async def run(args) -> int:
+    store = create_storage(args.url)
+    await store.init()
+    try:
+        if args.cmd == "snapshot":
+            sid = await store.stock_snapshot()
+            print(f"snapshot #{sid}" if sid else "no moves since the last snapshot")
+        elif args.cmd == "reconcile":
+            rows = await store.stock_reconcile()
+            for pid, title, stock, ledger in rows:
+                print(f"#{pid} {title or '(deleted)'}: stock={stock} ledger={ledger}")
+            print(f"{len(rows)} mismatch(es)" if rows else "stock matches the ledger")
+            return 1 if rows else 0
+        elif args.cmd == "history":
+            print(await store.stock_at(args.pid, args.at))
+        elif args.cmd == "moves":
+            for _id, delta, reason, user_id, order_id, created_at in await store.stock_moves(args.pid, limit=args.limit):
+                print(f"{_id:>8} {created_at} {delta:+6d} {reason:<14} user={user_id or '-'} order={order_id or '-'}")
+    finally:
+        await store.close()
+    return 0
+
+
+def main_cli():
+    ap = argparse.ArgumentParser(description="Stock movement ledger: snapshots, reconciliation, history")
+    ap.add_argument("--url", default=os.getenv("STORAGE_URL", ""), help="storage URL (default: STORAGE_URL / shop.db)")
+    sub = ap.add_subparsers(dest="cmd", required=True)
+    sub.add_parser("snapshot")
+    sub.add_parser("reconcile")
+    p_hist = sub.add_parser("history")
+    p_hist.add_argument("pid", type=int)
+    p_hist.add_argument("--at", help="UTC time 'YYYY-MM-DD HH:MM:SS' (default: now)")
+    p_moves = sub.add_parser("moves")
+    p_moves.add_argument("pid", type=int)
+    p_moves.add_argument("--limit", type=int, default=50)
+    args = ap.parse_args()
+    sys.exit(asyncio.run(run(args)))
+
+
+if __name__ == "__main__":
+    main_cli()
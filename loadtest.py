@@ -0,0 +1,344 @@
+"""
+Нагрузочный прогон бота без сети.
+
+Собирает синтетические Update (Message / CallbackQuery), прогоняет их через
+настоящий dp из main.py (Dispatcher.feed_update) и подменяет HTTP-сессию Bot
+на фейковую, которая только записывает вызовы Bot API.
+
+Пример:
+    python loadtest.py --users 50 --iterations 20 --scenario browse --scenario checkout
+    python loadtest.py --scenario all --json
+"""
+import argparse
+import asyncio
+import json
+import random
+import statistics
+import tempfile
+import time
+from collections import Counter
+from pathlib import Path
+
+from aiogram import Bot
+from aiogram.client.session.base import BaseSession
+from aiogram.types import Update
+
+import db
+import main
+
+FAKE_TOKEN = "123456:LOADTEST"
+LOAD_ADMIN_ID = 999_000_001  # админ для сценария accept/decline
+CATEGORIES = ["Coffee", "Tea", "Snacks", "Merch"]
+
+
+# ----------------- FAKE BOT API -----------------
+class RecordingSession(BaseSession):
+    """
+    Сессия без сети: каждый вызов Bot API записывается и получает
+    правдоподобный ответ (Message / True), прошедший через обычную десериализацию aiogram.
+    """
+
+    def __init__(self, latency: float = 0.0):
+        super().__init__()
+        self.latency = latency
+        self.calls = Counter()
+        self._next_message_id = 1
+
+    async def make_request(self, bot, method, timeout=None):
+        self.calls[type(method).__name__] += 1
+        if self.latency:
+            await asyncio.sleep(self.latency)
+
+        if method.__returning__ is bool:
+            result = True
+        else:
+            self._next_message_id += 1
+            chat_id = getattr(method, "chat_id", None) or 0
+            result = {
+                "message_id": self._next_message_id,
+                "date": int(time.time()),
+                "chat": {"id": chat_id, "type": "private"},
+            }
+
+        content = json.dumps({"ok": True, "result": result})
+        return self.check_response(bot, method, status_code=200, content=content).result
+
+    async def stream_content(self, url, headers=None, timeout=30, chunk_size=65536, raise_for_status=True):
+        yield b""
+
+    async def close(self):
+        pass
+
+    @property
+    def total_calls(self) -> int:
+        return sum(self.calls.values())
+
+
+# ----------------- UPDATE FACTORY -----------------
+class Updates:
+    """Генератор синтетических апдейтов, привязанных к конкретному Bot."""
+
+    def __init__(self, bot: Bot):
+        self.bot = bot
+        self._update_id = 0
+        self._message_id = 10_000_000
+
+    def _ids(self):
+        self._update_id += 1
+        self._message_id += 1
+        return self._update_id, self._message_id
+
+    @staticmethod
+    def _user(user_id: int) -> dict:
+        return {"id": user_id, "is_bot": False, "first_name": f"User{user_id}", "username": f"u{user_id}"}
+
+    def message(self, user_id: int, text: str) -> Update:
+        update_id, message_id = self._ids()
+        return Update.model_validate({
+            "update_id": update_id,
+            "message": {
+                "message_id": message_id,
+                "date": int(time.time()),
+                "chat": {"id": user_id, "type": "private"},
+                "from": self._user(user_id),
+                "text": text,
+            },
+        }, context={"bot": self.bot})
+
+    def callback(self, user_id: int, data: str) -> Update:
+        update_id, message_id = self._ids()
+        return Update.model_validate({
+            "update_id": update_id,
+            "callback_query": {
+                "id": str(update_id),
+                "from": self._user(user_id),
+                "chat_instance": str(user_id),
+                "data": data,
+                "message": {
+                    "message_id": message_id,
+                    "date": int(time.time()),
+                    "chat": {"id": user_id, "type": "private"},
+                    "text": "ui",
+                },
+            },
+        }, context={"bot": self.bot})
+
+
+# ----------------- SCENARIOS -----------------
+# Сценарий — генератор апдейтов одного виртуального пользователя.
+# Апдейты отдаются по одному, чтобы следующий шаг мог опираться на состояние БД.
+
+def scenario_browse(u: Updates, uid: int, products: dict):
+    yield u.message(uid, "/start")
+    yield u.callback(uid, "lang:ru")
+    yield u.callback(uid, "menu:catalog")
+    cat = random.choice(list(products))
+    yield u.callback(uid, f"cat:{cat}")
+    yield u.callback(uid, f"p:{random.choice(products[cat])}")
+    yield u.callback(uid, "menu:root")
+
+
+def scenario_cart(u: Updates, uid: int, products: dict):
+    cat = random.choice(list(products))
+    pid = random.choice(products[cat])
+    yield u.callback(uid, f"p:{pid}")
+    yield u.callback(uid, f"add:{pid}:2")
+    yield u.callback(uid, "menu:cart")
+    yield u.callback(uid, f"rm1:{pid}")
+    yield u.callback(uid, f"rm1:{pid}")
+    yield u.callback(uid, f"add:{pid}:1")
+    yield u.callback(uid, "cart:clear")
+
+
+def scenario_checkout(u: Updates, uid: int, products: dict):
+    cat = random.choice(list(products))
+    yield u.callback(uid, f"add:{random.choice(products[cat])}:1")
+    yield u.callback(uid, "menu:cart")
+    yield u.callback(uid, "checkout:start")
+    yield u.message(uid, f"Name {uid}")
+    yield u.message(uid, "+49 000 000")
+    yield u.message(uid, "Street 1")
+    yield u.callback(uid, "pay:cash")
+
+
+def scenario_carousel(u: Updates, uid: int, products: dict):
+    # products[cat] в порядке каталога (id DESC) — ▶️ ведёт к следующему элементу списка
+    cat = random.choice(list(products))
+    ids = products[cat]
+    i = random.randrange(len(ids))
+    yield u.callback(uid, f"p:{ids[i]}")
+    for _ in range(8):
+        step = random.choice((-1, 1, 1))
+        if not 0 <= i + step < len(ids):
+            step = -step
+        i += step
+        yield u.callback(uid, f"pc:{ids[i]}")
+    yield u.callback(uid, f"add:{ids[i]}:1")
+    yield u.callback(uid, "cart:clear")
+
+
+def scenario_orders(u: Updates, uid: int, products: dict):
+    yield u.callback(uid, "menu:orders")
+    yield u.callback(uid, "menu:root")
+    yield u.callback(uid, "menu:orders")
+    rows = db.user_orders_page(uid, None, 6)
+    if len(rows) > 5:
+        yield u.callback(uid, f"myo:{rows[4][0]}")
+
+
+def scenario_admin(u: Updates, uid: int, products: dict):
+    # сам заказ делает покупатель, решение принимает админ
+    yield from scenario_checkout(u, uid, products)
+    # генератор продолжается после обработки pay:cash — заказ этого покупателя уже в базе;
+    # list_orders("new") при параллельных покупателях вернул бы чужой
+    rows = db.user_orders_page(uid, None, 1)
+    if rows and rows[0][1] == "new":
+        action = random.choice(["accept", "decline"])
+        yield u.callback(LOAD_ADMIN_ID, f"ord:{action}:{rows[0][0]}")
+
+
+SCENARIOS = {
+    "browse": scenario_browse,
+    "cart": scenario_cart,
+    "checkout": scenario_checkout,
+    "admin": scenario_admin,
+    "orders": scenario_orders,
+    "carousel": scenario_carousel,
+}
+
+
+# ----------------- RUNNER -----------------
+def seed_db(path: Path, per_category: int) -> dict:
+    db.DB_PATH = path
+    db.init_db()
+    products = {}
+    for cat in CATEGORIES:
+        for i in range(per_category):
+            db.add_product(cat, f"{cat} #{i}", random.randint(100, 5000), 1_000_000)
+        products[cat] = [r[0] for r in db.list_products(cat)]
+    return products
+
+
+def percentile(values: list, p: float) -> float:
+    if not values:
+        return 0.0
+    values = sorted(values)
+    k = min(len(values) - 1, max(0, int(round(p / 100 * (len(values) - 1)))))
+    return values[k]
+
+
+async def run_user(bot: Bot, u: Updates, uid: int, scenarios: list, iterations: int,
+                   products: dict, latencies: list, errors: Counter):
+    for _ in range(iterations):
+        scenario = SCENARIOS[random.choice(scenarios)]
+        for update in scenario(u, uid, products):
+            t0 = time.perf_counter()
+            try:
+                await main.dp.feed_update(bot, update)
+            except Exception as e:
+                errors[type(e).__name__] += 1
+            latencies.append(time.perf_counter() - t0)
+
+
+async def run(users: int, iterations: int, scenarios: list, per_category: int, api_latency: float) -> dict:
+    with tempfile.TemporaryDirectory() as tmp:
+        products = seed_db(Path(tmp) / "load.db", per_category)
+        main.ADMIN_IDS.add(LOAD_ADMIN_ID)
+
+        session = RecordingSession(latency=api_latency)
+        bot = Bot(FAKE_TOKEN, session=session)
+        u = Updates(bot)
+        main.LOOP_MONITOR.start()  # в бою он тоже включён — меряем вместе с ним
+        latencies = []
+        errors = Counter()
+
+        t0 = time.perf_counter()
+        await asyncio.gather(*(
+            run_user(bot, u, 1_000 + i, scenarios, iterations, products, latencies, errors)
+            for i in range(users)
+        ))
+        # отложенные перерисовки корзины тоже часть нагрузки
+        await main.CART_RENDER.wait_idle()
+        await main.CAROUSEL.wait_idle()
+        elapsed = time.perf_counter() - t0
+        main.LOOP_MONITOR.stop()
+
+    updates = len(latencies)
+    return {
+        "users": users,
+        "iterations": iterations,
+        "scenarios": scenarios,
+        "updates": updates,
+        "elapsed_s": round(elapsed, 3),
+        "throughput_ups": round(updates / elapsed, 1) if elapsed else 0.0,
+        "latency_ms": {
+            "mean": round(statistics.fmean(latencies) * 1000, 3) if latencies else 0.0,
+            "p50": round(percentile(latencies, 50) * 1000, 3),
+            "p90": round(percentile(latencies, 90) * 1000, 3),
+            "p99": round(percentile(latencies, 99) * 1000, 3),
+            "max": round(max(latencies) * 1000, 3) if latencies else 0.0,
+        },
+        "api_calls": session.total_calls,
+        "api_calls_per_update": round(session.total_calls / updates, 3) if updates else 0.0,
+        "api_calls_by_method": dict(session.calls.most_common()),
+        "errors": dict(errors),
+        "dispatch": main.USER_GUARD.stats(),
+        "cart_render": main.CART_RENDER.stats(),
+        "carousel": main.CAROUSEL.stats(),
+        "loop": main.LOOP_MONITOR.stats(),
+    }
+
+
+def print_report(r: dict):
+    lat = r["latency_ms"]
+    print(f"users={r['users']} iterations={r['iterations']} scenarios={','.join(r['scenarios'])}")
+    print(f"updates: {r['updates']} in {r['elapsed_s']} s -> {r['throughput_ups']} upd/s")
+    print(f"latency ms: mean={lat['mean']} p50={lat['p50']} p90={lat['p90']} p99={lat['p99']} max={lat['max']}")
+    print(f"Bot API calls: {r['api_calls']} ({r['api_calls_per_update']} per update)")
+    for name, n in r["api_calls_by_method"].items():
+        print(f"  {name}: {n}")
+    d = r["dispatch"]
+    print(f"dispatch: shed={d['shed']} peak_queued={d['peak_queued']} peak_user_locks={d['peak_user_locks']} "
+          f"wait ms p50={d['wait_ms_p50']} p95={d['wait_ms_p95']} p99={d['wait_ms_p99']}")
+    c = r["cart_render"]
+    print(f"cart renders: scheduled={c['scheduled']} drawn={c['rendered']} avoided={c['coalesced']}")
+    cr = r["carousel"]
+    if cr["hits"] or cr["misses"]:
+        print(f"carousel swipes: hits={cr['hits']} misses={cr['misses']} prefetches={cr['prefetches']} "
+              f"ms hit p50={cr['swipe_ms_hit_p50']} p99={cr['swipe_ms_hit_p99']} "
+              f"miss p50={cr['swipe_ms_miss_p50']} p99={cr['swipe_ms_miss_p99']}")
+    lp = r["loop"]
+    print(f"loop lag ms: p50={lp['lag_ms_p50']} p90={lp['lag_ms_p90']} p99={lp['lag_ms_p99']} "
+          f"max={lp['lag_ms_max']} blocked={lp['blocked']}")
+    for b in lp["recent_blocks"]:
+        print(f"  blocked {b['blocked_ms']} ms at {b['where']}")
+    if r["errors"]:
+        print(f"errors: {r['errors']}")
+
+
+def main_cli():
+    ap = argparse.ArgumentParser(description="Load test for the shop bot (no network)")
+    ap.add_argument("--users", type=int, default=20, help="concurrent virtual users")
+    ap.add_argument("--iterations", type=int, default=10, help="scenario runs per user")
+    ap.add_argument("--scenario", action="append", choices=[*SCENARIOS, "all"],
+                    help="scenario to run (repeatable), default: all")
+    ap.add_argument("--products", type=int, default=25, help="products per category")
+    ap.add_argument("--api-latency", type=float, default=0.0, help="simulated Bot API latency, seconds")
+    ap.add_argument("--seed", type=int, default=1)
+    ap.add_argument("--json", action="store_true", help="print machine-readable JSON")
+    args = ap.parse_args()
+
+    random.seed(args.seed)
+    scenarios = args.scenario or ["all"]
+    if "all" in scenarios:
+        scenarios = list(SCENARIOS)
+
+    report = asyncio.run(run(args.users, args.iterations, scenarios, args.products, args.api_latency))
+    if args.json:
+        print(json.dumps(report, indent=2))
+    else:
+        print_report(report)
+
+
+if __name__ == "__main__":
+    main_cli()
@@ -0,0 +1,122 @@
+import asyncio
+import datetime
+import logging
+import sys
+import threading
+import time
+import traceback
+from collections import deque
+from pathlib import Path
+from typing import Optional
+
+_HERE = Path(__file__).resolve().parent
+log = logging.getLogger(__name__)
+
+
+def _where(stack) -> str:
+    """Самый глубокий кадр из кода бота (db.py, main.py, ...), а не из библиотек."""
+    for fs in reversed(stack):
+        path = Path(fs.filename)
+        if path.parent == _HERE and path.name != "loop_monitor.py":
+            return f"{path.name}:{fs.lineno} in {fs.name}"
+    fs = stack[-1] if stack else None
+    return f"{Path(fs.filename).name}:{fs.lineno} in {fs.name}" if fs else "?"
+
+
+class LoopMonitor:
+    """
+    Лаг event loop + сторожевой поток.
+
+    - Тикер в loop раз в interval сек засыпает и меряет, насколько позже проснулся — это лаг.
+    - Поток-сторож смотрит на время последнего тика. Если loop молчит дольше threshold,
+      снимает стек потока loop (sys._current_frames) — видно, какая функция его держит.
+      Один снимок на одну блокировку; длительность дописывается, когда loop оживёт.
+
+    Стоимость: один таймер в loop и одно пробуждение потока на threshold/4 — можно держать включённым всегда.
+    """
+
+    def __init__(self, interval: float = 0.1, threshold: float = 0.25, samples: int = 3000, keep: int = 20):
+        self.interval = interval
+        self.threshold = threshold
+        self._lags = deque(maxlen=samples)
+        self.blocks = deque(maxlen=keep)  # последние блокировки: when / blocked_ms / where / stack
+
+        self.blocked = 0
+        self.max_lag = 0.0
+        self._beat = time.monotonic()
+        self._current: Optional[dict] = None  # блокировка, которая идёт прямо сейчас
+        self._lock = threading.Lock()
+        self._loop_thread: Optional[int] = None
+        self._task = None
+        self._stop = threading.Event()
+
+    def start(self):
+        """Вызывать из работающего event loop."""
+        if self._task:
+            return
+        self._loop_thread = threading.get_ident()
+        self._beat = time.monotonic()
+        self._stop.clear()
+        self._task = asyncio.create_task(self._ticker())
+        threading.Thread(target=self._watchdog, name="loop-watchdog", daemon=True).start()
+
+    def stop(self):
+        self._stop.set()
+        if self._task:
+            self._task.cancel()
+            self._task = None
+
+    async def _ticker(self):
+        while True:
+            start = time.monotonic()
+            await asyncio.sleep(self.interval)
+            now = time.monotonic()
+            lag = max(0.0, now - start - self.interval)
+            self._lags.append(lag)
+            self.max_lag = max(self.max_lag, lag)
+            with self._lock:
+                self._beat = now
+                if self._current is not None:
+                    self._current["blocked_ms"] = round(lag * 1000, 1)
+                    self._current = None
+
+    def _watchdog(self):
+        while not self._stop.wait(self.threshold / 4):
+            with self._lock:
+                silent = time.monotonic() - self._beat - self.interval
+                if silent < self.threshold or self._current is not None:
+                    continue
+                frame = sys._current_frames().get(self._loop_thread)
+                stack = traceback.extract_stack(frame) if frame is not None else []
+                block = self._current = {
+                    "when": datetime.datetime.utcnow().isoformat(timespec="seconds"),
+                    "blocked_ms": round(silent * 1000, 1),  # уточнится, когда loop оживёт
+                    "where": _where(stack),
+                    "stack": [f"{Path(fs.filename).name}:{fs.lineno} in {fs.name}" for fs in stack[-8:]],
+                }
+                self.blocks.append(block)
+                self.blocked += 1
+            log.warning(
+                "event loop blocked >%.0f ms at %s\n%s",
+                self.threshold * 1000, block["where"], "".join(traceback.format_list(stack[-8:])),
+            )
+
+    def stats(self) -> dict:
+        lags = sorted(self._lags)
+
+        def pct(p):
+            if not lags:
+                return 0.0
+            return round(lags[min(len(lags) - 1, int(len(lags) * p))] * 1000, 3)
+
+        return {
+            "running": self._task is not None,  # False — монитор не запущен (LOOP_BLOCK_THRESHOLD=0)
+            "lag_ms_p50": pct(0.50),
+            "lag_ms_p90": pct(0.90),
+            "lag_ms_p99": pct(0.99),
+            "lag_ms_max": round(self.max_lag * 1000, 3),
+            "samples": len(lags),
+            "blocked": self.blocked,
+            "threshold_ms": round(self.threshold * 1000, 1),
+            "recent_blocks": list(self.blocks)[-5:],
+        }
@@ -1,15 +1,40 @@
 import asyncio
+import logging
 import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
 
 from aiohttp import web
 from aiogram import Bot, Dispatcher, F
-from aiogram.types import Message, CallbackQuery
+from aiogram.exceptions import TelegramBadRequest
+from aiogram.types import Message, CallbackQuery, InputMediaPhoto
 from aiogram.utils.keyboard import InlineKeyboardBuilder
 from aiogram.fsm.state import StatesGroup, State
 from aiogram.fsm.context import FSMContext
 
-from config import BOT_TOKEN, ADMIN_IDS, CURRENCY
+import config
+from config import (
+    MAX_IN_FLIGHT, MAX_QUEUE, MAX_PER_USER, CART_RENDER_DEBOUNCE,
+    BROADCAST_RATE, STOCK_ALERT_RATE, BULK_SEND_RATE, ADMIN_DIGEST_RATE, ADMIN_DIGEST_WINDOW,
+    ARCHIVE_AFTER_DAYS, ARCHIVE_INTERVAL_MIN, VACUUM_STEP_PAGES, VACUUM_MAX_STEPS,
+    BACKUP_DIR, BACKUP_INTERVAL_MIN, BACKUP_KEEP, STORAGE_URL, LOOP_LAG_INTERVAL, LOOP_BLOCK_THRESHOLD,
+    TENANTS_FILE, TENANT_DB_THREADS, LEDGER_SNAPSHOT_MIN, CAROUSEL_RADIUS, CAROUSEL_TTL,
+)
+import backup
+import broadcast
 import db
+import events
+import tenants
+from debounce import Debouncer
+from loop_monitor import LoopMonitor
+from admin_notify import OrderDigest, load_digest
+from carousel import CarouselCache
+from middlewares import TenantMiddleware, UserSerialMiddleware
+from orders_cache import RecentOrdersCache
+from stock_alerts import StockAlerts
+from storage import create_storage
+from tenants import Tenant, TenantAttr
 from texts import TEXT
 
 
@@ -28,7 +53,7 @@ def currency_symbol(code: str) -> str:
 def money(cents: int | float) -> str:
     # у тебя все цены в базе в cents
     euros = float(cents) / 100
-    return f"{euros:.2f} {currency_symbol(CURRENCY)}"
+    return f"{euros:.2f} {currency_symbol(tenants.current().currency)}"
 
 
 # ----------------- STATES -----------------
@@ -54,17 +79,58 @@ class ProductEdit(StatesGroup):
 
 # ----------------- GLOBALS -----------------
 dp = Dispatcher()
-USER_LANG = {}
-WAITING_CHANNEL = set()
-LAST_UI_MSG = {}  # user_id -> message_id
+TENANT_ROUTER = TenantMiddleware()  # бот апдейта -> магазин; должен стоять первым
+dp.update.outer_middleware(TENANT_ROUTER)
+USER_GUARD = UserSerialMiddleware(MAX_IN_FLIGHT, MAX_QUEUE, MAX_PER_USER)
+dp.update.outer_middleware(USER_GUARD)
+DIGEST_PAGE = 10  # заказов на странице дайджеста
+MY_ORDERS_PAGE = 5
+LOOP_MONITOR = LoopMonitor(LOOP_LAG_INTERVAL, LOOP_BLOCK_THRESHOLD)
+log = logging.getLogger(__name__)
+
+TENANTS = []  # запущенные магазины, заполняет main()
+
+
+def make_tenant(name: str, token: str, store, admin_ids: set, currency: str) -> Tenant:
+    t = Tenant(name, token, store, admin_ids, currency)
+    t.cart_render = Debouncer(CART_RENDER_DEBOUNCE)  # отложенные перерисовки корзины по user_id
+    t.order_digest = OrderDigest(store, ADMIN_DIGEST_RATE, ADMIN_DIGEST_WINDOW)
+    t.my_orders = RecentOrdersCache()  # первая страница «Моих заказов» по user_id
+    t.carousel = CarouselCache(store, CAROUSEL_RADIUS, ttl=CAROUSEL_TTL)  # окно каталога вокруг карточки по user_id
+    # «Сообщить о поступлении»; stock_alert_message объявлена ниже — берём её при вызове
+    # общий темп массовых отправок бота магазина: рассылка, «О поступлении», «принять / отклонить все»
+    t.send_limiter = broadcast.SendLimiter(BULK_SEND_RATE)
+    t.notify_tasks = set()  # фоновые уведомления после «принять / отклонить все»: держим ссылки до конца
+    t.stock_alerts = StockAlerts(store, lambda uid, product: stock_alert_message(uid, product), STOCK_ALERT_RATE,
+                                 t.send_limiter)
+    return t
+
+
+# Магазин из BOT_TOKEN / STORAGE_URL / ADMIN_IDS / CURRENCY (режим без TENANTS_FILE)
+tenants.set_default(make_tenant("default", config.BOT_TOKEN, create_storage(STORAGE_URL),
+                                config.ADMIN_IDS, config.CURRENCY))
+
+# Имена ниже — атрибуты текущего магазина (tenants.CURRENT), хендлеры пишут как раньше
+STORE = TenantAttr("store")
+ADMIN_IDS = TenantAttr("admin_ids")
+USER_LANG = TenantAttr("user_lang")
+WAITING_CHANNEL = TenantAttr("waiting_channel")
+LAST_UI_MSG = TenantAttr("last_ui_msg")
+CART_RENDER = TenantAttr("cart_render")
+ORDER_DIGEST = TenantAttr("order_digest")
+MY_ORDERS = TenantAttr("my_orders")
+CAROUSEL = TenantAttr("carousel")
+STOCK_ALERTS = TenantAttr("stock_alerts")
+SEND_LIMITER = TenantAttr("send_limiter")
+NOTIFY_TASKS = TenantAttr("notify_tasks")
 
 
 # ----------------- LANG -----------------
-def lang(user_id: int) -> str:
+async def lang(user_id: int) -> str:
     if user_id in USER_LANG:
         return USER_LANG[user_id]
 
-    saved = db.get_setting(f"lang:{user_id}")
+    saved = await STORE.get_setting(f"lang:{user_id}")
     if saved in ("ru", "de"):
         USER_LANG[user_id] = saved
         return saved
@@ -84,6 +150,7 @@ def kb_main(lg: str):
     kb = InlineKeyboardBuilder()
     kb.button(text=TEXT["catalog"][lg], callback_data="menu:catalog")
     kb.button(text=TEXT["cart"][lg], callback_data="menu:cart")
+    kb.button(text=TEXT["my_orders"][lg], callback_data="menu:orders")
     kb.adjust(1)
     kb.button(text=TEXT["admin"][lg], callback_data="menu:admin")
     kb.adjust(1)
@@ -113,6 +180,8 @@ async def cleanup_prev_ui(bot: Bot, chat_id: int, user_id: int):
 
 
 async def send_ui(bot: Bot, chat_id: int, user_id: int, text: str, reply_markup=None, photo=None):
+    # новый экран важнее отложенной перерисовки корзины
+    CART_RENDER.cancel(user_id)
     await cleanup_prev_ui(bot, chat_id, user_id)
     if photo:
         msg = await bot.send_photo(chat_id=chat_id, photo=photo, caption=text, reply_markup=reply_markup)
@@ -122,8 +191,30 @@ async def send_ui(bot: Bot, chat_id: int, user_id: int, text: str, reply_markup=
     return msg
 
 
-def cart_total_qty(user_id: int) -> int:
-    items = db.cart_items(user_id)
+async def edit_ui(bot: Bot, call: CallbackQuery, text: str, reply_markup=None, photo=None):
+    """Перерисовать экран в том же сообщении; текст <-> фото на месте не меняется — тогда как send_ui."""
+    msg, user_id = call.message, call.from_user.id
+    if bool(photo) != bool(msg.photo):
+        return await send_ui(bot, msg.chat.id, user_id, text, reply_markup, photo=photo)
+
+    CART_RENDER.cancel(user_id)
+    try:
+        if photo:
+            await bot.edit_message_media(
+                chat_id=msg.chat.id, message_id=msg.message_id,
+                media=InputMediaPhoto(media=photo, caption=text), reply_markup=reply_markup,
+            )
+        else:
+            await bot.edit_message_text(text, chat_id=msg.chat.id, message_id=msg.message_id, reply_markup=reply_markup)
+    except TelegramBadRequest as e:
+        if "not modified" not in str(e):
+            return await send_ui(bot, msg.chat.id, user_id, text, reply_markup, photo=photo)
+    LAST_UI_MSG[user_id] = msg.message_id
+    return msg
+
+
+async def cart_total_qty(user_id: int) -> int:
+    items = await STORE.cart_items(user_id)
     return sum(i[3] for i in items) if items else 0
 
 
@@ -141,14 +232,14 @@ async def start(message: Message, bot: Bot):
 async def set_lang(call: CallbackQuery, bot: Bot):
     lg = call.data.split(":")[1]
     USER_LANG[call.from_user.id] = lg
-    db.set_setting(f"lang:{call.from_user.id}", lg)
+    await STORE.set_setting(f"lang:{call.from_user.id}", lg)
     await call.answer()
     await send_ui(bot, call.message.chat.id, call.from_user.id, TEXT["menu"][lg], kb_main(lg))
 
 
 @dp.callback_query(F.data == "menu:root")
 async def menu_root(call: CallbackQuery, bot: Bot):
-    lg = lang(call.from_user.id)
+    lg = await lang(call.from_user.id)
     await call.answer()
     await send_ui(bot, call.message.chat.id, call.from_user.id, TEXT["menu"][lg], kb_main(lg))
 
@@ -156,8 +247,8 @@ async def menu_root(call: CallbackQuery, bot: Bot):
 # ---------------- CATALOG ----------------
 @dp.callback_query(F.data == "menu:catalog")
 async def menu_catalog(call: CallbackQuery, bot: Bot):
-    lg = lang(call.from_user.id)
-    cats = db.list_categories()
+    lg = await lang(call.from_user.id)
+    cats = await STORE.list_categories()
 
     if not cats:
         await call.answer()
@@ -176,9 +267,9 @@ async def menu_catalog(call: CallbackQuery, bot: Bot):
 
 @dp.callback_query(F.data.startswith("cat:"))
 async def cat_open(call: CallbackQuery, bot: Bot):
-    lg = lang(call.from_user.id)
+    lg = await lang(call.from_user.id)
     category = call.data.split(":", 1)[1]
-    products = db.list_products(category)
+    products = await STORE.list_products(category)
 
     kb = InlineKeyboardBuilder()
     for pid, title, price, stock in products:
@@ -190,32 +281,96 @@ async def cat_open(call: CallbackQuery, bot: Bot):
     await send_ui(bot, call.message.chat.id, call.from_user.id, f"{category}:", kb.as_markup())
 
 
-@dp.callback_query(F.data.startswith("p:"))
-async def product_open(call: CallbackQuery, bot: Bot):
-    lg = lang(call.from_user.id)
-    pid = int(call.data.split(":")[1])
-
-    p = db.get_product(pid)
-    if not p:
-        await call.answer("Not found", show_alert=True)
-        return
-
-    _id, category, title, price, stock, photo_file_id = p
-    total_qty = cart_total_qty(call.from_user.id)
+def product_card(lg: str, card: tuple):
+    """card = (row, prev_id, next_id, cart_qty) из CAROUSEL -> (caption, markup, photo)."""
+    (pid, category, title, price, stock, photo_file_id), prev_id, next_id, total_qty = card
 
     kb = InlineKeyboardBuilder()
     kb.button(text="➕ 1", callback_data=f"add:{pid}:1")
     kb.button(text="➕ 2", callback_data=f"add:{pid}:2")
     kb.button(text="➕ 5", callback_data=f"add:{pid}:5")
-    kb.adjust(3)
+    nav = 0
+    if prev_id is not None:
+        kb.button(text=TEXT["prev"][lg], callback_data=f"pc:{prev_id}")
+        nav += 1
+    if next_id is not None:
+        kb.button(text=TEXT["next"][lg], callback_data=f"pc:{next_id}")
+        nav += 1
+    if stock <= 0:
+        kb.button(text=TEXT["notify_me"][lg], callback_data=f"notify:{pid}")
     kb.button(text=f"{TEXT['cart'][lg]} ({total_qty})", callback_data="menu:cart")
     kb.button(text=TEXT["back"][lg], callback_data=f"cat:{category}")
-    kb.adjust(2)
+    kb.adjust(3, *([nav] if nav else []), 2)
 
     caption = f"{title}\n{money(price)}\nStock: {stock}"
+    return caption, kb.as_markup(), photo_file_id
 
+
+@dp.callback_query(F.data.startswith("p:"))
+async def product_open(call: CallbackQuery, bot: Bot):
+    lg = await lang(call.from_user.id)
+    pid = int(call.data.split(":")[1])
+
+    # карточка и соседи одним запросом — первый свайп уже из памяти
+    card = await CAROUSEL.load(call.from_user.id, pid)
+    if not card:
+        await call.answer("Not found", show_alert=True)
+        return
+
+    caption, markup, photo = product_card(lg, card)
+    await call.answer()
+    await send_ui(bot, call.message.chat.id, call.from_user.id, caption, markup, photo=photo)
+
+
+@dp.callback_query(F.data.startswith("pc:"))
+async def product_swipe(call: CallbackQuery, bot: Bot):
+    """◀️ / ▶️ в карусели: та же карточка, но сообщение редактируется на месте, а не пересылается."""
+    started = time.perf_counter()
+    user_id = call.from_user.id
+    lg = await lang(user_id)
+    pid = int(call.data.split(":")[1])
+
+    card = CAROUSEL.card(user_id, pid)
+    hit = card is not None
+    if not hit:
+        card = await CAROUSEL.load(user_id, pid)
+        if not card:
+            await call.answer("Not found", show_alert=True)
+            return
+
+    caption, markup, photo = product_card(lg, card)
     await call.answer()
-    await send_ui(bot, call.message.chat.id, call.from_user.id, caption, kb.as_markup(), photo=photo_file_id)
+    await edit_ui(bot, call, caption, markup, photo)
+    CAROUSEL.record(hit, time.perf_counter() - started)
+
+    # пока пользователь смотрит карточку — подтягиваем соседей следующего свайпа
+    if hit:
+        CAROUSEL.prefetch(user_id, pid)
+
+
+@dp.callback_query(F.data.startswith("notify:"))
+async def product_notify(call: CallbackQuery, bot: Bot):
+    lg = await lang(call.from_user.id)
+    pid = int(call.data.split(":")[1])
+
+    p = await STORE.get_product(pid)
+    if not p:
+        await call.answer("Not found", show_alert=True)
+        return
+    if p[4] > 0:
+        await call.answer(TEXT["notify_in_stock"][lg], show_alert=True)
+        return
+
+    await STORE.stock_subscribe(pid, call.from_user.id)
+    await call.answer(TEXT["notify_ok"][lg], show_alert=True)
+
+
+async def stock_alert_message(user_id: int, product):
+    lg = await lang(user_id)
+    pid, _category, title = product[0], product[1], product[2]
+    kb = InlineKeyboardBuilder()
+    kb.button(text=TEXT["open_product"][lg], callback_data=f"p:{pid}")
+    return TEXT["back_in_stock"][lg].format(title=title), kb.as_markup()
 
 
 # ---------------- CART ----------------
@@ -226,13 +381,14 @@ async def add_to_cart(call: CallbackQuery, bot: Bot):
         pid = int(pid)
         qty = int(qty)
 
-        added = db.cart_add_reserve(call.from_user.id, pid, qty)
+        added = await STORE.cart_add_reserve(call.from_user.id, pid, qty)
         if added <= 0:
             await call.answer("Нет в наличии / Nicht verfügbar", show_alert=True)
             return
 
-        total_qty = cart_total_qty(call.from_user.id)
-        lg = lang(call.from_user.id)
+        total_qty = await cart_total_qty(call.from_user.id)
+        CAROUSEL.cart_added(call.from_user.id, pid, added, total_qty)
+        lg = await lang(call.from_user.id)
         msg = f"✅ Добавлено: +{added}\n🧺 В корзине: {total_qty}" if lg == "ru" else f"✅ Hinzugefügt: +{added}\n🧺 Im Warenkorb: {total_qty}"
         await call.answer(msg, show_alert=True)
     except Exception:
@@ -243,29 +399,37 @@ async def add_to_cart(call: CallbackQuery, bot: Bot):
 async def remove_one(call: CallbackQuery, bot: Bot):
     try:
         pid = int(call.data.split(":")[1])
-        removed = db.cart_remove_return(call.from_user.id, pid, 1)
+        removed = await STORE.cart_remove_return(call.from_user.id, pid, 1)
+        CAROUSEL.invalidate(call.from_user.id)
         await call.answer(f"-{removed}" if removed else "0", show_alert=False)
-        await cart_view(call, bot)
+        # склад уже обновлён, а экран корзины рисуем один раз после серии тапов
+        chat_id, user_id = call.message.chat.id, call.from_user.id
+        CART_RENDER.schedule(user_id, lambda: render_cart(bot, chat_id, user_id), USER_GUARD.hold(bot.id, user_id))
     except Exception:
         await call.answer("Ошибка / Error", show_alert=True)
 
 
 @dp.callback_query(F.data == "cart:clear")
 async def cart_clear(call: CallbackQuery, bot: Bot):
-    lg = lang(call.from_user.id)
-    db.cart_clear_return(call.from_user.id)
+    lg = await lang(call.from_user.id)
+    await STORE.cart_clear_return(call.from_user.id)
+    CAROUSEL.invalidate(call.from_user.id)
     await call.answer()
     await send_ui(bot, call.message.chat.id, call.from_user.id, TEXT["empty"][lg], kb_back(lg))
 
 
 @dp.callback_query(F.data == "menu:cart")
 async def cart_view(call: CallbackQuery, bot: Bot):
-    lg = lang(call.from_user.id)
-    items = db.cart_items(call.from_user.id)
+    await call.answer()
+    await render_cart(bot, call.message.chat.id, call.from_user.id)
+
+
+async def render_cart(bot: Bot, chat_id: int, user_id: int):
+    lg = await lang(user_id)
+    items = await STORE.cart_items(user_id)
 
     if not items:
-        await call.answer()
-        await send_ui(bot, call.message.chat.id, call.from_user.id, TEXT["empty"][lg], kb_back(lg))
+        await send_ui(bot, chat_id, user_id, TEXT["empty"][lg], kb_back(lg))
         return
 
     total = 0
@@ -284,14 +448,64 @@ async def cart_view(call: CallbackQuery, bot: Bot):
     kb.button(text=TEXT["continue_shop"][lg], callback_data="menu:catalog")
     kb.adjust(1)
 
+    await send_ui(bot, chat_id, user_id, text, kb.as_markup())
+
+
+# ---------------- MY ORDERS ----------------
+async def my_orders_page(user_id: int, before_id: int | None):
+    """Страница заказов + их позиции (одним запросом на страницу). Первая страница — из кэша."""
+    if before_id is None:
+        cached = MY_ORDERS.get(user_id)
+        if cached is not None:
+            return cached
+
+    rows = await STORE.user_orders_page(user_id, before_id, MY_ORDERS_PAGE + 1)
+    has_more = len(rows) > MY_ORDERS_PAGE
+    rows = rows[:MY_ORDERS_PAGE]
+    items = await STORE.order_items_batch([r[0] for r in rows])
+    page = {"orders": rows, "items": items, "has_more": has_more}
+
+    if before_id is None:
+        MY_ORDERS.put(user_id, page)
+    return page
+
+
+@dp.callback_query(F.data == "menu:orders")
+@dp.callback_query(F.data.startswith("myo:"))
+async def my_orders(call: CallbackQuery, bot: Bot):
+    lg = await lang(call.from_user.id)
+    before_id = int(call.data.split(":")[1]) if call.data.startswith("myo:") else None
+    page = await my_orders_page(call.from_user.id, before_id)
+
     await call.answer()
+    if not page["orders"]:
+        await send_ui(bot, call.message.chat.id, call.from_user.id, TEXT["no_orders"][lg], kb_back(lg))
+        return
+
+    by_order = {}
+    for oid, _pid, title, price, qty in page["items"]:
+        by_order.setdefault(oid, []).append(f"   • {title} × {qty} = {money(price * qty)}")
+
+    blocks = []
+    for oid, status, total_cents, created_at in page["orders"]:
+        label = TEXT.get(f"status_{status}", {}).get(lg, status)
+        head = f"#{oid} · {(created_at or '')[:10]} · {label}\n   {money(total_cents)}"
+        blocks.append("\n".join([head, *by_order.get(oid, [])]))
+
+    kb = InlineKeyboardBuilder()
+    if page["has_more"]:
+        kb.button(text=TEXT["older"][lg], callback_data=f"myo:{page['orders'][-1][0]}")
+    kb.button(text=TEXT["back"][lg], callback_data="menu:root")
+    kb.adjust(1)
+
+    text = TEXT["my_orders"][lg] + "\n\n" + "\n\n".join(blocks)
     await send_ui(bot, call.message.chat.id, call.from_user.id, text, kb.as_markup())
 
 
 # ---------------- CHECKOUT ----------------
 @dp.callback_query(F.data == "checkout:start")
 async def checkout_start(call: CallbackQuery, state: FSMContext, bot: Bot):
-    lg = lang(call.from_user.id)
+    lg = await lang(call.from_user.id)
     await state.set_state(Checkout.name)
     await call.answer("✍️")
     await send_ui(bot, call.message.chat.id, call.from_user.id, TEXT["ask_name"][lg], kb_cancel_to(lg, "menu:cart"))
@@ -300,7 +514,7 @@ async def checkout_start(call: CallbackQuery, state: FSMContext, bot: Bot):
 @dp.message(Checkout.name)
 async def checkout_name(message: Message, state: FSMContext, bot: Bot):
     await state.update_data(name=message.text.strip())
-    lg = lang(message.from_user.id)
+    lg = await lang(message.from_user.id)
     await state.set_state(Checkout.phone)
     await send_ui(bot, message.chat.id, message.from_user.id, TEXT["ask_phone"][lg], kb_cancel_to(lg, "menu:cart"))
 
@@ -308,7 +522,7 @@ async def checkout_name(message: Message, state: FSMContext, bot: Bot):
 @dp.message(Checkout.phone)
 async def checkout_phone(message: Message, state: FSMContext, bot: Bot):
     await state.update_data(phone=message.text.strip())
-    lg = lang(message.from_user.id)
+    lg = await lang(message.from_user.id)
     await state.set_state(Checkout.address)
     await send_ui(bot, message.chat.id, message.from_user.id, TEXT["ask_address"][lg], kb_cancel_to(lg, "menu:cart"))
 
@@ -316,7 +530,7 @@ async def checkout_phone(message: Message, state: FSMContext, bot: Bot):
 @dp.message(Checkout.address)
 async def checkout_address(message: Message, state: FSMContext, bot: Bot):
     await state.update_data(address=message.text.strip())
-    lg = lang(message.from_user.id)
+    lg = await lang(message.from_user.id)
     await state.set_state(Checkout.pay)
 
     kb = InlineKeyboardBuilder()
@@ -330,7 +544,7 @@ async def checkout_address(message: Message, state: FSMContext, bot: Bot):
 
 @dp.callback_query(Checkout.pay, F.data.startswith("pay:"))
 async def checkout_pay(call: CallbackQuery, state: FSMContext, bot: Bot):
-    lg = lang(call.from_user.id)
+    lg = await lang(call.from_user.id)
     pay_method = call.data.split(":")[1]
 
     data = await state.get_data()
@@ -341,7 +555,7 @@ async def checkout_pay(call: CallbackQuery, state: FSMContext, bot: Bot):
     tg_username = call.from_user.username
     tg_name = " ".join(x for x in [call.from_user.first_name, call.from_user.last_name] if x).strip()
 
-    created = db.create_order(
+    created = await STORE.create_order(
         call.from_user.id, name, phone, address, pay_method,
         tg_username=tg_username, tg_name=tg_name
     )
@@ -354,6 +568,8 @@ async def checkout_pay(call: CallbackQuery, state: FSMContext, bot: Bot):
 
     await call.answer("✅")
     await state.clear()
+    MY_ORDERS.invalidate(call.from_user.id)
+    CAROUSEL.invalidate(call.from_user.id)
 
     await send_ui(
         bot, call.message.chat.id, call.from_user.id,
@@ -361,7 +577,10 @@ async def checkout_pay(call: CallbackQuery, state: FSMContext, bot: Bot):
         kb_main(lg)
     )
 
-    if ADMIN_IDS:
+    if ADMIN_IDS and ORDER_DIGEST.should_batch():
+        # поток заказов большой — уйдёт одним дайджестом по таймеру
+        await ORDER_DIGEST.add(order_id, lambda did, ids: send_digest(bot, did, ids))
+    elif ADMIN_IDS:
         tg_link = f"tg://user?id={call.from_user.id}"
 
         lines = [
@@ -406,7 +625,7 @@ async def admin_order_action(call: CallbackQuery, bot: Bot):
         await call.answer("Bad data", show_alert=True)
         return
 
-    order = db.get_order(order_id)
+    order = await STORE.get_order(order_id)
     if not order:
         await call.answer("Order not found", show_alert=True)
         return
@@ -418,11 +637,9 @@ async def admin_order_action(call: CallbackQuery, bot: Bot):
         return
 
     if action == "accept":
-        db.set_order_status(order_id, "accepted")
-        try:
-            await bot.send_message(user_id, "✅ Ваш заказ подтверждён! Мы скоро свяжемся с вами.")
-        except Exception:
-            pass
+        await STORE.set_order_status(order_id, "accepted")
+        MY_ORDERS.invalidate(user_id)
+        await notify_customer(bot, user_id, "accepted")
         await call.answer("✅ Принято", show_alert=True)
         try:
             await call.message.edit_reply_markup(reply_markup=None)
@@ -431,29 +648,210 @@ async def admin_order_action(call: CallbackQuery, bot: Bot):
         return
 
     if action == "decline":
-        db.set_order_status(order_id, "declined")
-        db.restock_order(order_id)
+        await STORE.set_order_status(order_id, "declined")
+        MY_ORDERS.invalidate(user_id)
+        await STORE.restock_order(order_id)
+        await notify_customer(bot, user_id, "declined")
+        await call.answer("❌ Отклонено", show_alert=True)
         try:
-            await bot.send_message(user_id, "❌ К сожалению, заказ отклонён. Напишите нам, чтобы уточнить детали.")
+            await call.message.edit_reply_markup(reply_markup=None)
         except Exception:
             pass
-        await call.answer("❌ Отклонено", show_alert=True)
+        return
+
+
+async def notify_customer(bot: Bot, user_id: int, status: str, limiter=None) -> str:
+    text = (
+        "✅ Ваш заказ подтверждён! Мы скоро свяжемся с вами."
+        if status == "accepted"
+        else "❌ К сожалению, заказ отклонён. Напишите нам, чтобы уточнить детали."
+    )
+    return await broadcast.send_with_retry(bot, user_id, text, limiter)
+
+
+def log_task_error(task: asyncio.Task):
+    if not task.cancelled() and task.exception() is not None:
+        log.error("background task %s failed", task.get_name(), exc_info=task.exception())
+
+
+async def notify_customers(bot: Bot, changed: list, status: str):
+    """
+    Уведомления после «принять / отклонить все»: в темпе BROADCAST_RATE и в общем темпе
+    массовых отправок бота (SEND_LIMITER), с учётом flood-контроля.
+    """
+    interval = 1.0 / BROADCAST_RATE if BROADCAST_RATE > 0 else 0.0
+    next_at = time.monotonic()
+    for _oid, user_id in changed:
+        delay = next_at - time.monotonic()
+        if delay > 0:
+            await asyncio.sleep(delay)
+        next_at = max(next_at, time.monotonic()) + interval
+        await notify_customer(bot, user_id, status, SEND_LIMITER)  # общий темп с рассылкой и «О поступлении»
+
+
+# ---------------- ADMIN: order digest ----------------
+async def digest_view(digest_id: int, order_ids: list, page: int):
+    pages = max(1, (len(order_ids) + DIGEST_PAGE - 1) // DIGEST_PAGE)
+    page = min(max(0, page), pages - 1)
+    chunk = order_ids[page * DIGEST_PAGE:(page + 1) * DIGEST_PAGE]
+
+    rows = await STORE.orders_brief(order_ids)
+    new_count = sum(1 for r in rows if r[1] == "new")
+    total = sum(int(r[4]) for r in rows)
+
+    lines = [
+        f"🧾 Orders digest: {len(order_ids)} orders (#{order_ids[0]}–#{order_ids[-1]})",
+        f"Waiting: {new_count} | Sum: {money(total)}",
+        "",
+    ]
+    visible = set(chunk)
+    for oid, status, cname, tg_username, total_cents in rows:
+        if oid not in visible:
+            continue
+        who = f"@{tg_username}" if tg_username else (cname or "—")
+        lines.append(f"#{oid} [{status}] {who} — {money(total_cents)}")
+    lines.append(f"\nPage {page + 1}/{pages}")
+
+    kb = InlineKeyboardBuilder()
+    if new_count:
+        kb.button(text="✅ Принять все / Accept all", callback_data=f"dg:accept:{digest_id}:{page}")
+        kb.button(text="❌ Отклонить все / Decline all", callback_data=f"dg:decline:{digest_id}:{page}")
+    if page > 0:
+        kb.button(text="◀️", callback_data=f"dg:p:{digest_id}:{page - 1}")
+    if page < pages - 1:
+        kb.button(text="▶️", callback_data=f"dg:p:{digest_id}:{page + 1}")
+    kb.adjust(1, 1, 2) if new_count else kb.adjust(2)
+    return "\n".join(lines), kb.as_markup()
+
+
+async def send_digest(bot: Bot, digest_id: int, order_ids: list):
+    text, markup = await digest_view(digest_id, order_ids, 0)
+    for admin_id in ADMIN_IDS:
         try:
-            await call.message.edit_reply_markup(reply_markup=None)
+            await bot.send_message(admin_id, text, reply_markup=markup)
         except Exception:
             pass
+
+
+@dp.callback_query(F.data.startswith("dg:"))
+async def admin_digest_action(call: CallbackQuery, bot: Bot):
+    if call.from_user.id not in ADMIN_IDS:
+        await call.answer("No access", show_alert=True)
         return
 
+    try:
+        _, action, did, page = call.data.split(":")
+        digest_id, page = int(did), int(page)
+    except Exception:
+        await call.answer("Bad data", show_alert=True)
+        return
+
+    order_ids = await load_digest(STORE, digest_id)
+    if not order_ids:
+        await call.answer("Digest not found", show_alert=True)
+        return
+
+    if action in ("accept", "decline"):
+        status = "accepted" if action == "accept" else "declined"
+        changed = await STORE.set_orders_status_bulk(order_ids, status, restock=(action == "decline"))
+        await call.answer(f"{'✅' if action == 'accept' else '❌'} {len(changed)}", show_alert=True)
+        for _oid, user_id in changed:
+            MY_ORDERS.invalidate(user_id)
+        # большой дайджест — это сотни сообщений: шлём в фоне, не держа админа
+        task = asyncio.create_task(notify_customers(bot, changed, status))
+        NOTIFY_TASKS.add(task)  # иначе задачу может собрать GC посреди рассылки
+        task.add_done_callback(NOTIFY_TASKS.discard)
+        task.add_done_callback(log_task_error)
+    else:
+        await call.answer()
+
+    text, markup = await digest_view(digest_id, order_ids, page)
+    try:
+        await call.message.edit_text(text, reply_markup=markup)
+    except Exception:
+        pass
+
+
+# ---------------- ADMIN: BROADCAST ----------------
+@dp.message(F.text == "/broadcast_status")
+async def broadcast_status(message: Message):
+    if message.from_user.id not in ADMIN_IDS:
+        return
+    await message.answer(broadcast.report_text(await STORE.broadcast_last()))
+
+
+@dp.message(F.text == "/broadcast_cancel")
+async def broadcast_cancel(message: Message):
+    if message.from_user.id not in ADMIN_IDS:
+        return
+    rows = await STORE.broadcast_running()
+    for row in rows:
+        await STORE.broadcast_finish(row[0], "cancelled")
+    await message.answer("⏹ Отменено / Cancelled" if rows else "Нет активной рассылки / Nothing running")
+
+
+@dp.message(F.text.startswith("/broadcast"))
+async def broadcast_cmd(message: Message, bot: Bot):
+    if message.from_user.id not in ADMIN_IDS:
+        return
+
+    text = message.text.partition(" ")[2].strip()
+    if not text:
+        await message.answer("/broadcast <текст / Text>")
+        return
+
+    created = await STORE.broadcast_create(text, message.from_user.id)
+    if not created:
+        await message.answer("Рассылка уже идёт / Already running: /broadcast_status")
+        return
+
+    bid, total = created
+    broadcast.start(bot, STORE, bid, BROADCAST_RATE, SEND_LIMITER)
+    await message.answer(f"📣 Broadcast #{bid} started: {total} recipients")
+
+
+# ---------------- ADMIN: STOCK LEDGER ----------------
+@dp.message(F.text == "/reconcile")
+async def reconcile_cmd(message: Message):
+    if message.from_user.id not in ADMIN_IDS:
+        return
+    rows = await STORE.stock_reconcile()
+    if not rows:
+        await message.answer("✅ Склад сходится с журналом / Stock matches the ledger")
+        return
+    lines = [f"⚠️ Расхождения / Mismatches: {len(rows)}"]
+    for pid, title, stock, ledger in rows[:30]:
+        lines.append(f"#{pid} {title or '—'}: stock={stock} ledger={ledger}")
+    await message.answer("\n".join(lines))
+
+
+@dp.message(F.text.startswith("/stock_moves"))
+async def stock_moves_cmd(message: Message):
+    if message.from_user.id not in ADMIN_IDS:
+        return
+    arg = message.text.partition(" ")[2].strip()
+    if not arg.isdigit():
+        await message.answer("/stock_moves <product_id>")
+        return
+    pid = int(arg)
+    moves = await STORE.stock_moves(pid, limit=20)
+    lines = [f"📦 #{pid}: stock (ledger) = {await STORE.stock_at(pid)}"]
+    for _id, delta, reason, user_id, order_id, created_at in moves:
+        ref = f" order #{order_id}" if order_id else (f" user {user_id}" if user_id else "")
+        lines.append(f"{created_at} {delta:+d} {reason}{ref}")
+    await message.answer("\n".join(lines))
+
 
 # ---------------- BACKGROUND ----------------
 async def cart_expiry_worker(bot: Bot):
     while True:
         try:
-            users = db.stale_cart_users(minutes=30)
+            users = await STORE.stale_cart_users(minutes=30)
             for uid in users:
-                db.release_cart(uid)
+                await STORE.release_cart(uid)
+                CAROUSEL.invalidate(uid)
                 try:
-                    lg = lang(uid)
+                    lg = await lang(uid)
                     text = (
                         "⏱ Корзина очищена (30 минут без активности). Товары снова в наличии."
                         if lg == "ru"
@@ -467,13 +865,84 @@ async def cart_expiry_worker(bot: Bot):
         await asyncio.sleep(60)
 
 
+async def retention_worker():
+    """
+    Периодически переносит старые завершённые заказы в архив и по шагам
+    возвращает освободившиеся страницы (incremental_vacuum). Между батчами
+    отдаём управление циклу, чтобы покупатели не ждали.
+    """
+    while True:
+        try:
+            while await STORE.run(db.archive_orders_batch, ARCHIVE_AFTER_DAYS) > 0:
+                await asyncio.sleep(0.05)
+            await STORE.run(db.prune_settings)
+            # без auto_vacuum=INCREMENTAL (миграция не прошла, файл подменили) freelist не уменьшается —
+            # останавливаемся, как только шаг ничего не освободил
+            left = None
+            for _ in range(VACUUM_MAX_STEPS):
+                now = await STORE.run(db.incremental_vacuum, VACUUM_STEP_PAGES)
+                if now == 0 or (left is not None and now >= left):
+                    break
+                left = now
+                await asyncio.sleep(0.05)
+        except Exception:
+            pass
+        await asyncio.sleep(ARCHIVE_INTERVAL_MIN * 60)
+
+
+async def backup_worker():
+    while True:
+        await asyncio.sleep(BACKUP_INTERVAL_MIN * 60)
+        try:
+            await backup.backup_once(Path(BACKUP_DIR), keep=BACKUP_KEEP, db_file=STORE.path)
+        except Exception:
+            pass
+
+
+async def ledger_worker():
+    """Снимок остатков по журналу: stock_at и сверка читают движения только после последнего снимка."""
+    while True:
+        await asyncio.sleep(LEDGER_SNAPSHOT_MIN * 60)
+        try:
+            await STORE.stock_snapshot()
+        except Exception:
+            pass
+
+
 # ---------------- WEB SERVER (Render) ----------------
 async def start_web_server():
     async def handle(request):
         return web.Response(text="OK")
 
+    async def handle_health(request):
+        # сюда дошли — значит loop отвечает; degraded, если недавно были длинные блокировки.
+        # Выключенный монитор лаг не меряет — тогда просто ok
+        loop = LOOP_MONITOR.stats()
+        status = "degraded" if loop["running"] and loop["lag_ms_p99"] >= loop["threshold_ms"] else "ok"
+        return web.json_response({"status": status, "loop": loop, "dispatch": USER_GUARD.stats()})
+
+    def shop_stats(t: Tenant) -> dict:
+        return {
+            "cart_render": t.cart_render.stats(),
+            "order_digest": t.order_digest.stats(),
+            "my_orders_cache": t.my_orders.stats(),
+            "stock_alerts": t.stock_alerts.stats(),
+            "carousel": t.carousel.stats(),
+            "send_limiter": t.send_limiter.stats(),
+        }
+
+    async def handle_stats(request):
+        data = {"loop": LOOP_MONITOR.stats(), "dispatch": USER_GUARD.stats()}
+        if len(TENANTS) == 1:
+            data.update(shop_stats(TENANTS[0]))
+        else:
+            data["shops"] = {t.name: shop_stats(t) for t in TENANTS}
+        return web.json_response(data)
+
     app = web.Application()
     app.router.add_get("/", handle)
+    app.router.add_get("/health", handle_health)
+    app.router.add_get("/stats", handle_stats)
 
     runner = web.AppRunner(app)
     await runner.setup()
@@ -486,21 +955,66 @@ async def start_web_server():
 
 
 # ---------------- MAIN ----------------
+def load_tenants() -> list:
+    """Магазины из TENANTS_FILE; без него — один магазин по умолчанию."""
+    if not TENANTS_FILE:
+        return [tenants.current()]
+
+    # SQLite-магазины делят пул потоков; очередь к каждой базе — своя (SqliteStorage)
+    executor = ThreadPoolExecutor(max_workers=TENANT_DB_THREADS, thread_name_prefix="sqlite")
+    shops = []
+    for cfg in tenants.load_config(Path(TENANTS_FILE)):
+        store = create_storage(cfg["storage_url"], cfg.get("schema"), executor, cfg.get("pool_size", 2))
+        admin_ids = {int(x) for x in cfg.get("admin_ids", [])}
+        shops.append(make_tenant(cfg["name"], cfg["token"], store, admin_ids, cfg.get("currency", "EUR")))
+    return shops
+
+
+async def start_tenant(t: Tenant, session=None):
+    """
+    Запуск одного магазина. Вызывать через tenants.within(t, ...) — фоновые задачи наследуют магазин.
+    session — подменная HTTP-сессия Bot (bench_tenants.py), в бою None.
+    """
+    await t.store.init()
+    t.bot = Bot(t.token, session=session)
+    t.stock_alerts.attach(t.bot)
+    TENANT_ROUTER.register(t)
+
+    # background tasks
+    asyncio.create_task(cart_expiry_worker(t.bot))
+    # архив, vacuum и файловые снимки — только для SQLite (у PostgreSQL свои средства)
+    if t.store.kind == "sqlite" and ARCHIVE_AFTER_DAYS > 0:
+        asyncio.create_task(retention_worker())
+    if t.store.kind == "sqlite" and BACKUP_INTERVAL_MIN > 0:
+        asyncio.create_task(backup_worker())
+    if LEDGER_SNAPSHOT_MIN > 0:
+        asyncio.create_task(ledger_worker())
+    await broadcast.resume_all(t.bot, t.store, BROADCAST_RATE, t.send_limiter)  # недоделанные рассылки после рестарта
+    await t.order_digest.resume(lambda did, ids: send_digest(t.bot, did, ids))  # заказы, ждавшие дайджеста
+
+    # IMPORTANT: remove webhook to avoid 409 conflict
+    await t.bot.delete_webhook(drop_pending_updates=True)
+
+
 async def main():
-    db.init_db()
+    TENANTS.extend(load_tenants())
+    if LOOP_BLOCK_THRESHOLD > 0:
+        LOOP_MONITOR.start()
+
+    # «сообщить о поступлении»: событие склада приходит в контексте магазина, где оно случилось
+    loop = asyncio.get_running_loop()
+    events.stock_changed.connect(lambda pid, old, new: STOCK_ALERTS.on_stock_changed(pid, old, new), loop)
+    # карусель: окна с изменившимся товаром перечитываются из базы
+    events.stock_changed.connect(lambda pid, old, new: CAROUSEL.drop_product(pid), loop)
+    events.product_changed.connect(lambda pid: CAROUSEL.drop_product(pid), loop)
 
-    bot = Bot(BOT_TOKEN)
+    # gather — у каждого магазина своя задача и свой контекст
+    await asyncio.gather(*(tenants.within(t, start_tenant(t)) for t in TENANTS))
 
     # Render keep-alive server
     await start_web_server()
 
-    # background tasks
-    asyncio.create_task(cart_expiry_worker(bot))
-
-    # IMPORTANT: remove webhook to avoid 409 conflict
-    await bot.delete_webhook(drop_pending_updates=True)
-
-    await dp.start_polling(bot)
+    await dp.start_polling(*(t.bot for t in TENANTS))
 
 
 if __name__ == "__main__":
@@ -0,0 +1,204 @@
+import asyncio
+import time
+from collections import deque
+from contextlib import asynccontextmanager
+from typing import Any, Awaitable, Callable, Dict
+
+from aiogram import BaseMiddleware
+from aiogram.types import TelegramObject, Update
+
+import tenants
+
+
+class _UserSlot:
+    __slots__ = ("lock", "refs")
+
+    def __init__(self):
+        self.lock = asyncio.Lock()
+        self.refs = 0
+
+
+class _NoLock:
+    """Апдейт без пользователя: очереди пользователя нет, ждём только общий семафор."""
+
+    async def __aenter__(self):
+        return None
+
+    async def __aexit__(self, *exc):
+        return False
+
+
+_NO_LOCK = _NoLock()
+
+
+class UserSerialMiddleware(BaseMiddleware):
+    """
+    Outer-middleware на dp.update:
+    - апдейты одного пользователя обрабатываются строго по очереди
+      (двойной тап add:/rm1: больше не гоняется в db.py read-then-write);
+    - одновременно выполняется не больше max_in_flight хендлеров;
+    - если ждущих апдейтов больше max_queue (или у одного юзера больше max_per_user) — апдейт сбрасывается.
+
+    Замок пользователя живёт, пока на нём есть ждущие/работающие апдейты, потом удаляется,
+    так что память ~ числу активных прямо сейчас пользователей.
+    """
+
+    def __init__(self, max_in_flight: int = 32, max_queue: int = 1000, max_per_user: int = 5,
+                 samples: int = 2048):
+        self.max_in_flight = max_in_flight
+        self.max_queue = max_queue
+        self.max_per_user = max_per_user
+
+        self._slots: Dict[int, _UserSlot] = {}
+        self._sem = asyncio.Semaphore(max_in_flight)
+
+        self.in_flight = 0
+        self.queued = 0
+        self.peak_queued = 0
+        self.peak_locks = 0
+        self.handled = 0
+        self.shed = 0
+        self.evicted = 0
+        self._waits = deque(maxlen=samples)
+
+    async def __call__(
+        self,
+        handler: Callable[[TelegramObject, Dict[str, Any]], Awaitable[Any]],
+        event: TelegramObject,
+        data: Dict[str, Any],
+    ) -> Any:
+        user = data.get("event_from_user")
+        if user is None:
+            # channel_post, my_chat_member без from_user и т.п.: без очереди пользователя,
+            # но с тем же общим лимитом max_in_flight и сбросом при переполнении
+            if self.queued >= self.max_queue:
+                return await self._shed(event)
+            return await self._admit(handler, event, data, _NO_LOCK)
+
+        # один и тот же человек в двух магазинах — это две независимые очереди
+        bot = data.get("bot")
+        key = (bot.id if bot else 0, user.id)
+
+        slot = self._slots.get(key)
+        if slot is None:
+            slot = self._slots[key] = _UserSlot()
+            self.peak_locks = max(self.peak_locks, len(self._slots))
+
+        if self.queued >= self.max_queue or slot.refs >= self.max_per_user:
+            if slot.refs == 0:
+                del self._slots[key]
+            return await self._shed(event)
+
+        slot.refs += 1
+        try:
+            return await self._admit(handler, event, data, slot.lock)
+        finally:
+            slot.refs -= 1
+            if slot.refs == 0 and self._slots.get(key) is slot:
+                del self._slots[key]
+                self.evicted += 1
+
+    @asynccontextmanager
+    async def hold(self, bot_id: int, user_id: int):
+        """
+        Очередь пользователя для работы вне апдейта (отложенная перерисовка корзины):
+        внутри не выполняется ни один хендлер этого пользователя.
+        """
+        key = (bot_id, user_id)
+        slot = self._slots.get(key)
+        if slot is None:
+            slot = self._slots[key] = _UserSlot()
+        slot.refs += 1
+        try:
+            async with slot.lock:
+                yield
+        finally:
+            slot.refs -= 1
+            if slot.refs == 0 and self._slots.get(key) is slot:
+                del self._slots[key]
+
+    async def _admit(self, handler, event, data, lock):
+        """Очередь: замок (пользователя или _NO_LOCK), потом место среди max_in_flight."""
+        self.queued += 1
+        self.peak_queued = max(self.peak_queued, self.queued)
+        t0 = time.perf_counter()
+        try:
+            async with lock:
+                async with self._sem:
+                    self.queued -= 1
+                    self._waits.append(time.perf_counter() - t0)
+                    t0 = None
+                    return await self._run(handler, event, data)
+        finally:
+            if t0 is not None:
+                # отменили, пока ждали в очереди
+                self.queued -= 1
+
+    async def _run(self, handler, event, data):
+        self.in_flight += 1
+        try:
+            return await handler(event, data)
+        finally:
+            self.in_flight -= 1
+            self.handled += 1
+
+    async def _shed(self, event: TelegramObject):
+        self.shed += 1
+        # чтобы у кнопки не крутились часики — отвечаем на callback без алерта
+        if isinstance(event, Update) and event.callback_query:
+            try:
+                await event.callback_query.answer("⏳")
+            except Exception:
+                pass
+        return None
+
+    def stats(self) -> dict:
+        waits = sorted(self._waits)
+
+        def pct(p):
+            if not waits:
+                return 0.0
+            return round(waits[min(len(waits) - 1, int(len(waits) * p))] * 1000, 3)
+
+        return {
+            "in_flight": self.in_flight,
+            "queued": self.queued,
+            "peak_queued": self.peak_queued,
+            "handled": self.handled,
+            "shed": self.shed,
+            "user_locks": len(self._slots),
+            "peak_user_locks": self.peak_locks,
+            "evicted_locks": self.evicted,
+            "wait_ms_p50": pct(0.50),
+            "wait_ms_p95": pct(0.95),
+            "wait_ms_p99": pct(0.99),
+        }
+
+
+class TenantMiddleware(BaseMiddleware):
+    """
+    Outer-middleware на dp.update (ставится первым): по боту, получившему апдейт,
+    выбирает магазин (tenants.CURRENT) на всё время обработки. Бот не из списка
+    (один магазин без TENANTS_FILE) — работает магазин по умолчанию.
+    """
+
+    def __init__(self):
+        self.by_bot: Dict[int, "tenants.Tenant"] = {}
+
+    def register(self, tenant: "tenants.Tenant"):
+        self.by_bot[tenant.bot.id] = tenant
+
+    async def __call__(
+        self,
+        handler: Callable[[TelegramObject, Dict[str, Any]], Awaitable[Any]],
+        event: TelegramObject,
+        data: Dict[str, Any],
+    ) -> Any:
+        tenant = self.by_bot.get(data["bot"].id)
+        if tenant is None:
+            return await handler(event, data)
+        token = tenants.CURRENT.set(tenant)
+        try:
+            return await handler(event, data)
+        finally:
+            tenants.CURRENT.reset(token)
@@ -0,0 +1,48 @@
+import time
+from collections import OrderedDict
+from typing import Optional
+
+
+class RecentOrdersCache:
+    """
+    Первая страница «Моих заказов» на пользователя (LRU на max_users записей).
+    Сбрасывается при новом заказе и смене статуса заказа покупателя,
+    а также по ttl — на случай изменений из другого процесса.
+    """
+
+    def __init__(self, max_users: int = 5000, ttl: float = 300):
+        self.max_users = max_users
+        self.ttl = ttl
+        self._pages: "OrderedDict[int, tuple]" = OrderedDict()  # user_id -> (expires_at, page)
+
+        self.hits = 0
+        self.misses = 0
+        self.invalidations = 0
+
+    def get(self, user_id: int) -> Optional[dict]:
+        entry = self._pages.get(user_id)
+        if entry is None or entry[0] < time.monotonic():
+            self._pages.pop(user_id, None)
+            self.misses += 1
+            return None
+        self._pages.move_to_end(user_id)
+        self.hits += 1
+        return entry[1]
+
+    def put(self, user_id: int, page: dict):
+        self._pages[user_id] = (time.monotonic() + self.ttl, page)
+        self._pages.move_to_end(user_id)
+        while len(self._pages) > self.max_users:
+            self._pages.popitem(last=False)
+
+    def invalidate(self, user_id: int):
+        if self._pages.pop(user_id, None) is not None:
+            self.invalidations += 1
+
+    def stats(self) -> dict:
+        return {
+            "users": len(self._pages),
+            "hits": self.hits,
+            "misses": self.misses,
+            "invalidations": self.invalidations,
+        }
@@ -0,0 +1,709 @@
+"""
+PostgreSQL-реализация Storage на asyncpg.
+
+- пул соединений (min_size/max_size);
+- резерв склада под построчной блокировкой (SELECT ... FOR UPDATE), так что
+  несколько процессов бота могут работать с одной базой без пересорта;
+- asyncpg сам готовит (PREPARE) каждый запрос и кэширует его на соединении,
+  поэтому все запросы здесь — константные строки с $n-параметрами.
+
+Нужен пакет asyncpg (pip install asyncpg).
+"""
+import datetime
+from typing import List, Optional
+
+import events
+from storage import Storage
+
+SCHEMA = [
+    """
+    CREATE TABLE IF NOT EXISTS products(
+        id BIGSERIAL PRIMARY KEY,
+        category TEXT NOT NULL,
+        title TEXT NOT NULL,
+        price_cents INTEGER NOT NULL,
+        stock INTEGER NOT NULL DEFAULT 0,
+        photo_file_id TEXT
+    )
+    """,
+    "CREATE INDEX IF NOT EXISTS idx_products_category ON products(category, id)",
+    """
+    CREATE TABLE IF NOT EXISTS cart(
+        user_id BIGINT NOT NULL,
+        product_id BIGINT NOT NULL,
+        qty INTEGER NOT NULL,
+        updated_at TIMESTAMP NOT NULL DEFAULT (now() AT TIME ZONE 'utc'),
+        PRIMARY KEY(user_id, product_id)
+    )
+    """,
+    "CREATE INDEX IF NOT EXISTS idx_cart_updated ON cart(updated_at)",
+    """
+    CREATE TABLE IF NOT EXISTS orders(
+        id BIGSERIAL PRIMARY KEY,
+        user_id BIGINT NOT NULL,
+        name TEXT,
+        phone TEXT,
+        address TEXT,
+        pay_method TEXT,
+        total_cents INTEGER NOT NULL,
+        created_at TIMESTAMP NOT NULL DEFAULT (now() AT TIME ZONE 'utc'),
+        status TEXT DEFAULT 'new',
+        tg_username TEXT,
+        tg_name TEXT
+    )
+    """,
+    "CREATE INDEX IF NOT EXISTS idx_orders_status ON orders(status, id)",
+    "CREATE INDEX IF NOT EXISTS idx_orders_user ON orders(user_id, id)",
+    """
+    CREATE TABLE IF NOT EXISTS order_items(
+        order_id BIGINT NOT NULL,
+        product_id BIGINT NOT NULL,
+        title TEXT NOT NULL,
+        price_cents INTEGER NOT NULL,
+        qty INTEGER NOT NULL
+    )
+    """,
+    "CREATE INDEX IF NOT EXISTS idx_order_items_order ON order_items(order_id)",
+    """
+    CREATE TABLE IF NOT EXISTS settings(
+        key TEXT PRIMARY KEY,
+        value TEXT NOT NULL
+    )
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS broadcasts(
+        id BIGSERIAL PRIMARY KEY,
+        text TEXT NOT NULL,
+        created_by BIGINT,
+        status TEXT NOT NULL DEFAULT 'running',
+        total INTEGER NOT NULL DEFAULT 0,
+        last_user_id BIGINT NOT NULL DEFAULT 0,
+        delivered INTEGER NOT NULL DEFAULT 0,
+        blocked INTEGER NOT NULL DEFAULT 0,
+        failed INTEGER NOT NULL DEFAULT 0,
+        created_at TIMESTAMP NOT NULL DEFAULT (now() AT TIME ZONE 'utc')
+    )
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS broadcast_recipients(
+        broadcast_id BIGINT NOT NULL,
+        user_id BIGINT NOT NULL,
+        PRIMARY KEY(broadcast_id, user_id)
+    )
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS stock_subs(
+        product_id BIGINT NOT NULL,
+        user_id BIGINT NOT NULL,
+        created_at TIMESTAMP NOT NULL DEFAULT (now() AT TIME ZONE 'utc'),
+        PRIMARY KEY(product_id, user_id)
+    )
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS stock_moves(
+        id BIGSERIAL PRIMARY KEY,
+        product_id BIGINT NOT NULL,
+        delta INTEGER NOT NULL,
+        reason TEXT NOT NULL,
+        user_id BIGINT,
+        order_id BIGINT,
+        created_at TIMESTAMP NOT NULL DEFAULT (now() AT TIME ZONE 'utc')
+    )
+    """,
+    "CREATE INDEX IF NOT EXISTS idx_stock_moves_product ON stock_moves(product_id, id)",
+    """
+    CREATE TABLE IF NOT EXISTS stock_snapshots(
+        id BIGSERIAL PRIMARY KEY,
+        last_move_id BIGINT NOT NULL,
+        created_at TIMESTAMP NOT NULL DEFAULT (now() AT TIME ZONE 'utc')
+    )
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS stock_snapshot_items(
+        snapshot_id BIGINT NOT NULL,
+        product_id BIGINT NOT NULL,
+        stock INTEGER NOT NULL,
+        PRIMARY KEY(snapshot_id, product_id)
+    )
+    """,
+    # журнал появился на живой базе — текущие остатки становятся начальными движениями
+    """
+    INSERT INTO stock_moves(product_id, delta, reason)
+    SELECT id, stock, 'opening' FROM products
+    WHERE stock != 0 AND NOT EXISTS (SELECT 1 FROM stock_moves)
+    """,
+]
+
+ORDER_FIELDS = "id, user_id, status, tg_username, tg_name, name, phone, address, pay_method, total_cents"
+BROADCAST_FIELDS = "id, text, created_by, status, total, last_user_id, delivered, blocked, failed"
+
+# Движения склада (журнал stock_moves) — executemany в той же транзакции, что и UPDATE stock
+LOG_MOVE_SQL = "INSERT INTO stock_moves(product_id, delta, reason, user_id, order_id) VALUES($1,$2,$3,$4,$5)"
+
+# Склад += количество из позиций заказов (возврат при отклонении / отмене), движение — на каждую позицию.
+# RETURNING (id, old, new) — для events.stock_changed
+RESTOCK_ORDERS_SQL = """
+    WITH i AS (SELECT order_id, product_id, qty FROM order_items WHERE order_id = ANY($1::bigint[])),
+    m AS (
+        INSERT INTO stock_moves(product_id, delta, reason, order_id)
+        SELECT i.product_id, i.qty, 'order_restock', i.order_id FROM i JOIN products p ON p.id = i.product_id
+        WHERE i.qty > 0
+    )
+    UPDATE products p SET stock = p.stock + s.qty
+    FROM (SELECT product_id, SUM(qty) AS qty FROM i GROUP BY product_id) s
+    WHERE p.id = s.product_id
+    RETURNING p.id, p.stock - s.qty, p.stock
+"""
+
+# Очистить корзину и вернуть всё на склад одним запросом ($2 — причина: cart_return / cart_expired)
+RELEASE_CART_SQL = """
+    WITH d AS (DELETE FROM cart WHERE user_id=$1 RETURNING product_id, qty),
+    m AS (
+        INSERT INTO stock_moves(product_id, delta, reason, user_id)
+        SELECT d.product_id, d.qty, $2, $1 FROM d JOIN products p ON p.id = d.product_id
+        WHERE d.qty > 0
+    )
+    UPDATE products p SET stock = p.stock + d.qty FROM d WHERE p.id = d.product_id
+    RETURNING p.id, p.stock - d.qty, p.stock
+"""
+
+# Ручная правка склада админом: старое значение из той же строки, движение = разница ($3 — причина)
+ADMIN_STOCK_SQL = """
+    WITH o AS (SELECT id, stock FROM products WHERE id=$1 FOR UPDATE),
+    u AS (
+        UPDATE products p SET stock = {new} FROM o WHERE p.id = o.id
+        RETURNING p.id, o.stock AS old, p.stock AS new
+    ),
+    m AS (
+        INSERT INTO stock_moves(product_id, delta, reason, user_id)
+        SELECT id, new - old, $3, $4 FROM u WHERE new != old
+    )
+    SELECT id, old, new FROM u
+"""
+
+# Остаток по журналу = остатки снимка $1 + движения в (last_move_id $2, $3]
+LEDGER_SINCE_SNAPSHOT_SQL = """
+    SELECT product_id, SUM(q)::bigint AS q FROM (
+        SELECT product_id, stock AS q FROM stock_snapshot_items WHERE snapshot_id=$1
+        UNION ALL
+        SELECT product_id, delta FROM stock_moves WHERE id > $2 AND id <= $3
+    ) x GROUP BY product_id
+"""
+
+
+def _rows(rows):
+    return [tuple(r) for r in rows]
+
+
+def _row(r):
+    return tuple(r) if r is not None else None
+
+
+def _emit_stock(rows):
+    """Событие шлём только после коммита и только на рост склада — как db._emit_stock."""
+    for pid, old, new in rows:
+        if new > old:
+            events.stock_changed.emit(int(pid), int(old), int(new))
+
+
+def _affected(status: str) -> int:
+    # asyncpg отдаёт статус команды вида "INSERT 0 42" / "UPDATE 3"
+    try:
+        return int(status.rsplit(" ", 1)[-1])
+    except (ValueError, AttributeError):
+        return 0
+
+
+class PostgresStorage(Storage):
+    kind = "postgres"
+
+    def __init__(self, dsn: str, min_size: int = 2, max_size: int = 10, schema: Optional[str] = None):
+        self.dsn = dsn
+        self.min_size = min_size
+        self.max_size = max_size
+        self.schema = schema  # отдельная схема на магазин (tenants.py)
+        self.pool = None
+
+    async def init(self):
+        try:
+            import asyncpg
+        except ImportError as e:
+            raise RuntimeError("PostgreSQL storage needs asyncpg: pip install asyncpg") from e
+
+        settings = {"search_path": self.schema} if self.schema else None
+        self.pool = await asyncpg.create_pool(
+            self.dsn, min_size=self.min_size, max_size=self.max_size, statement_cache_size=256,
+            server_settings=settings,
+        )
+        async with self.pool.acquire() as con:
+            async with con.transaction():
+                # несколько процессов могут стартовать одновременно
+                await con.execute("SELECT pg_advisory_xact_lock(727001)")
+                if self.schema:
+                    await con.execute(f'CREATE SCHEMA IF NOT EXISTS "{self.schema}"')
+                for stmt in SCHEMA:
+                    await con.execute(stmt)
+
+    async def close(self):
+        if self.pool:
+            await self.pool.close()
+
+    # ---------- Products ----------
+    async def add_product(self, category, title, price_cents, stock, photo_file_id=None):
+        await self.pool.execute("""
+            WITH p AS (
+                INSERT INTO products(category,title,price_cents,stock,photo_file_id) VALUES($1,$2,$3,$4,$5)
+                RETURNING id, stock
+            )
+            INSERT INTO stock_moves(product_id, delta, reason) SELECT id, stock, 'added' FROM p WHERE stock != 0
+        """, category, title, int(price_cents), int(stock), photo_file_id)
+
+    async def list_categories(self) -> List[str]:
+        rows = await self.pool.fetch("SELECT DISTINCT category FROM products ORDER BY category")
+        return [r[0] for r in rows]
+
+    async def list_products(self, category):
+        return _rows(await self.pool.fetch(
+            "SELECT id, title, price_cents, stock FROM products WHERE category=$1 ORDER BY id DESC", category,
+        ))
+
+    async def get_product(self, pid):
+        return _row(await self.pool.fetchrow(
+            "SELECT id, category, title, price_cents, stock, photo_file_id FROM products WHERE id=$1", int(pid),
+        ))
+
+    async def product_window(self, pid, radius):
+        return _rows(await self.pool.fetch("""
+            WITH c AS (SELECT category FROM products WHERE id=$1)
+            SELECT id, category, title, price_cents, stock, photo_file_id FROM (
+                (SELECT p.* FROM products p, c WHERE p.category=c.category AND p.id>$1 ORDER BY p.id LIMIT $2)
+                UNION ALL
+                SELECT * FROM products WHERE id=$1
+                UNION ALL
+                (SELECT p.* FROM products p, c WHERE p.category=c.category AND p.id<$1 ORDER BY p.id DESC LIMIT $2)
+            ) w ORDER BY id DESC
+        """, int(pid), int(radius)))
+
+    async def products_all(self):
+        return _rows(await self.pool.fetch(
+            "SELECT id, category, title, price_cents, stock FROM products ORDER BY category, title"
+        ))
+
+    async def product_set_stock(self, pid: int, stock: int, user_id: Optional[int] = None) -> int:
+        stock = max(0, int(stock))
+        row = await self.pool.fetchrow(
+            ADMIN_STOCK_SQL.format(new="$2"), int(pid), stock, "admin_set", user_id,
+        )
+        if row:
+            _emit_stock([row])
+            events.product_changed.emit(int(pid))
+        return stock
+
+    async def product_stock_delta(self, pid: int, delta: int, user_id: Optional[int] = None) -> int:
+        row = await self.pool.fetchrow(
+            ADMIN_STOCK_SQL.format(new="GREATEST(0, p.stock + $2)"), int(pid), int(delta), "admin_delta", user_id,
+        )
+        if row is None:
+            return -1
+        _emit_stock([row])
+        events.product_changed.emit(int(pid))
+        return int(row[2])
+
+    async def product_set_price(self, pid: int, price_cents: int) -> int:
+        price_cents = max(0, int(price_cents))
+        await self.pool.execute("UPDATE products SET price_cents=$2 WHERE id=$1", int(pid), price_cents)
+        events.product_changed.emit(int(pid))
+        return price_cents
+
+    async def product_delete(self, pid: int) -> bool:
+        async with self.pool.acquire() as con:
+            async with con.transaction():
+                await con.execute(
+                    "INSERT INTO stock_moves(product_id, delta, reason) "
+                    "SELECT id, -stock, 'deleted' FROM products WHERE id=$1 AND stock != 0",
+                    int(pid),
+                )
+                await con.execute("DELETE FROM products WHERE id=$1", int(pid))
+                await con.execute("DELETE FROM cart WHERE product_id=$1", int(pid))
+                await con.execute("DELETE FROM stock_subs WHERE product_id=$1", int(pid))
+        events.product_changed.emit(int(pid))
+        return True
+
+    # ---------- Cart ----------
+    async def cart_items(self, user_id):
+        return _rows(await self.pool.fetch("""
+            SELECT c.product_id, p.title, p.price_cents, c.qty
+            FROM cart c
+            JOIN products p ON p.id=c.product_id
+            WHERE c.user_id=$1
+            ORDER BY p.title
+        """, int(user_id)))
+
+    async def cart_add_reserve(self, user_id: int, pid: int, qty: int) -> int:
+        async with self.pool.acquire() as con:
+            async with con.transaction():
+                # строка товара заблокирована до конца транзакции — параллельный резерв подождёт
+                stock = await con.fetchval("SELECT stock FROM products WHERE id=$1 FOR UPDATE", int(pid))
+                if stock is None or stock <= 0:
+                    return 0
+                add_qty = min(int(qty), int(stock))
+                await con.execute("UPDATE products SET stock = stock - $2 WHERE id=$1", int(pid), add_qty)
+                await con.execute(LOG_MOVE_SQL, int(pid), -add_qty, "reserve", int(user_id), None)
+                await con.execute("""
+                    INSERT INTO cart(user_id, product_id, qty, updated_at)
+                    VALUES($1, $2, $3, now() AT TIME ZONE 'utc')
+                    ON CONFLICT (user_id, product_id) DO UPDATE SET qty = cart.qty + EXCLUDED.qty
+                """, int(user_id), int(pid), add_qty)
+                await con.execute(
+                    "UPDATE cart SET updated_at = now() AT TIME ZONE 'utc' WHERE user_id=$1", int(user_id)
+                )
+                return add_qty
+
+    async def cart_remove_return(self, user_id: int, pid: int, qty: int) -> int:
+        async with self.pool.acquire() as con:
+            async with con.transaction():
+                have = await con.fetchval(
+                    "SELECT qty FROM cart WHERE user_id=$1 AND product_id=$2 FOR UPDATE", int(user_id), int(pid),
+                )
+                if have is None:
+                    return 0
+                rem = min(int(qty), int(have))
+                if have - rem <= 0:
+                    await con.execute("DELETE FROM cart WHERE user_id=$1 AND product_id=$2", int(user_id), int(pid))
+                else:
+                    await con.execute(
+                        "UPDATE cart SET qty=$3 WHERE user_id=$1 AND product_id=$2",
+                        int(user_id), int(pid), have - rem,
+                    )
+                changed = await con.fetch(
+                    "UPDATE products SET stock = stock + $2 WHERE id=$1 RETURNING id, stock - $2, stock",
+                    int(pid), rem,
+                )
+                if changed and rem > 0:
+                    await con.execute(LOG_MOVE_SQL, int(pid), rem, "cart_return", int(user_id), None)
+                await con.execute(
+                    "UPDATE cart SET updated_at = now() AT TIME ZONE 'utc' WHERE user_id=$1", int(user_id)
+                )
+        _emit_stock(changed)
+        return rem
+
+    async def cart_clear_return(self, user_id: int):
+        _emit_stock(await self.pool.fetch(RELEASE_CART_SQL, int(user_id), "cart_return"))
+
+    async def stale_cart_users(self, minutes: int = 30) -> List[int]:
+        rows = await self.pool.fetch(
+            "SELECT DISTINCT user_id FROM cart "
+            "WHERE updated_at <= (now() AT TIME ZONE 'utc') - make_interval(mins => $1)",
+            int(minutes),
+        )
+        return [int(r[0]) for r in rows]
+
+    async def release_cart(self, user_id: int):
+        _emit_stock(await self.pool.fetch(RELEASE_CART_SQL, int(user_id), "cart_expired"))
+
+    # ---------- Orders ----------
+    async def create_order(self, user_id, name, phone, address, pay_method, tg_username=None, tg_name=None):
+        async with self.pool.acquire() as con:
+            async with con.transaction():
+                items = _rows(await con.fetch("""
+                    SELECT c.product_id, p.title, p.price_cents, c.qty
+                    FROM cart c
+                    JOIN products p ON p.id=c.product_id
+                    WHERE c.user_id=$1
+                    ORDER BY p.title
+                    FOR UPDATE OF c
+                """, int(user_id)))
+                if not items:
+                    return None
+
+                total = sum(int(price) * int(qty) for _pid, _title, price, qty in items)
+                order_id = await con.fetchval(
+                    "INSERT INTO orders(user_id,name,phone,address,pay_method,total_cents,status,tg_username,tg_name) "
+                    "VALUES($1,$2,$3,$4,$5,$6,'new',$7,$8) RETURNING id",
+                    int(user_id), name, phone, address, pay_method, total, tg_username, tg_name,
+                )
+                await con.executemany(
+                    "INSERT INTO order_items(order_id,product_id,title,price_cents,qty) VALUES($1,$2,$3,$4,$5)",
+                    [(order_id, pid, title, price, qty) for pid, title, price, qty in items],
+                )
+                await con.execute("DELETE FROM cart WHERE user_id=$1", int(user_id))
+        return order_id, total, items
+
+    async def get_order(self, order_id: int):
+        return _row(await self.pool.fetchrow(f"SELECT {ORDER_FIELDS} FROM orders WHERE id=$1", int(order_id)))
+
+    async def set_order_status(self, order_id: int, status: str):
+        await self.pool.execute("UPDATE orders SET status=$2 WHERE id=$1", int(order_id), status)
+
+    async def restock_order(self, order_id: int):
+        _emit_stock(await self.pool.fetch(RESTOCK_ORDERS_SQL, [int(order_id)]))
+
+    async def cancel_order(self, order_id: int):
+        async with self.pool.acquire() as con:
+            async with con.transaction():
+                changed = await con.fetch(RESTOCK_ORDERS_SQL, [int(order_id)])
+                await con.execute("UPDATE orders SET status='cancelled' WHERE id=$1", int(order_id))
+        _emit_stock(changed)
+        return True
+
+    async def list_orders(self, status: str = "new", limit: int = 20):
+        rows = await self.pool.fetch(
+            f"SELECT {ORDER_FIELDS}, created_at FROM orders WHERE status=$1 ORDER BY id DESC LIMIT $2",
+            status, int(limit),
+        )
+        # created_at отдаём строкой, как SQLite-бэкенд
+        return [(*tuple(r)[:-1], r["created_at"].isoformat()) for r in rows]
+
+    async def order_items_full(self, order_id: int):
+        return _rows(await self.pool.fetch(
+            "SELECT product_id, title, price_cents, qty FROM order_items WHERE order_id=$1 ORDER BY title",
+            int(order_id),
+        ))
+
+    async def user_orders_page(self, user_id: int, before_id: Optional[int] = None, limit: int = 5):
+        rows = await self.pool.fetch(
+            "SELECT id, status, total_cents, created_at FROM orders "
+            "WHERE user_id=$1 AND id<$2 ORDER BY id DESC LIMIT $3",
+            int(user_id), int(before_id) if before_id else 2 ** 62, int(limit),
+        )
+        return [(r[0], r[1], r[2], r[3].isoformat()) for r in rows]
+
+    async def order_items_batch(self, order_ids: List[int]):
+        if not order_ids:
+            return []
+        return _rows(await self.pool.fetch(
+            "SELECT order_id, product_id, title, price_cents, qty FROM order_items "
+            "WHERE order_id = ANY($1::bigint[]) ORDER BY order_id DESC, title",
+            [int(i) for i in order_ids],
+        ))
+
+    async def orders_brief(self, order_ids: List[int]):
+        if not order_ids:
+            return []
+        return _rows(await self.pool.fetch(
+            "SELECT id, status, name, tg_username, total_cents FROM orders WHERE id = ANY($1::bigint[]) ORDER BY id",
+            [int(i) for i in order_ids],
+        ))
+
+    async def set_orders_status_bulk(self, order_ids: List[int], status: str, restock: bool = False):
+        if not order_ids:
+            return []
+        restocked = []
+        async with self.pool.acquire() as con:
+            async with con.transaction():
+                changed = await con.fetch(
+                    "UPDATE orders SET status=$2 WHERE id = ANY($1::bigint[]) AND status='new' "
+                    "RETURNING id, user_id",
+                    [int(i) for i in order_ids], status,
+                )
+                if changed and restock:
+                    restocked = await con.fetch(RESTOCK_ORDERS_SQL, [int(r[0]) for r in changed])
+        _emit_stock(restocked)
+        return sorted((int(r[0]), int(r[1])) for r in changed)
+
+    async def _recalc_total(self, con, order_id: int) -> int:
+        return int(await con.fetchval(
+            "UPDATE orders SET total_cents = "
+            "(SELECT COALESCE(SUM(price_cents * qty), 0) FROM order_items WHERE order_id=$1) "
+            "WHERE id=$1 RETURNING total_cents",
+            int(order_id),
+        ) or 0)
+
+    async def order_item_delta(self, order_id: int, product_id: int, delta: int):
+        order_id, product_id, delta = int(order_id), int(product_id), int(delta)
+        restocked = []
+        async with self.pool.acquire() as con:
+            async with con.transaction():
+                row = await con.fetchrow(
+                    "SELECT qty FROM order_items WHERE order_id=$1 AND product_id=$2 FOR UPDATE",
+                    order_id, product_id,
+                )
+                if not row:
+                    return (False, 0, await self._recalc_total(con, order_id), "item_not_found")
+                qty = int(row[0])
+
+                if delta > 0:
+                    stock = await con.fetchval("SELECT stock FROM products WHERE id=$1 FOR UPDATE", product_id)
+                    if stock is None:
+                        return (False, qty, await self._recalc_total(con, order_id), "product_not_found")
+                    if stock < delta:
+                        return (False, qty, await self._recalc_total(con, order_id), "no_stock")
+                    await con.execute("UPDATE products SET stock = stock - $2 WHERE id=$1", product_id, delta)
+                    await con.execute(LOG_MOVE_SQL, product_id, -delta, "order_edit", None, order_id)
+                    new_qty = qty + delta
+                    await con.execute(
+                        "UPDATE order_items SET qty=$3 WHERE order_id=$1 AND product_id=$2",
+                        order_id, product_id, new_qty,
+                    )
+                else:
+                    real = min(abs(delta), qty)
+                    new_qty = qty - real
+                    restocked = await con.fetch(
+                        "UPDATE products SET stock = stock + $2 WHERE id=$1 RETURNING id, stock - $2, stock",
+                        product_id, real,
+                    )
+                    if restocked and real > 0:
+                        await con.execute(LOG_MOVE_SQL, product_id, real, "order_edit", None, order_id)
+                    if new_qty <= 0:
+                        await con.execute(
+                            "DELETE FROM order_items WHERE order_id=$1 AND product_id=$2", order_id, product_id
+                        )
+                    else:
+                        await con.execute(
+                            "UPDATE order_items SET qty=$3 WHERE order_id=$1 AND product_id=$2",
+                            order_id, product_id, new_qty,
+                        )
+
+                new_total = await self._recalc_total(con, order_id)
+        _emit_stock(restocked)
+        return (True, new_qty, new_total, "ok")
+
+    # ---------- Settings ----------
+    async def set_setting(self, key: str, value: str):
+        await self.pool.execute(
+            "INSERT INTO settings(key,value) VALUES($1,$2) ON CONFLICT(key) DO UPDATE SET value=EXCLUDED.value",
+            key, value,
+        )
+
+    async def get_setting(self, key: str) -> Optional[str]:
+        return await self.pool.fetchval("SELECT value FROM settings WHERE key=$1", key)
+
+    # ---------- Broadcasts ----------
+    async def broadcast_create(self, text: str, created_by: int):
+        async with self.pool.acquire() as con:
+            async with con.transaction():
+                await con.execute("LOCK TABLE broadcasts IN SHARE ROW EXCLUSIVE MODE")
+                if await con.fetchval("SELECT 1 FROM broadcasts WHERE status='running'"):
+                    return None
+                bid = await con.fetchval(
+                    "INSERT INTO broadcasts(text, created_by) VALUES($1,$2) RETURNING id", text, created_by,
+                )
+                status = await con.execute("""
+                    INSERT INTO broadcast_recipients(broadcast_id, user_id)
+                    SELECT $1, uid FROM (
+                        SELECT CAST(substr(key, 6) AS BIGINT) AS uid FROM settings WHERE key ~ '^lang:[0-9]+$'
+                        UNION SELECT user_id FROM orders
+                        UNION SELECT user_id FROM cart
+                    ) u WHERE uid > 0
+                    ON CONFLICT DO NOTHING
+                """, bid)
+                total = _affected(status)
+                await con.execute("UPDATE broadcasts SET total=$2 WHERE id=$1", bid, total)
+        return bid, total
+
+    async def broadcast_get(self, bid: int):
+        return _row(await self.pool.fetchrow(f"SELECT {BROADCAST_FIELDS} FROM broadcasts WHERE id=$1", int(bid)))
+
+    async def broadcast_running(self):
+        return _rows(await self.pool.fetch(
+            f"SELECT {BROADCAST_FIELDS} FROM broadcasts WHERE status='running' ORDER BY id"
+        ))
+
+    async def broadcast_last(self):
+        return _row(await self.pool.fetchrow(f"SELECT {BROADCAST_FIELDS} FROM broadcasts ORDER BY id DESC LIMIT 1"))
+
+    async def broadcast_recipients(self, bid: int, after_user_id: int, limit: int = 100) -> List[int]:
+        rows = await self.pool.fetch(
+            "SELECT user_id FROM broadcast_recipients WHERE broadcast_id=$1 AND user_id>$2 ORDER BY user_id LIMIT $3",
+            int(bid), int(after_user_id), int(limit),
+        )
+        return [int(r[0]) for r in rows]
+
+    async def broadcast_checkpoint(self, bid: int, last_user_id: int, delivered: int, blocked: int, failed: int):
+        await self.pool.execute(
+            "UPDATE broadcasts SET last_user_id=$2, delivered=$3, blocked=$4, failed=$5 WHERE id=$1",
+            int(bid), int(last_user_id), int(delivered), int(blocked), int(failed),
+        )
+
+    async def broadcast_finish(self, bid: int, status: str = "done"):
+        async with self.pool.acquire() as con:
+            async with con.transaction():
+                await con.execute("UPDATE broadcasts SET status=$2 WHERE id=$1", int(bid), status)
+                await con.execute("DELETE FROM broadcast_recipients WHERE broadcast_id=$1", int(bid))
+
+    # ---------- Stock subscriptions ----------
+    async def stock_subscribe(self, pid: int, user_id: int) -> bool:
+        status = await self.pool.execute(
+            "INSERT INTO stock_subs(product_id, user_id) VALUES($1,$2) ON CONFLICT DO NOTHING", int(pid), int(user_id),
+        )
+        return _affected(status) > 0
+
+    async def stock_subscribers(self, pid: int, after_user_id: int = 0, limit: int = 100) -> List[int]:
+        rows = await self.pool.fetch(
+            "SELECT user_id FROM stock_subs WHERE product_id=$1 AND user_id>$2 ORDER BY user_id LIMIT $3",
+            int(pid), int(after_user_id), int(limit),
+        )
+        return [int(r[0]) for r in rows]
+
+    async def stock_unsubscribe(self, pid: int, user_ids: List[int]):
+        if not user_ids:
+            return
+        await self.pool.execute(
+            "DELETE FROM stock_subs WHERE product_id=$1 AND user_id = ANY($2::bigint[])",
+            int(pid), [int(u) for u in user_ids],
+        )
+
+    # ---------- Stock ledger ----------
+    async def _last_snapshot(self, con, before: datetime.datetime = datetime.datetime.max):
+        row = await con.fetchrow(
+            "SELECT id, last_move_id FROM stock_snapshots WHERE created_at <= $1 ORDER BY id DESC LIMIT 1", before,
+        )
+        return (int(row[0]), int(row[1])) if row else (0, 0)
+
+    async def stock_snapshot(self) -> Optional[int]:
+        async with self.pool.acquire() as con:
+            async with con.transaction():
+                # SHARE ждёт незакоммиченные движения и не пускает новые — MAX(id) без «дыр» от параллельных транзакций
+                await con.execute("LOCK TABLE stock_moves IN SHARE MODE")
+                prev_id, prev_last = await self._last_snapshot(con)
+                last = int(await con.fetchval("SELECT COALESCE(MAX(id), 0) FROM stock_moves"))
+                if prev_id and last == prev_last:
+                    return None
+                sid = await con.fetchval(
+                    "INSERT INTO stock_snapshots(last_move_id) VALUES($1) RETURNING id", last,
+                )
+                await con.execute(
+                    f"INSERT INTO stock_snapshot_items(snapshot_id, product_id, stock) "
+                    f"SELECT $4, product_id, q FROM ({LEDGER_SINCE_SNAPSHOT_SQL}) l",
+                    prev_id, prev_last, last, sid,
+                )
+        return int(sid)
+
+    async def stock_at(self, pid: int, at: Optional[str] = None) -> int:
+        at = datetime.datetime.fromisoformat(at) if at else datetime.datetime.max
+        async with self.pool.acquire() as con:
+            sid, last = await self._last_snapshot(con, at)
+            base = await con.fetchval(
+                "SELECT stock FROM stock_snapshot_items WHERE snapshot_id=$1 AND product_id=$2", sid, int(pid),
+            )
+            since = await con.fetchval(
+                "SELECT COALESCE(SUM(delta), 0) FROM stock_moves WHERE product_id=$1 AND id>$2 AND created_at<=$3",
+                int(pid), last, at,
+            )
+        return int(base or 0) + int(since)
+
+    async def stock_moves(self, pid: int, before_id: Optional[int] = None, limit: int = 50):
+        rows = await self.pool.fetch(
+            "SELECT id, delta, reason, user_id, order_id, created_at FROM stock_moves "
+            "WHERE product_id=$1 AND id<$2 ORDER BY id DESC LIMIT $3",
+            int(pid), int(before_id) if before_id else 2 ** 62, int(limit),
+        )
+        # created_at — как у SQLite: 'YYYY-MM-DD HH:MM:SS'
+        return [(*tuple(r)[:-1], r["created_at"].isoformat(sep=" ", timespec="seconds")) for r in rows]
+
+    async def stock_reconcile(self):
+        async with self.pool.acquire() as con:
+            async with con.transaction(isolation="repeatable_read"):
+                # до первого SELECT: склад и журнал читаем из одного и того же состояния
+                await con.execute("LOCK TABLE stock_moves IN SHARE MODE")
+                sid, last = await self._last_snapshot(con)
+                top = int(await con.fetchval("SELECT COALESCE(MAX(id), 0) FROM stock_moves"))
+                ledger = {int(r[0]): int(r[1]) for r in await con.fetch(LEDGER_SINCE_SNAPSHOT_SQL, sid, last, top)}
+                products = await con.fetch("SELECT id, title, stock FROM products ORDER BY id")
+        out = []
+        for pid, title, stock in products:
+            expected = ledger.pop(int(pid), 0)
+            if int(stock) != expected:
+                out.append((int(pid), title, int(stock), expected))
+        out += [(pid, None, None, q) for pid, q in sorted(ledger.items()) if q != 0]
+        return out
@@ -0,0 +1,81 @@
+import asyncio
+import time
+
+from aiogram import Bot
+
+from broadcast import SendLimiter, send_with_retry
+
+
+class StockAlerts:
+    """
+    «Сообщить о поступлении». Склад не опрашиваем: слушаем events.stock_changed
+    и, когда товар появился (0 -> больше 0), рассылаем подписчикам уведомление
+    в ровном темпе rate сообщений/с. Одна рассылка на товар за раз; подписка
+    удаляется после отправки.
+
+    render(user_id, product) -> (text, reply_markup) — текст на языке пользователя.
+    limiter — общий темп массовых отправок бота (broadcast.SendLimiter): рассылки по
+    нескольким товарам и обычная рассылка вместе не превышают лимит Telegram.
+    """
+
+    def __init__(self, store, render, rate: float, limiter: SendLimiter = None, batch: int = 100):
+        self.store = store
+        self.render = render
+        self.rate = rate
+        self.limiter = limiter
+        self.batch = batch
+        self.bot = None
+        self._tasks = {}  # product_id -> asyncio.Task
+
+        self.runs = 0
+        self.counts = {"delivered": 0, "blocked": 0, "failed": 0}
+
+    def attach(self, bot: Bot):
+        """
+        Бот, от имени которого шлём. on_stock_changed подключает к events.stock_changed main():
+        через loop.call_soon_threadsafe (события приходят и из потока SQLite) и с маршрутизацией по магазину.
+        """
+        self.bot = bot
+
+    def on_stock_changed(self, pid: int, old: int, new: int):
+        if self.bot is None or old > 0 or new <= 0:
+            return
+        task = self._tasks.get(pid)
+        if task and not task.done():
+            return
+        task = asyncio.create_task(self._fan_out(pid))
+        self._tasks[pid] = task
+        task.add_done_callback(lambda t: self._tasks.pop(pid, None) if self._tasks.get(pid) is t else None)
+
+    async def _fan_out(self, pid: int):
+        self.runs += 1
+        interval = 1.0 / self.rate if self.rate > 0 else 0.0
+        next_at = time.monotonic()
+
+        while True:
+            # товар могли снова раскупить — остальные подписчики ждут следующего поступления
+            product = await self.store.get_product(pid)
+            if not product or product[4] <= 0:
+                return
+
+            uids = await self.store.stock_subscribers(pid, 0, self.batch)
+            if not uids:
+                return
+
+            for uid in uids:
+                delay = next_at - time.monotonic()
+                if delay > 0:
+                    await asyncio.sleep(delay)
+                next_at = max(next_at, time.monotonic()) + interval
+
+                text, markup = await self.render(uid, product)
+                self.counts[await send_with_retry(self.bot, uid, text, self.limiter, reply_markup=markup)] += 1
+
+            await self.store.stock_unsubscribe(pid, uids)
+
+    async def wait_idle(self):
+        while self._tasks:
+            await asyncio.gather(*list(self._tasks.values()), return_exceptions=True)
+
+    def stats(self) -> dict:
+        return {"active": len(self._tasks), "runs": self.runs, **self.counts}
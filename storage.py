@@ -0,0 +1,228 @@
+"""
+Слой хранения за единым async-интерфейсом.
+
+Storage — набор операций над товарами, корзиной, заказами, настройками, рассылками,
+подписками на поступление товара и журналом движений склада.
+Хендлеры работают только с ним, а конкретная реализация выбирается по STORAGE_URL:
+    sqlite:///shop.db            -> SqliteStorage (db.py, по умолчанию)
+    postgresql://user:pw@host/db -> PostgresStorage (pg_storage.py, asyncpg)
+
+Все методы возвращают те же кортежи, что и функции db.py.
+"""
+import asyncio
+import contextvars
+import functools
+from abc import ABC, abstractmethod, update_abstractmethods
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import List, Optional
+
+import db
+
+
+class Storage(ABC):
+    kind = "abstract"
+
+    @abstractmethod
+    async def init(self): ...
+    async def close(self): pass
+
+    # ---------- Products ----------
+    @abstractmethod
+    async def add_product(self, category, title, price_cents, stock, photo_file_id=None): ...
+    @abstractmethod
+    async def list_categories(self) -> List[str]: ...
+    @abstractmethod
+    async def list_products(self, category): ...
+    @abstractmethod
+    async def get_product(self, pid): ...
+    @abstractmethod
+    async def product_window(self, pid, radius): ...
+    @abstractmethod
+    async def products_all(self): ...
+    @abstractmethod
+    async def product_set_stock(self, pid: int, stock: int, user_id: Optional[int] = None) -> int:
+        ...
+    @abstractmethod
+    async def product_stock_delta(self, pid: int, delta: int, user_id: Optional[int] = None) -> int:
+        ...
+    @abstractmethod
+    async def product_set_price(self, pid: int, price_cents: int) -> int: ...
+    @abstractmethod
+    async def product_delete(self, pid: int) -> bool: ...
+
+    # ---------- Cart ----------
+    @abstractmethod
+    async def cart_items(self, user_id): ...
+    @abstractmethod
+    async def cart_add_reserve(self, user_id: int, pid: int, qty: int) -> int: ...
+    @abstractmethod
+    async def cart_remove_return(self, user_id: int, pid: int, qty: int) -> int: ...
+    @abstractmethod
+    async def cart_clear_return(self, user_id: int): ...
+    @abstractmethod
+    async def stale_cart_users(self, minutes: int = 30) -> List[int]: ...
+    @abstractmethod
+    async def release_cart(self, user_id: int): ...
+
+    # ---------- Orders ----------
+    @abstractmethod
+    async def create_order(self, user_id, name, phone, address, pay_method, tg_username=None, tg_name=None):
+        ...
+    @abstractmethod
+    async def get_order(self, order_id: int): ...
+    @abstractmethod
+    async def set_order_status(self, order_id: int, status: str): ...
+    @abstractmethod
+    async def restock_order(self, order_id: int): ...
+    @abstractmethod
+    async def cancel_order(self, order_id: int): ...
+    @abstractmethod
+    async def list_orders(self, status: str = "new", limit: int = 20): ...
+    @abstractmethod
+    async def order_items_full(self, order_id: int): ...
+    @abstractmethod
+    async def orders_brief(self, order_ids: List[int]): ...
+    @abstractmethod
+    async def user_orders_page(self, user_id: int, before_id: Optional[int] = None, limit: int = 5):
+        ...
+    @abstractmethod
+    async def order_items_batch(self, order_ids: List[int]): ...
+    @abstractmethod
+    async def set_orders_status_bulk(self, order_ids: List[int], status: str, restock: bool = False):
+        ...
+    @abstractmethod
+    async def order_item_delta(self, order_id: int, product_id: int, delta: int): ...
+
+    # ---------- Settings ----------
+    @abstractmethod
+    async def set_setting(self, key: str, value: str): ...
+    @abstractmethod
+    async def get_setting(self, key: str) -> Optional[str]: ...
+
+    # ---------- Broadcasts ----------
+    @abstractmethod
+    async def broadcast_create(self, text: str, created_by: int): ...
+    @abstractmethod
+    async def broadcast_get(self, bid: int): ...
+    @abstractmethod
+    async def broadcast_running(self): ...
+    @abstractmethod
+    async def broadcast_last(self): ...
+    @abstractmethod
+    async def broadcast_recipients(self, bid: int, after_user_id: int, limit: int = 100) -> List[int]:
+        ...
+    @abstractmethod
+    async def broadcast_checkpoint(self, bid: int, last_user_id: int, delivered: int, blocked: int, failed: int):
+        ...
+    @abstractmethod
+    async def broadcast_finish(self, bid: int, status: str = "done"): ...
+
+    # ---------- Stock subscriptions ----------
+    @abstractmethod
+    async def stock_subscribe(self, pid: int, user_id: int) -> bool: ...
+    @abstractmethod
+    async def stock_subscribers(self, pid: int, after_user_id: int = 0, limit: int = 100) -> List[int]:
+        ...
+    @abstractmethod
+    async def stock_unsubscribe(self, pid: int, user_ids: List[int]): ...
+
+    # ---------- Stock ledger ----------
+    @abstractmethod
+    async def stock_snapshot(self) -> Optional[int]: ...
+    @abstractmethod
+    async def stock_at(self, pid: int, at: Optional[str] = None) -> int: ...
+    @abstractmethod
+    async def stock_moves(self, pid: int, before_id: Optional[int] = None, limit: int = 50):
+        ...
+    @abstractmethod
+    async def stock_reconcile(self): ...
+
+
+def _delegate(name):
+    fn = getattr(db, name)
+
+    @functools.wraps(fn)
+    async def method(self, *args, **kwargs):
+        return await self.run(fn, *args, **kwargs)
+
+    return method
+
+
+class SqliteStorage(Storage):
+    """
+    Текущий db.py за async-интерфейсом. Обращения к одной базе идут строго по одному:
+    единственный писатель (как и раньше — без гонок read-then-write и без
+    "database is locked"), но event loop при этом не ждёт диск.
+
+    По умолчанию у базы свой поток. Магазинам (tenants.py) отдаётся общий executor
+    на несколько потоков, а очередь к каждой базе держит свой asyncio.Lock —
+    так сотня магазинов не означает сотню потоков.
+    """
+
+    kind = "sqlite"
+
+    def __init__(self, path: Optional[Path] = None, executor: Optional[ThreadPoolExecutor] = None):
+        self.path = Path(path) if path else None
+        self._shared = executor is not None
+        self._executor = executor or ThreadPoolExecutor(max_workers=1, thread_name_prefix="sqlite")
+        self._lock = asyncio.Lock() if self._shared else None
+
+    async def run(self, fn, *args, **kwargs):
+        # copy_context — чтобы contextvars хендлера были видны и в потоке
+        ctx = contextvars.copy_context()
+        if self.path:
+            ctx.run(db.DB_PATH_CTX.set, self.path)
+        call = functools.partial(ctx.run, fn, *args, **kwargs)
+        if self._lock is None:
+            return await asyncio.get_running_loop().run_in_executor(self._executor, call)
+        async with self._lock:
+            return await asyncio.get_running_loop().run_in_executor(self._executor, call)
+
+    async def init(self):
+        if self.path:
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+        await self.run(db.init_db)
+
+    async def close(self):
+        if not self._shared:
+            self._executor.shutdown(wait=True)
+
+
+# Методы SqliteStorage один в один повторяют функции db.py
+for _name in (
+    "add_product", "list_categories", "list_products", "get_product", "product_window", "products_all",
+    "product_set_stock", "product_stock_delta", "product_set_price", "product_delete",
+    "cart_items", "cart_add_reserve", "cart_remove_return", "cart_clear_return",
+    "stale_cart_users", "release_cart",
+    "create_order", "get_order", "set_order_status", "restock_order", "cancel_order",
+    "list_orders", "order_items_full", "orders_brief", "set_orders_status_bulk", "order_item_delta",
+    "user_orders_page", "order_items_batch",
+    "set_setting", "get_setting",
+    "broadcast_create", "broadcast_get", "broadcast_running", "broadcast_last",
+    "broadcast_recipients", "broadcast_checkpoint", "broadcast_finish",
+    "stock_subscribe", "stock_subscribers", "stock_unsubscribe",
+    "stock_snapshot", "stock_at", "stock_moves", "stock_reconcile",
+):
+    setattr(SqliteStorage, _name, _delegate(_name))
+del _name
+update_abstractmethods(SqliteStorage)  # методы добавлены циклом выше, после создания класса
+
+
+def create_storage(url: str, schema: Optional[str] = None, executor: Optional[ThreadPoolExecutor] = None,
+                   pool_size: Optional[int] = None) -> Storage:
+    """
+    schema — схема PostgreSQL (магазины в одной базе), executor — общий пул потоков
+    для SQLite-магазинов, pool_size — max соединений PostgreSQL на магазин.
+    """
+    url = (url or "").strip()
+    if url.startswith(("postgres://", "postgresql://")):
+        from pg_storage import PostgresStorage
+        if pool_size:
+            return PostgresStorage(url, min_size=1, max_size=pool_size, schema=schema)
+        return PostgresStorage(url, schema=schema)
+    if url.startswith("sqlite:///"):
+        return SqliteStorage(Path(url[len("sqlite:///"):]), executor)
+    if url:
+        raise ValueError(f"Unsupported STORAGE_URL: {url}")
+    return SqliteStorage()
@@ -0,0 +1,124 @@
+"""
+Несколько магазинов (ботов) в одном процессе.
+
+Каждый магазин — Tenant: свой Bot, своё хранилище (файл SQLite или схема PostgreSQL),
+свои ADMIN_IDS / CURRENCY и свои кэши. Текущий магазин лежит в ContextVar CURRENT:
+его ставит middlewares.TenantMiddleware по боту, получившему апдейт, а фоновые задачи
+запускаются через within(tenant, ...). Всё, что создано из хендлера (таймеры, задачи,
+вызовы в поток SQLite), наследует контекст и видит тот же магазин.
+
+Файл магазинов (TENANTS_FILE), JSON-список:
+    [
+      {"name": "tea", "token": "123:AAA", "storage_url": "sqlite:///shops/tea.db",
+       "admin_ids": [111], "currency": "EUR"},
+      {"name": "coffee", "token": "456:BBB", "storage_url": "postgresql://u:p@host/shops",
+       "schema": "coffee", "admin_ids": [222], "currency": "USD"}
+    ]
+Без TENANTS_FILE работает один магазин из BOT_TOKEN / STORAGE_URL / ADMIN_IDS / CURRENCY.
+"""
+import json
+import re
+from contextvars import ContextVar
+from pathlib import Path
+from typing import List, Optional
+
+CURRENT: ContextVar["Tenant"] = ContextVar("tenant")
+_DEFAULT: Optional["Tenant"] = None
+
+
+class Tenant:
+    def __init__(self, name: str, token: str, store, admin_ids: set, currency: str):
+        self.name = name
+        self.token = token
+        self.store = store
+        self.admin_ids = admin_ids
+        self.currency = currency
+        self.bot = None  # создаётся в main(), когда уже есть event loop
+
+        # кэши магазина (main.make_tenant добавляет остальные)
+        self.user_lang = {}
+        self.waiting_channel = set()
+        self.last_ui_msg = {}  # user_id -> message_id
+
+
+def set_default(tenant: Tenant):
+    """Магазин вне контекста апдейта (один магазин, импорт main, CLI-скрипты)."""
+    global _DEFAULT
+    _DEFAULT = tenant
+
+
+def current() -> Tenant:
+    tenant = CURRENT.get(_DEFAULT)
+    if tenant is None:
+        raise RuntimeError("no current tenant")
+    return tenant
+
+
+async def within(tenant: Tenant, coro):
+    """Выполнить корутину от имени магазина. Использовать как create_task(within(t, worker()))."""
+    CURRENT.set(tenant)  # у задачи своя копия контекста — соседей не задевает
+    return await coro
+
+
+class TenantAttr:
+    """
+    Глобальное имя (STORE, ADMIN_IDS, USER_LANG, ...), которое обращается
+    к одноимённому атрибуту текущего магазина. Хендлеры main.py остаются как были.
+    """
+
+    __slots__ = ("_attr",)
+
+    def __init__(self, attr: str):
+        self._attr = attr
+
+    def _target(self):
+        return getattr(current(), self._attr)
+
+    def __getattr__(self, item):
+        return getattr(self._target(), item)
+
+    def __contains__(self, item):
+        return item in self._target()
+
+    def __getitem__(self, key):
+        return self._target()[key]
+
+    def __setitem__(self, key, value):
+        self._target()[key] = value
+
+    def __delitem__(self, key):
+        del self._target()[key]
+
+    def __iter__(self):
+        return iter(self._target())
+
+    def __len__(self):
+        return len(self._target())
+
+    def __bool__(self):
+        return bool(self._target())
+
+    def __repr__(self):
+        return f"<TenantAttr {self._attr}>"
+
+
+def load_config(path: Path) -> List[dict]:
+    """Читает и проверяет файл магазинов. Ошибки — ValueError с понятным текстом."""
+    items = json.loads(Path(path).read_text(encoding="utf-8"))
+    if not isinstance(items, list) or not items:
+        raise ValueError(f"{path}: expected a non-empty JSON list of shops")
+
+    names, tokens = set(), set()
+    for i, item in enumerate(items):
+        for key in ("name", "token", "storage_url"):
+            if not item.get(key):
+                raise ValueError(f"{path}: shop #{i} has no '{key}'")
+        if item["name"] in names:
+            raise ValueError(f"{path}: duplicate shop name '{item['name']}'")
+        if item.get("schema") and not re.fullmatch(r"[a-z_][a-z0-9_]*", item["schema"]):
+            raise ValueError(f"{path}: shop '{item['name']}' has an invalid schema name")
+        if item["token"] in tokens:
+            raise ValueError(f"{path}: shop '{item['name']}' reuses a bot token")
+        names.add(item["name"])
+        tokens.add(item["token"])
+    return items
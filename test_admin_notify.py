@@ -0,0 +1,63 @@
+"""
+OrderDigest: накопление заказов и отправка дайджестом.
+
+    python -m pytest -q test_admin_notify.py
+"""
+import asyncio
+
+from admin_notify import PENDING_KEY, OrderDigest, load_digest
+
+
+class MemoryStore:
+    """settings в памяти; каждый вызов уступает loop, как настоящий Storage."""
+
+    def __init__(self):
+        self.settings = {}
+
+    async def get_setting(self, key):
+        await asyncio.sleep(0)
+        return self.settings.get(key)
+
+    async def set_setting(self, key, value):
+        await asyncio.sleep(0)
+        self.settings[key] = value
+
+
+def test_add_during_flush_gets_own_timer():
+    async def scenario():
+        store = MemoryStore()
+        digest = OrderDigest(store, rate_per_min=0, window=0.01)
+        sent = []
+        sending = asyncio.Event()
+
+        async def flush(digest_id, ids):
+            sent.append(ids)
+            sending.set()
+            await asyncio.sleep(0.05)  # медленная отправка админам
+
+        await digest.add(1, flush)
+        await sending.wait()
+        await digest.add(2, flush)  # пришёл, пока уходит первый дайджест
+        await asyncio.sleep(0.2)  # оба окна и обе отправки позади
+        assert sent == [[1], [2]]
+        assert await load_digest(store, 2) == [2]
+        assert store.settings[PENDING_KEY] == ""
+
+    asyncio.run(scenario())
+
+
+def test_resume_flushes_pending_from_settings():
+    async def scenario():
+        store = MemoryStore()
+        store.settings[PENDING_KEY] = "5,7"
+        digest = OrderDigest(store, rate_per_min=0, window=60)
+        sent = []
+
+        async def flush(digest_id, ids):
+            sent.append((digest_id, ids))
+
+        await digest.resume(flush)
+        await digest._timer
+        assert sent == [(5, [5, 7])] and store.settings[PENDING_KEY] == ""
+
+    asyncio.run(scenario())
@@ -0,0 +1,52 @@
+"""
+Перенос старых заказов в архивную базу (db.archive_orders_batch).
+
+    python -m pytest -q test_archive.py
+"""
+import sqlite3
+
+import pytest
+
+import db
+
+
+@pytest.fixture
+def shop(tmp_path, monkeypatch):
+    monkeypatch.setattr(db, "DB_PATH", tmp_path / "shop.db")
+    db.init_db()
+    db.add_product("Tea", "Green", 350, 10)
+    pid = db.list_products("Tea")[0][0]
+    ids = []
+    for uid in (1, 2):
+        db.cart_add_reserve(uid, pid, 2)
+        oid, _, _ = db.create_order(uid, "N", "P", "A", "cash")
+        ids.append(oid)
+    db.set_orders_status_bulk(ids, "accepted")
+    with db.connect() as con:
+        con.execute("UPDATE orders SET created_at='2000-01-01T00:00:00'")
+        con.commit()
+    return ids
+
+
+def archived_items():
+    with sqlite3.connect(db.archive_path()) as con:
+        return con.execute("SELECT order_id, qty FROM order_items ORDER BY order_id").fetchall()
+
+
+def test_rerun_of_half_applied_batch_does_not_duplicate(shop):
+    assert db.archive_orders_batch(30) == 2
+    items = archived_items()
+    assert [r[0] for r in items] == shop
+
+    # сбой посреди commit: архив зафиксирован, а горячая база — нет
+    with db.connect() as con:
+        con.execute("ATTACH DATABASE ? AS archive", (str(db.archive_path()),))
+        con.execute(f"INSERT INTO main.orders({db.ORDER_COLS}) SELECT {db.ORDER_COLS} FROM archive.orders")
+        con.execute(f"INSERT INTO main.order_items({db.ITEM_COLS}) SELECT {db.ITEM_COLS} FROM archive.order_items")
+        con.commit()
+
+    assert db.archive_orders_batch(30) == 2
+    assert archived_items() == items
+    assert db.archive_orders_batch(30) == 0
+    page = db.user_orders_page(1, None, 5)
+    assert [r[0] for r in page] == [shop[0]]
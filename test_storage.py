@@ -0,0 +1,270 @@
+"""
+Общий набор тестов бэкендов Storage: одни и те же сценарии для SQLite и PostgreSQL.
+
+    python -m pytest -q test_storage.py                      # SQLite во временном файле
+    STORAGE_TEST_DSN=postgresql://postgres:pw@localhost/shop_check python -m pytest -q test_storage.py
+
+PostgreSQL-вариант пропускается без STORAGE_TEST_DSN. Каждый тест работает в своей
+одноразовой схеме (как магазин в tenants.py) и удаляет её после себя, например:
+    docker run --rm -e POSTGRES_PASSWORD=pw -e POSTGRES_DB=shop_check -p 5432:5432 postgres:16
+"""
+import asyncio
+import os
+import uuid
+
+import pytest
+
+import events
+from storage import create_storage
+
+PG_DSN = os.getenv("STORAGE_TEST_DSN", "")
+
+BACKENDS = [
+    "sqlite",
+    pytest.param("postgres", marks=pytest.mark.skipif(not PG_DSN, reason="STORAGE_TEST_DSN is not set")),
+]
+
+
+@pytest.fixture(params=BACKENDS)
+def run(request, tmp_path):
+    """run(scenario) — выполнить async scenario(store) на чистом хранилище выбранного бэкенда."""
+
+    def runner(scenario):
+        async def go():
+            schema = None
+            if request.param == "postgres":
+                schema = f"test_{uuid.uuid4().hex[:12]}"
+                store = create_storage(PG_DSN, schema)
+            else:
+                store = create_storage(f"sqlite:///{tmp_path / 'test.db'}")
+            await store.init()
+            try:
+                await scenario(store)
+            finally:
+                if schema:
+                    await store.pool.execute(f'DROP SCHEMA "{schema}" CASCADE')
+                await store.close()
+
+        asyncio.run(go())
+
+    return runner
+
+
+@pytest.fixture
+def seen():
+    """events.stock_changed за время теста: (product_id, old, new)."""
+    got = []
+
+    def listener(*args):
+        got.append(args)
+
+    events.stock_changed.connect(listener)
+    yield got
+    events.stock_changed.disconnect(listener)
+
+
+async def seed(store):
+    """Green (10 шт.), Black (нет в наличии) в Tea и Beans (3 шт., с фото) в Coffee."""
+    await store.add_product("Tea", "Green", 350, 10)
+    await store.add_product("Tea", "Black", 300, 0)
+    await store.add_product("Coffee", "Beans", 1200, 3, "photo-1")
+    tea = await store.list_products("Tea")
+    green = next(t[0] for t in tea if t[1] == "Green")
+    black = next(t[0] for t in tea if t[1] == "Black")
+    beans = (await store.list_products("Coffee"))[0][0]
+    return green, black, beans
+
+
+async def stock(store, pid):
+    return (await store.get_product(pid))[4]
+
+
+# ---------- products ----------
+def test_products(run):
+    async def scenario(store):
+        assert await store.list_categories() == []
+        green, black, beans = await seed(store)
+        assert await store.list_categories() == ["Coffee", "Tea"]
+        tea = await store.list_products("Tea")
+        assert [t[1] for t in tea] == ["Black", "Green"] and len(tea[0]) == 4
+        assert await store.get_product(beans) == (beans, "Coffee", "Beans", 1200, 3, "photo-1")
+        assert await store.get_product(10_000) is None
+
+        assert [r[0] for r in await store.product_window(black, 1)] == [black, green]
+        assert (await store.product_window(green, 5))[1] == await store.get_product(green)
+        assert await store.product_window(10_000, 2) == []
+
+    run(scenario)
+
+
+# ---------- cart ----------
+def test_cart(run, seen):
+    async def scenario(store):
+        green, black, beans = await seed(store)
+        assert await store.cart_add_reserve(1, black, 1) == 0
+        assert await store.cart_add_reserve(1, beans, 5) == 3
+        assert await stock(store, beans) == 0
+        assert await store.cart_add_reserve(1, green, 2) == 2
+        assert await store.cart_add_reserve(1, green, 1) == 1
+        assert await store.cart_items(1) == [(beans, "Beans", 1200, 3), (green, "Green", 350, 3)]
+        assert await store.cart_remove_return(1, beans, 1) == 1 and await stock(store, beans) == 1
+        assert await store.cart_remove_return(1, beans, 10) == 2
+
+        # параллельный резерв: на складе 7 Green, 20 покупателей по 1 — продано ровно 7
+        got = await asyncio.gather(*(store.cart_add_reserve(100 + i, green, 1) for i in range(20)))
+        assert sum(got) == 7 and await stock(store, green) == 0
+        for i in range(20):
+            await store.cart_clear_return(100 + i)
+        assert await stock(store, green) == 7
+        assert await store.stale_cart_users(30) == []
+
+        await store.cart_add_reserve(2, beans, 1)
+        await store.release_cart(2)
+        assert await store.cart_items(2) == [] and await stock(store, beans) == 3
+        assert seen[-1] == (beans, 2, 3)
+
+    run(scenario)
+
+
+# ---------- orders ----------
+def test_orders(run):
+    async def scenario(store):
+        green, black, beans = await seed(store)
+        assert await store.create_order(3, "N", "P", "A", "cash") is None
+        await store.cart_add_reserve(3, green, 2)
+        await store.cart_add_reserve(3, beans, 1)
+        oid, total, items = await store.create_order(3, "Ann", "+1", "Street", "cash", "ann", "Ann A")
+        assert total == 2 * 350 + 1200 and len(items) == 2
+        assert await store.cart_items(3) == []
+        assert await store.get_order(oid) == (oid, 3, "new", "ann", "Ann A", "Ann", "+1", "Street", "cash", total)
+        assert [o[0] for o in await store.list_orders("new")] == [oid]
+        assert await store.order_items_full(oid) == [(beans, "Beans", 1200, 1), (green, "Green", 350, 2)]
+
+        assert await store.order_item_delta(oid, green, 1) == (True, 3, 3 * 350 + 1200, "ok")
+        assert (await store.order_item_delta(oid, beans, 100))[3] == "no_stock"
+        assert await store.order_item_delta(oid, beans, -1) == (True, 0, 3 * 350, "ok")
+        assert (await store.order_item_delta(oid, beans, 1))[3] == "item_not_found"
+
+        await store.cart_add_reserve(4, green, 1)
+        oid2, _, _ = await store.create_order(4, "Bob", "+2", "Road", "cash")
+        await store.cart_add_reserve(5, green, 1)
+        oid3, _, _ = await store.create_order(5, "Cid", "+3", "Lane", "cash")
+        assert [r[0] for r in await store.orders_brief([oid3, oid2])] == [oid2, oid3]
+        before = await stock(store, green)
+        changed = await store.set_orders_status_bulk([oid2, oid3, oid], "declined", restock=True)
+        assert changed == [(oid, 3), (oid2, 4), (oid3, 5)]
+        assert await stock(store, green) == before + 3 + 1 + 1
+        assert await store.set_orders_status_bulk([oid], "accepted") == []
+
+        await store.cart_add_reserve(3, beans, 1)
+        oid5, _, _ = await store.create_order(3, "Ann", "+1", "Street", "cash")
+        page = await store.user_orders_page(3, None, 1)
+        assert [r[0] for r in page] == [oid5] and len(page[0]) == 4
+        assert [r[0] for r in await store.user_orders_page(3, oid5, 5)] == [oid]
+        items = await store.order_items_batch([oid, oid5])
+        assert [(r[0], r[2]) for r in items] == [(oid5, "Beans"), (oid, "Green")]
+        await store.cancel_order(oid5)
+
+        await store.cart_add_reserve(6, beans, 1)
+        oid4, _, _ = await store.create_order(6, "Dan", "+4", "Way", "cash")
+        await store.cancel_order(oid4)
+        assert (await store.get_order(oid4))[2] == "cancelled" and await stock(store, beans) == 3
+
+    run(scenario)
+
+
+# ---------- products admin / stock subscriptions ----------
+def test_admin_and_subscriptions(run, seen):
+    async def scenario(store):
+        green, black, beans = await seed(store)
+        assert await store.stock_subscribe(black, 9) and await store.stock_subscribe(black, 8)
+        assert await store.stock_subscribe(black, 9) is False
+        assert await store.stock_subscribers(black) == [8, 9]
+        assert await store.stock_subscribers(black, 8) == [9]
+
+        n = len(seen)
+        assert await store.product_set_stock(black, -5) == 0
+        assert len(seen) == n  # без роста склада события нет
+        assert await store.product_stock_delta(black, 4, user_id=1) == 4
+        assert seen[n:] == [(black, 0, 4)]
+        await store.stock_unsubscribe(black, [8])
+        assert await store.stock_subscribers(black) == [9]
+        assert await store.product_stock_delta(10_000, 1) == -1
+        assert await store.product_set_price(black, 999) == 999
+        await store.product_delete(black)
+        assert await store.get_product(black) is None and await store.stock_subscribers(black) == []
+
+    run(scenario)
+
+
+# ---------- stock ledger ----------
+def test_ledger(run):
+    async def scenario(store):
+        green, black, beans = await seed(store)
+        await store.cart_add_reserve(1, beans, 3)                 # reserve
+        await store.cart_remove_return(1, beans, 1)               # cart_return
+        await store.cart_remove_return(1, beans, 10)              # cart_return
+        await store.cart_add_reserve(2, beans, 1)
+        await store.release_cart(2)                               # cart_expired
+        await store.cart_add_reserve(3, beans, 2)
+        oid, _, _ = await store.create_order(3, "Ann", "+1", "Street", "cash")
+        await store.order_item_delta(oid, beans, -1)              # order_edit
+        await store.set_orders_status_bulk([oid], "declined", restock=True)  # order_restock
+        await store.product_stock_delta(black, 4)
+        await store.product_delete(black)                         # deleted
+
+        assert await store.stock_reconcile() == []
+        reasons = [m[2] for m in reversed(await store.stock_moves(beans, limit=100))]
+        assert reasons[:4] == ["added", "reserve", "cart_return", "cart_return"]
+        assert {"cart_expired", "order_edit", "order_restock"} <= set(reasons)
+        page = await store.stock_moves(beans, limit=2)
+        assert len(page) == 2 and len(page[0]) == 6
+        assert (await store.stock_moves(beans, page[-1][0], 1))[0][0] < page[-1][0]
+
+        assert await store.stock_at(beans) == 3
+        assert await store.stock_at(green) == await stock(store, green)
+        assert await store.stock_at(beans, "2000-01-01 00:00:00") == 0
+        assert await store.stock_at(black) == 0
+
+        assert await store.stock_snapshot() is not None
+        assert await store.stock_snapshot() is None  # движений не было — снимок не нужен
+        await store.product_set_stock(beans, 10, user_id=1)
+        assert await store.stock_at(beans) == 10
+        assert (await store.stock_moves(beans, limit=1))[0][1:4] == (7, "admin_set", 1)
+        assert await store.stock_reconcile() == []
+
+    run(scenario)
+
+
+# ---------- settings ----------
+def test_settings(run):
+    async def scenario(store):
+        await store.set_setting("lang:7", "de")
+        await store.set_setting("lang:7", "ru")
+        assert await store.get_setting("lang:7") == "ru"
+        assert await store.get_setting("nope") is None
+
+    run(scenario)
+
+
+# ---------- broadcasts ----------
+def test_broadcasts(run):
+    async def scenario(store):
+        green, black, beans = await seed(store)
+        for uid in (1, 4, 7):
+            await store.set_setting(f"lang:{uid}", "ru")
+        await store.cart_add_reserve(3, green, 1)              # получатель из корзины
+        await store.cart_add_reserve(6, green, 1)
+        await store.create_order(6, "Dan", "+4", "Way", "cash")  # ... и из заказов
+
+        bid, total = await store.broadcast_create("hello", 1)
+        assert total == 5
+        assert await store.broadcast_recipients(bid, 0, 3) == [1, 3, 4]
+        assert await store.broadcast_create("again", 1) is None
+        await store.broadcast_checkpoint(bid, 4, 3, 0, 0)
+        assert await store.broadcast_recipients(bid, 4) == [6, 7]
+        await store.broadcast_finish(bid, "cancelled")
+        assert (await store.broadcast_last())[3] == "cancelled"
+        assert await store.broadcast_running() == []
+
+    run(scenario)
@@ -23,4 +23,20 @@ TEXT = {
     "admin_add_wizard": {"ru": "➕ Добавить товар (мастер)", "de": "➕ Produkt hinzufügen (Assistent)"},
     "admin_stock": {"ru": "📦 Остатки", "de": "📦 Bestand"},
     "admin_help": {"ru": "Команды админа:", "de": "Admin-Befehle:"},
+
+    "my_orders": {"ru": "📦 Мои заказы", "de": "📦 Meine Bestellungen"},
+    "no_orders": {"ru": "Заказов пока нет.", "de": "Noch keine Bestellungen."},
+    "older": {"ru": "⬇️ Раньше", "de": "⬇️ Ältere"},
+    "status_new": {"ru": "🕓 новый", "de": "🕓 neu"},
+    "status_accepted": {"ru": "✅ подтверждён", "de": "✅ bestätigt"},
+    "status_declined": {"ru": "❌ отклонён", "de": "❌ abgelehnt"},
+    "status_cancelled": {"ru": "🚫 отменён", "de": "🚫 storniert"},
+
+    "notify_me": {"ru": "🔔 Сообщить о поступлении", "de": "🔔 Bei Verfügbarkeit melden"},
+    "notify_ok": {"ru": "Готово! Напишу, как только товар появится.", "de": "Erledigt! Ich melde mich, sobald der Artikel da ist."},
+    "notify_in_stock": {"ru": "Товар уже в наличии 🙂", "de": "Der Artikel ist schon verfügbar 🙂"},
+    "back_in_stock": {"ru": "🔔 Снова в наличии: {title}", "de": "🔔 Wieder verfügbar: {title}"},
+    "open_product": {"ru": "👀 Открыть", "de": "👀 Ansehen"},
+    "prev": {"ru": "◀️", "de": "◀️"},
+    "next": {"ru": "▶️", "de": "▶️"},
 }